@@ -1,91 +1,96 @@
 # app.py
+import time
 import streamlit as st
 from src.config import AppConfig
+from src.services import metrics
 from src.services.logging import get_logger
-from src.services.bedrock import get_bedrock_client, call_bedrock
-from src.services.dynamodb_service import ConversationService
+from src.services.chat_gateway import ChatRequest
+from src.services.container import get_services
 from src.ui.layout import configure_page, render_header
 from src.ui.sidebar import render_sidebar
-from opentelemetry import trace
 from opentelemetry.context import Context
-from src.ui.chat import init_session, render_history, handle_input
+from src.ui.chat import current_user_id, init_session, render_history, handle_input, get_converse_history
 
+# 每次 rerun 的固定開銷：從這裡到服務就緒（chatbot.app.rerun.setup.duration）
+_rerun_start = time.perf_counter()
 cfg = AppConfig()
 
 # ⚠️ must be first Streamlit call
 configure_page(cfg)
 
-logger = get_logger()
-client = get_bedrock_client(cfg.aws_region)
-
-tracer = trace.get_tracer(__name__)
-
-# 初始化 DynamoDB 服務
+# 首次執行（startupProbe 的 script-health-check）時建立並預熱所有 client，之後的 rerun 只取回同一個 container
 try:
-    conv_service = ConversationService(
-        table_name=cfg.dynamodb_table_name,
-        region=cfg.aws_region
-    )
+    services = get_services(cfg)
 except Exception as e:
-    logger.error(f"Failed to initialize ConversationService: {e}")
-    st.error("Failed to initialize conversation service. Please check configuration.")
+    get_logger().error(f"Failed to initialize services: {e}")
+    st.error("Failed to initialize services. Please check configuration.")
     st.stop()
 
+logger = services.logger
+tracer = services.tracer
+conv_service = services.conv_service
+context_manager = services.context_manager
+gateway = services.gateway
+metrics.app_rerun_setup_duration.record((time.perf_counter() - _rerun_start) * 1000)
+
+user_id = current_user_id(cfg.user_id_header)
+
 render_header(cfg)
-avatars = render_sidebar(cfg, conv_service)
+avatars = render_sidebar(cfg, conv_service, user_id)
 
 # 檢查是否需要加載歷史會話
 load_session_id = st.session_state.pop("load_session_id", None)
-current_session_id = init_session(conv_service, session_id=load_session_id)
-
-render_history(avatars.user_avatar, avatars.bot_avatar)
+current_session_id = init_session(
+    conv_service,
+    session_id=load_session_id,
+    tail_messages=cfg.session_tail_messages,
+)
 
-def build_full_context(new_prompt: str) -> str:
-    """
-    將 session_state 中的對話紀錄轉換為 Claude 格式的 Prompt
-    """
-    formatted_history = ""
+render_history(
+    avatars.user_avatar,
+    avatars.bot_avatar,
+    conv_service=conv_service,
+    page_size=cfg.session_tail_messages,
+)
 
-    # 從 session_state 讀取歷史訊息 (預設為空 list)
-    messages = st.session_state.get("messages", [])
+def build_chat_request(prompt: str, span) -> ChatRequest:
+    """組出本輪的 ChatRequest（messages 已包含本輪 user 訊息，須在 span 內呼叫）"""
+    history = get_converse_history()
+    messages, stats = context_manager.build(current_session_id, history)
+    span.set_attribute("gen_ai.request.message_count", len(messages))
+    return ChatRequest(
+        prompt=prompt,
+        messages=messages,
+        session_id=current_session_id,
+        input_tokens=stats.sent_tokens,
+    )
 
-    for msg in messages:
-        role = msg["role"]
-        content = msg["content"]
+def on_user_prompt(prompt: str):
+    """處理用戶輸入並調用 Bedrock（串流模式回傳 text delta generator）"""
+    if cfg.stream_responses:
+        return stream_user_prompt(prompt)
 
-        # 依照 Claude 建議的 Prompt 格式拼接 (Human / Assistant)
-        if role == "user":
-            formatted_history += f"\n\nHuman: {content}"
-        elif role == "assistant":
-            formatted_history += f"\n\nAssistant: {content}"
+    with tracer.start_as_current_span("generate_response", context=Context()) as span:
 
-    # 最後加上使用者這次的新問題，並預留 Assistant 的回答空間
-    formatted_history += f"\n\nHuman: {new_prompt}\n\nAssistant:"
-    return formatted_history
+        # 記錄使用者當下的輸入 (方便除錯)
+        span.set_attribute("gen_ai.prompt", prompt)
+        span.set_attribute("gen_ai.session_id", current_session_id)
 
-def on_user_prompt(prompt: str) -> str:
-    """處理用戶輸入並調用 Bedrock"""
-    # 這裡呼叫上面的 helper function 取得「包含歷史的完整 Prompt」
-    full_context_prompt = build_full_context(prompt)
+        return gateway.complete(build_chat_request(prompt, span))
 
+def stream_user_prompt(prompt: str):
+    """串流版本：span 在 generator 消費完畢後才結束，才能記錄 TTFT 與 tokens/sec"""
     with tracer.start_as_current_span("generate_response", context=Context()) as span:
-
-        # 記錄使用者當下的輸入 (方便除錯)
         span.set_attribute("gen_ai.prompt", prompt)
         span.set_attribute("gen_ai.session_id", current_session_id)
+        span.set_attribute("gen_ai.streaming", True)
 
-        return call_bedrock(
-            full_context_prompt, # 👈 關鍵修改：傳送完整歷史，而不是只有 prompt
-            client=client,
-            model_id=cfg.model_id,
-            max_tokens=cfg.max_tokens,
-            temperature=cfg.temperature,
-            logger=logger,
-        )
+        yield from gateway.stream(build_chat_request(prompt, span))
 
 handle_input(
     user_avatar=avatars.user_avatar,
     bot_avatar=avatars.bot_avatar,
     on_user_prompt=on_user_prompt,
     conv_service=conv_service,
+    user_id=user_id,
 )
@@ -1,6 +1,7 @@
 from dataclasses import dataclass, field
 import os
 import streamlit as st
+from src.prompts import PromptOptions
 
 def get_url_from_env() -> str:
     """Helper function to fetch URL"""
@@ -9,6 +10,23 @@ def get_url_from_env() -> str:
     # 如果都沒設，回傳空字串 (代表使用相對路徑/本地路徑)
     return os.getenv("CLOUDFRONT_STATIC_URL", "").rstrip("/")
 
+def env_int(name: str, default: int) -> int:
+    """讀取整數型環境變數"""
+    value = os.getenv(name)
+    return int(value) if value else default
+
+def env_float(name: str, default: float) -> float:
+    """讀取浮點數型環境變數"""
+    value = os.getenv(name)
+    return float(value) if value else default
+
+def env_bool(name: str, default: bool) -> bool:
+    """讀取布林型環境變數 (1/true/yes/on 視為 True)"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
 @dataclass(frozen=True)
 class AppConfig:
     page_title: str = "Simple AI Chatbot"
@@ -16,21 +34,270 @@ class AppConfig:
     layout: str = "centered"
 
     aws_region: str = "ap-northeast-1"
+    # 多 region 容錯（逗號分隔，依偏好排序）；空字串表示只使用 aws_region
+    bedrock_regions: str = field(
+        default_factory=lambda: os.getenv("BEDROCK_REGIONS", "")
+    )
+    # 覆寫各 region 的端點，格式為 region=url,region=url（本地測試時指向 src.tools.fake_bedrock）
+    bedrock_endpoint_urls: str = field(
+        default_factory=lambda: os.getenv("BEDROCK_ENDPOINT_URLS", "")
+    )
     model_id: str = "amazon.nova-lite-v1:0"
 
+    # 模型分級路由（opt-in）：依問題複雜度選擇層級，偏好的模型被節流或 p95 超出預算時降級
+    model_router_enabled: bool = field(
+        default_factory=lambda: env_bool("MODEL_ROUTER_ENABLED", False)
+    )
+    # 由快到強排列，格式為 name=model_id,name=model_id
+    model_tiers: str = field(
+        default_factory=lambda: os.getenv(
+            "MODEL_TIERS",
+            "fast=amazon.nova-micro-v1:0,standard=amazon.nova-lite-v1:0,strong=amazon.nova-pro-v1:0",
+        )
+    )
+    # p95 延遲預算：串流模式比較首個 token 的延遲，阻塞模式比較整個呼叫的延遲
+    model_latency_budget_ms: float = field(
+        default_factory=lambda: env_float("MODEL_LATENCY_BUDGET_MS", 8000.0)
+    )
+
     max_tokens: int = 1000
     temperature: float = 0.7
 
+    # Bedrock client：連線池、逾時、重試與啟動預熱
+    bedrock_max_pool_connections: int = field(
+        default_factory=lambda: env_int("BEDROCK_MAX_POOL_CONNECTIONS", 50)
+    )
+    bedrock_connect_timeout: float = field(
+        default_factory=lambda: env_float("BEDROCK_CONNECT_TIMEOUT", 3.0)
+    )
+    bedrock_read_timeout: float = field(
+        default_factory=lambda: env_float("BEDROCK_READ_TIMEOUT", 60.0)
+    )
+    bedrock_max_attempts: int = field(
+        default_factory=lambda: env_int("BEDROCK_MAX_ATTEMPTS", 3)
+    )
+    bedrock_retry_mode: str = field(
+        default_factory=lambda: os.getenv("BEDROCK_RETRY_MODE", "adaptive")
+    )
+    bedrock_warmup_connections: int = field(
+        default_factory=lambda: env_int("BEDROCK_WARMUP_CONNECTIONS", 4)
+    )
+
+    # 每輪對話的 deadline（秒）：botocore 重試與等待回應都不會超過；0 表示不設
+    turn_deadline_seconds: float = field(
+        default_factory=lambda: env_float("TURN_DEADLINE_SECONDS", 30.0)
+    )
+    # 串流收到首個 token 後不再受 turn deadline 限制，改為限制事件之間的閒置時間（秒）；0 表示不限制
+    stream_idle_timeout_seconds: float = field(
+        default_factory=lambda: env_float("STREAM_IDLE_TIMEOUT_SECONDS", 15.0)
+    )
+    # 斷路器（依模型與 region）：連續失敗達門檻後開啟，冷卻期間直接回覆 fallback 訊息
+    circuit_breaker_enabled: bool = field(
+        default_factory=lambda: env_bool("CIRCUIT_BREAKER_ENABLED", True)
+    )
+    circuit_breaker_failure_threshold: int = field(
+        default_factory=lambda: env_int("CIRCUIT_BREAKER_FAILURE_THRESHOLD", 5)
+    )
+    circuit_breaker_open_seconds: float = field(
+        default_factory=lambda: env_float("CIRCUIT_BREAKER_OPEN_SECONDS", 30.0)
+    )
+
+    # Hedged request（opt-in，僅阻塞模式）：主請求超過最近延遲的 percentile 仍未完成時，
+    # 對備援 region / 模型再送一次；額外請求率不超過 max_ratio。
+    # 串流模式 (BEDROCK_STREAMING=true，預設) 不 hedge，啟動時會記錄警告
+    bedrock_hedge_enabled: bool = field(
+        default_factory=lambda: env_bool("BEDROCK_HEDGE_ENABLED", False)
+    )
+    # 空字串表示與主請求相同
+    bedrock_hedge_region: str = field(
+        default_factory=lambda: os.getenv("BEDROCK_HEDGE_REGION", "")
+    )
+    bedrock_hedge_model_id: str = field(
+        default_factory=lambda: os.getenv("BEDROCK_HEDGE_MODEL_ID", "")
+    )
+    bedrock_hedge_percentile: float = field(
+        default_factory=lambda: env_float("BEDROCK_HEDGE_PERCENTILE", 0.95)
+    )
+    bedrock_hedge_max_ratio: float = field(
+        default_factory=lambda: env_float("BEDROCK_HEDGE_MAX_RATIO", 0.05)
+    )
+    bedrock_hedge_min_delay_ms: float = field(
+        default_factory=lambda: env_float("BEDROCK_HEDGE_MIN_DELAY_MS", 1000.0)
+    )
+    bedrock_hedge_max_delay_ms: float = field(
+        default_factory=lambda: env_float("BEDROCK_HEDGE_MAX_DELAY_MS", 20000.0)
+    )
+
+    # 准入控制：每個 Pod 的 RPM / TPM 配額與同時呼叫數；預估排隊超過期限時直接拒絕
+    admission_enabled: bool = field(
+        default_factory=lambda: env_bool("ADMISSION_ENABLED", True)
+    )
+    bedrock_rpm_limit: int = field(
+        default_factory=lambda: env_int("BEDROCK_RPM_LIMIT", 200)
+    )
+    bedrock_tpm_limit: int = field(
+        default_factory=lambda: env_int("BEDROCK_TPM_LIMIT", 400_000)
+    )
+    bedrock_max_concurrency: int = field(
+        default_factory=lambda: env_int("BEDROCK_MAX_CONCURRENCY", 16)
+    )
+    admission_max_wait_seconds: float = field(
+        default_factory=lambda: env_float("ADMISSION_MAX_WAIT_SECONDS", 10.0)
+    )
+
+    # 以 ConverseStream 串流輸出回應 (降低首字延遲)
+    stream_responses: bool = field(
+        default_factory=lambda: env_bool("BEDROCK_STREAMING", True)
+    )
+
+    # Prompt caching：system prompt 內的時間精度決定前綴能否被快取重用
+    prompt_cache: bool = field(
+        default_factory=lambda: env_bool("BEDROCK_PROMPT_CACHE", True)
+    )
+    prompt_time_granularity: str = field(
+        default_factory=lambda: os.getenv("PROMPT_TIME_GRANULARITY", "hour")
+    )
+    prompt_time_in_user_turn: bool = field(
+        default_factory=lambda: env_bool("PROMPT_TIME_IN_USER_TURN", False)
+    )
+
     assets_base_url: str = field(default_factory=get_url_from_env)
 
+    # Context window：歷史超過 token 預算時，保留最近 N 輪，較早的對話折疊為滾動摘要
+    context_budget_tokens: int = field(
+        default_factory=lambda: env_int("CONTEXT_BUDGET_TOKENS", 6000)
+    )
+    context_keep_turns: int = field(
+        default_factory=lambda: env_int("CONTEXT_KEEP_TURNS", 6)
+    )
+    summary_max_tokens: int = 512
+
+    # 回應快取（opt-in）：只快取無前文的單輪問題，temperature 高於門檻時略過
+    response_cache_enabled: bool = field(
+        default_factory=lambda: env_bool("RESPONSE_CACHE_ENABLED", False)
+    )
+    response_cache_shared: bool = field(
+        default_factory=lambda: env_bool("RESPONSE_CACHE_SHARED", False)
+    )
+    response_cache_max_entries: int = field(
+        default_factory=lambda: env_int("RESPONSE_CACHE_MAX_ENTRIES", 1024)
+    )
+    response_cache_ttl_seconds: int = field(
+        default_factory=lambda: env_int("RESPONSE_CACHE_TTL_SECONDS", 3600)
+    )
+    response_cache_max_temperature: float = field(
+        default_factory=lambda: env_float("RESPONSE_CACHE_MAX_TEMPERATURE", 0.7)
+    )
+
+    # 語意快取（opt-in）：比對改寫過的相同問題，套用與回應快取相同的略過規則
+    semantic_cache_enabled: bool = field(
+        default_factory=lambda: env_bool("SEMANTIC_CACHE_ENABLED", False)
+    )
+    semantic_cache_threshold: float = field(
+        default_factory=lambda: env_float("SEMANTIC_CACHE_THRESHOLD", 0.92)
+    )
+    semantic_cache_max_entries: int = field(
+        default_factory=lambda: env_int("SEMANTIC_CACHE_MAX_ENTRIES", 100_000)
+    )
+    # 索引檔目錄（每個 Pod 各自一份，例如 emptyDir / 本機 volume）；空字串表示不持久化
+    semantic_cache_path: str = field(
+        default_factory=lambda: os.getenv("SEMANTIC_CACHE_PATH", "")
+    )
+    # bedrock | hashing（本地替代 embedder，測試用）
+    semantic_cache_embedder: str = field(
+        default_factory=lambda: os.getenv("SEMANTIC_CACHE_EMBEDDER", "bedrock")
+    )
+    embedding_model_id: str = "amazon.titan-embed-text-v2:0"
+    embedding_dimensions: int = 256
+
+    # 相同請求（prompt、模型與參數皆相同）進行中時，後到者共用同一個模型呼叫
+    single_flight_enabled: bool = field(
+        default_factory=lambda: env_bool("SINGLE_FLIGHT_ENABLED", True)
+    )
+
+    # 對話儲存後端：dynamodb | sqlite（本機檔案，WAL）| memory（不持久化）
+    conversation_store: str = field(
+        default_factory=lambda: os.getenv("CONVERSATION_STORE", "dynamodb")
+    )
+    conversation_sqlite_path: str = field(
+        default_factory=lambda: os.getenv("CONVERSATION_SQLITE_PATH", "conversations.db")
+    )
+
     # 新增 DynamoDB 配置
     dynamodb_table_name: str = field(
         default_factory=lambda: os.getenv("DYNAMODB_TABLE_NAME", "")
     )
 
+    # 對話訊息以背景佇列批次寫入（不阻塞請求執行緒），SIGTERM / 結束時寫完
+    dynamodb_write_behind: bool = field(
+        default_factory=lambda: env_bool("DYNAMODB_WRITE_BEHIND", True)
+    )
+
+    # 使用者身分：由前方的驗證代理設定的 header（例如 ALB OIDC 的 X-Amzn-Oidc-Identity）；
+    # 未設定或 header 不存在時所有會話歸屬於 "default"
+    user_id_header: str = field(
+        default_factory=lambda: os.getenv("USER_ID_HEADER", "")
+    )
+    # 會話列表 GSI 的寫入分片數（每個使用者的會話分散到 N 個 partition）；只能調大
+    session_index_shards: int = field(
+        default_factory=lambda: env_int("SESSION_INDEX_SHARDS", 4)
+    )
+
+    # 訊息內容超過門檻時 zlib 壓縮為 Binary；壓縮後仍超過單一 item 上限時拆成 chunk item
+    message_compress_threshold: int = field(
+        default_factory=lambda: env_int("MESSAGE_COMPRESS_THRESHOLD", 2048)
+    )
+    message_max_inline_bytes: int = field(
+        default_factory=lambda: env_int("MESSAGE_MAX_INLINE_BYTES", 350_000)
+    )
+
+    # 長會話每 N 則已結束的訊息在背景壓縮為一個區段 item（load_session 讀取的 item 數隨之減少）；0 表示不壓縮。
+    # 最近 SESSION_SEGMENT_KEEP_OPEN 則不壓縮，不小於 SESSION_TAIL_MESSAGES 時開啟會話不必讀區段
+    session_segment_size: int = field(
+        default_factory=lambda: env_int("SESSION_SEGMENT_SIZE", 0)
+    )
+    session_segment_keep_open: int = field(
+        default_factory=lambda: env_int("SESSION_SEGMENT_KEEP_OPEN", 50)
+    )
+
+    # 會話列表 / 歷史的行程內讀取快取（本 Pod 的寫入會立即失效）；容量 0 表示不快取
+    session_cache_max_entries: int = field(
+        default_factory=lambda: env_int("SESSION_CACHE_MAX_ENTRIES", 1000)
+    )
+    session_cache_ttl_seconds: float = field(
+        default_factory=lambda: env_float("SESSION_CACHE_TTL_SECONDS", 30.0)
+    )
+
+    # 開啟會話時只載入最近 N 條消息，更早的消息按「Load earlier messages」再分批載入；0 表示全部載入
+    session_tail_messages: int = field(
+        default_factory=lambda: env_int("SESSION_TAIL_MESSAGES", 50)
+    )
+
     # 會話列表顯示數量
     session_list_limit: int = 10
 
+    @property
+    def bedrock_region_list(self) -> tuple:
+        regions = tuple(r.strip() for r in self.bedrock_regions.split(",") if r.strip())
+        return regions or (self.aws_region,)
+
+    @property
+    def bedrock_endpoint_url_map(self) -> dict:
+        endpoints = {}
+        for part in self.bedrock_endpoint_urls.split(","):
+            region, _, url = part.partition("=")
+            if url.strip():
+                endpoints[region.strip()] = url.strip()
+        return endpoints
+
+    @property
+    def prompt_options(self) -> PromptOptions:
+        return PromptOptions(
+            prompt_cache=self.prompt_cache,
+            time_granularity=self.prompt_time_granularity,
+            time_in_user_turn=self.prompt_time_in_user_turn,
+        )
+
     @property
     def css_url(self) -> str:
         return f"{self.assets_base_url}/style.css"
@@ -1,7 +1,46 @@
-def build_system_prompts(current_time_taipei: str) -> list[dict]:
+from dataclasses import dataclass
+from typing import Optional
+
+# system prompt 版本：修改 build_system_prompts 內容時遞增，使回應快取失效
+SYSTEM_PROMPT_VERSION = "1"
+
+# Converse prompt caching 的快取斷點
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+# 時間精度：越粗，system prompt 在同一時間窗內越能被重複使用為快取前綴
+TIME_FORMATS = {
+    "second": "%Y-%m-%d %H:%M:%S",
+    "minute": "%Y-%m-%d %H:%M",
+    "hour": "%Y-%m-%d %H:00",
+    "day": "%Y-%m-%d",
+}
+
+@dataclass(frozen=True)
+class PromptOptions:
+    # 在 system block 與穩定的歷史前綴之後加入 cachePoint
+    prompt_cache: bool = False
+    # 時間精度 (second / minute / hour / day)
+    time_granularity: str = "second"
+    # 將時間放到最後一則 user 訊息，讓 system prompt 完全固定
+    time_in_user_turn: bool = False
+
+def build_time_prompt(current_time_taipei: str) -> dict:
+    return {"text": f"The current time in Taipei is {current_time_taipei}."}
+
+def build_system_prompts(current_time_taipei: Optional[str]) -> list[dict]:
     base = [
         {"text": "You are a helpful and professional DevOps/SRE Assistant."},
         {"text": "You should answer questions concisely and use technical terminology where appropriate."},
     ]
-    time_prompt = {"text": f"The current time in Taipei is {current_time_taipei}."}
+    if current_time_taipei is None:
+        return base
+    time_prompt = build_time_prompt(current_time_taipei)
     return base + [time_prompt]
+
+
+def build_summary_prompts() -> list[dict]:
+    return [
+        {"text": "You maintain a running summary of a conversation between a user and a DevOps/SRE Assistant."},
+        {"text": "Merge the existing summary with the new turns. Keep facts, decisions, commands, resource names, "
+                 "error messages and open questions; drop pleasantries. Reply with the updated summary only."},
+    ]
@@ -0,0 +1,244 @@
+# src/services/admission.py
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Iterator, Optional
+
+import streamlit as st
+from opentelemetry import trace
+
+from src.services import metrics
+
+REJECTION_MESSAGE = (
+    "The assistant is handling a lot of requests right now. "
+    "Please try again in a few seconds."
+)
+
+
+class AdmissionRejected(Exception):
+    """預估排隊時間超過期限，請求在送出前即被拒絕"""
+
+    def __init__(self, reason: str, estimated_wait: float):
+        super().__init__(f"admission rejected ({reason}), estimated wait {estimated_wait:.1f}s")
+        self.reason = reason
+        self.estimated_wait = estimated_wait
+        self.user_message = REJECTION_MESSAGE
+
+
+class TokenBucket:
+    """以固定速率補充的 token bucket（呼叫端負責加鎖）"""
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def clamp(self, amount: float) -> float:
+        # 單一請求大於 bucket 容量時以容量計，避免永遠無法放行
+        return min(amount, self.capacity)
+
+    def time_until(self, amount: float) -> float:
+        deficit = self.clamp(amount) - self.tokens
+        return max(0.0, deficit / self.rate)
+
+
+class _Waiter:
+    def __init__(self, session_id: str, tokens: int):
+        self.session_id = session_id
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    行程內的模型呼叫准入控制
+
+    - RPM / TPM 各一個 token bucket，並以 semaphore 限制同時進行的呼叫數
+    - 等待中的請求依 session_id 輪流放行（round-robin），單一 session 的大量請求不會餓死其他人
+    - 預估等待時間超過 max_wait_seconds 時立即拒絕（AdmissionRejected），不佔用 session 執行緒
+    """
+
+    def __init__(self, *, rpm: int, tpm: int, max_concurrency: int, max_wait_seconds: float):
+        # bucket 容量為 10 秒的配額，允許小幅突發但不會一次用光整分鐘的額度
+        self._requests = TokenBucket(rpm / 60.0, max(1.0, rpm / 6.0))
+        self._tokens = TokenBucket(tpm / 60.0, max(1.0, tpm / 6.0))
+        self.max_concurrency = max_concurrency
+        self.max_wait_seconds = max_wait_seconds
+
+        self._cond = threading.Condition()
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._queued = 0
+        self._queued_tokens = 0
+        self._active = 0
+        # 單次呼叫耗時的 EWMA，用來估計等待 semaphore 的時間
+        self._service_time = 2.0
+
+    @contextmanager
+    def admit(self, session_id: str, tokens: int) -> Iterator[None]:
+        """
+        取得一次模型呼叫的許可，離開 context 時釋放
+
+        :param session_id: 會話 ID（公平排程的單位）
+        :param tokens: 預估消耗的 token 數（輸入 + 最大輸出）
+        """
+        started = time.monotonic()
+        self._acquire(session_id, tokens)
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def try_admit(self, tokens: int) -> Optional[Callable[[], None]]:
+        """
+        不排隊的許可（例如 hedge 的備援請求）：有請求在排隊、同時呼叫數或配額不足時回傳 None，
+        不會搶走排隊中使用者請求的配額
+
+        :param tokens: 預估消耗的 token 數（輸入 + 最大輸出）
+        :return: 取得許可時回傳 release 函式（呼叫結束後呼叫一次）
+        """
+        cost = self._tokens.clamp(tokens)
+        with self._cond:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            if (self._queues or self._active >= self.max_concurrency
+                    or self._requests.tokens < 1 or self._tokens.tokens < cost):
+                return None
+            self._requests.tokens -= 1
+            self._tokens.tokens -= cost
+            self._active += 1
+
+        started = time.monotonic()
+        return lambda: self._release(time.monotonic() - started)
+
+    def _acquire(self, session_id: str, tokens: int) -> None:
+        span = trace.get_current_span()
+        waiter = _Waiter(session_id, int(self._tokens.clamp(tokens)))
+        tokens = waiter.tokens
+
+        with self._cond:
+            now = time.monotonic()
+            estimated_wait = self._estimate_wait(now, tokens)
+            span.set_attribute("gen_ai.admission.estimated_wait_s", estimated_wait)
+            if estimated_wait > self.max_wait_seconds:
+                self._reject(span, "queue_full", estimated_wait)
+
+            self._enqueue(waiter)
+            deadline = now + self.max_wait_seconds
+            self._dispatch(now)
+
+            while not waiter.granted:
+                now = time.monotonic()
+                if now >= deadline:
+                    self._dequeue(waiter)
+                    self._reject(span, "timeout", now - waiter.enqueued)
+                # bucket 依時間補充，不會有人 notify，等到補足或期限為止
+                self._cond.wait(timeout=min(deadline - now, self._next_refill_delay(now)))
+                self._dispatch(time.monotonic())
+
+        wait = time.monotonic() - waiter.enqueued
+        span.set_attribute("gen_ai.admission.wait_s", wait)
+        metrics.admission_wait.record(wait)
+
+    def _release(self, service_time: float) -> None:
+        with self._cond:
+            self._active -= 1
+            self._service_time = 0.8 * self._service_time + 0.2 * service_time
+            self._dispatch(time.monotonic())
+            # 釋放時 bucket 可能暫時不足而沒有放行任何請求：仍喚醒等待者，改以 bucket 補充時間等待
+            self._cond.notify_all()
+
+    def _estimate_wait(self, now: float, tokens: int) -> float:
+        self._requests.refill(now)
+        self._tokens.refill(now)
+
+        # 排在前面的請求加上本請求，以 bucket 速率換算需要等待的時間
+        request_wait = max(0.0, self._queued + 1 - self._requests.tokens) / self._requests.rate
+        token_wait = max(0.0, self._queued_tokens + self._tokens.clamp(tokens) - self._tokens.tokens) / self._tokens.rate
+
+        concurrency_wait = 0.0
+        if self._active >= self.max_concurrency:
+            rounds = self._queued // self.max_concurrency + 1
+            concurrency_wait = rounds * self._service_time
+
+        return max(request_wait, token_wait, concurrency_wait)
+
+    def _dispatch(self, now: float) -> None:
+        """依 session 輪流放行佇列前端的請求，直到 semaphore 或 bucket 不足"""
+        self._requests.refill(now)
+        self._tokens.refill(now)
+
+        granted = False
+        while self._queues and self._active < self.max_concurrency:
+            session_id, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            cost = self._tokens.clamp(waiter.tokens)
+            if self._requests.tokens < 1 or self._tokens.tokens < cost:
+                break
+
+            self._requests.tokens -= 1
+            self._tokens.tokens -= cost
+            self._active += 1
+            waiter.granted = True
+            granted = True
+
+            queue.popleft()
+            self._queued -= 1
+            self._queued_tokens -= waiter.tokens
+            metrics.admission_queue_depth.add(-1)
+            # 放行後輪到下一個 session
+            if queue:
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+
+        if granted:
+            self._cond.notify_all()
+
+    def _next_refill_delay(self, now: float) -> float:
+        # 卡在 semaphore 時由 _release 喚醒（每次釋放都會 notify），不需要輪詢
+        if not self._queues or self._active >= self.max_concurrency:
+            return self.max_wait_seconds
+        waiter = next(iter(self._queues.values()))[0]
+        return max(0.01, self._requests.time_until(1), self._tokens.time_until(waiter.tokens))
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        self._queues.setdefault(waiter.session_id, deque()).append(waiter)
+        self._queued += 1
+        self._queued_tokens += waiter.tokens
+        metrics.admission_queue_depth.add(1)
+
+    def _dequeue(self, waiter: _Waiter) -> None:
+        queue = self._queues[waiter.session_id]
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[waiter.session_id]
+        self._queued -= 1
+        self._queued_tokens -= waiter.tokens
+        metrics.admission_queue_depth.add(-1)
+
+    @staticmethod
+    def _reject(span, reason: str, estimated_wait: float) -> None:
+        span.set_attribute("gen_ai.admission.rejected", reason)
+        metrics.admission_rejections.add(1, {"reason": reason})
+        raise AdmissionRejected(reason, estimated_wait)
+
+
+@st.cache_resource
+def get_admission_controller(
+    rpm: int,
+    tpm: int,
+    max_concurrency: int,
+    max_wait_seconds: float,
+) -> AdmissionController:
+    """行程內共用同一個准入控制器（跨 Streamlit session 與 rerun）"""
+    return AdmissionController(
+        rpm=rpm, tpm=tpm, max_concurrency=max_concurrency, max_wait_seconds=max_wait_seconds,
+    )
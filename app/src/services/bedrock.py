@@ -1,19 +1,260 @@
 # src/services/bedrock.py
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
 import boto3
 import pytz
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from datetime import datetime
 import streamlit as st
+from opentelemetry import trace
+
+from src.services.logging import get_logger
+from src.services import metrics
+from src.services.circuit_breaker import CircuitBreakerRegistry
+from src.services.deadline import (
+    SEND_STAGE,
+    DeadlineExceeded,
+    TimedIterator,
+    enforce_deadline,
+    remaining,
+    run_with_deadline,
+)
+from src.services.hedging import Hedger
+from src.services.region_pool import RegionalClientPool, failover_reason
+from src.prompts import (
+    CACHE_POINT,
+    TIME_FORMATS,
+    PromptOptions,
+    build_summary_prompts,
+    build_system_prompts,
+    build_time_prompt,
+)
+
+# call_bedrock / call_bedrock_stream 失敗時回傳給 UI 的文字前綴
+ERROR_PREFIX = "Error: "
+
+def is_error_response(text: str) -> bool:
+    return text.startswith(ERROR_PREFIX)
+
+def error_response(error: Exception) -> str:
+    return f"{ERROR_PREFIX}{str(error)}"
+
+logger = get_logger()
 
-from src.prompts import build_system_prompts
+# 行程內各 region 進行中的 Bedrock 呼叫數（串流會佔用連線直到讀完）
+_pool_lock = threading.Lock()
+_pool_in_use: Dict[str, int] = {}
 
 @st.cache_resource
-def get_bedrock_client(region_name: str):
-    return boto3.client(service_name="bedrock-runtime", region_name=region_name)
+def get_bedrock_client(
+    region_name: str,
+    *,
+    max_pool_connections: int = 10,
+    connect_timeout: float = 60,
+    read_timeout: float = 60,
+    max_attempts: int = 3,
+    retry_mode: str = "legacy",
+    warmup_model_id: Optional[str] = None,
+    warmup_connections: int = 0,
+    endpoint_url: Optional[str] = None,
+):
+    """
+    建立（並快取）bedrock-runtime client
+
+    :param max_pool_connections: urllib3 連線池大小，應不小於同時進行的 Bedrock 呼叫數
+    :param retry_mode: legacy / standard / adaptive（adaptive 會依節流自動降速）
+    :param warmup_connections: 啟動時預先建立的連線數（DNS + TLS），0 表示不預熱
+    :param endpoint_url: 覆寫服務端點（例如本地的 src.tools.fake_bedrock）
+    """
+    client = boto3.client(
+        service_name="bedrock-runtime",
+        region_name=region_name,
+        endpoint_url=endpoint_url,
+        config=Config(
+            max_pool_connections=max_pool_connections,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retries={"max_attempts": max_attempts, "mode": retry_mode},
+            tcp_keepalive=True,
+        ),
+    )
+    # 每次 HTTP 嘗試前檢查本輪 deadline，逾時後不再重試
+    client.meta.events.register("before-send.bedrock-runtime", enforce_deadline)
+    if warmup_model_id and warmup_connections > 0:
+        warm_up_bedrock_client(client, warmup_model_id, warmup_connections)
+    return client
+
+def warm_up_bedrock_client(client, model_id: str, connections: int) -> None:
+    """
+    以並行的無效請求預先建立連線池中的連線
+
+    以 assistant 開頭的對話會被服務端以 ValidationException 拒絕：
+    不會呼叫模型、不產生費用，但 DNS 查詢與 TLS 握手都已完成，連線留在池中供之後重用。
+    """
+    start_time = time.time()
 
-def taipei_now_str() -> str:
+    def ping(_):
+        try:
+            client.converse(
+                modelId=model_id,
+                messages=[{"role": "assistant", "content": [{"text": "warm-up"}]}],
+            )
+        except ClientError:
+            return True
+        except Exception as e:
+            logger.error("Bedrock warm-up request failed", extra={"error": str(e)})
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=connections, thread_name_prefix="bedrock-warmup") as pool:
+        succeeded = sum(pool.map(ping, range(connections)))
+
+    logger.info("Bedrock client warmed up", extra={
+        "region": client.meta.region_name,
+        "connections": succeeded,
+        "duration": time.time() - start_time,
+    })
+
+@contextmanager
+def _pool_slot(client):
+    """記錄連線池使用量；超過池大小時 urllib3 會另開連線（重新握手）後丟棄"""
+    region = client.meta.region_name
+    pool_size = client.meta.config.max_pool_connections
+    with _pool_lock:
+        in_use = _pool_in_use.get(region, 0) + 1
+        _pool_in_use[region] = in_use
+
+    attributes = {"region": region}
+    metrics.bedrock_pool_in_use.add(1, attributes)
+    metrics.bedrock_pool_utilization.record(in_use / pool_size, attributes)
+    if in_use > pool_size:
+        metrics.bedrock_pool_saturated.add(1, attributes)
+    try:
+        yield
+    finally:
+        with _pool_lock:
+            _pool_in_use[region] -= 1
+        metrics.bedrock_pool_in_use.add(-1, attributes)
+
+@contextmanager
+def _breaker_guard(breakers: Optional[CircuitBreakerRegistry], model_id: str, client):
+    """
+    斷路器開啟時立即拋出 CircuitOpenError；節流 / 5xx / 連線錯誤 / 送出後的逾時計為失敗
+
+    送出前就已超過 deadline（before-send hook，時間耗在准入排隊或先前的重試）時請求沒有到達服務端，
+    不計成功或失敗：用戶端變慢不應打開健康模型 / region 的斷路器。
+    """
+    if breakers is None:
+        yield
+        return
+    breaker = breakers.get(model_id, client.meta.region_name)
+    breaker.allow()
+    outcome = "success"
+    try:
+        yield
+    except DeadlineExceeded as e:
+        outcome = "neutral" if e.stage == SEND_STAGE else "failure"
+        raise
+    except Exception as e:
+        if failover_reason(e) is not None:
+            outcome = "failure"
+        raise
+    finally:
+        if outcome == "failure":
+            breaker.record_failure()
+        elif outcome == "neutral":
+            breaker.record_neutral()
+        else:
+            # 其他錯誤（例如 ValidationException）代表服務仍有回應
+            breaker.record_success()
+
+def taipei_now_str(granularity: str = "second") -> str:
     tz = pytz.timezone("Asia/Taipei")
-    return datetime.now(tz).strftime("%Y-%m-%d %H:%M:%S")
+    return datetime.now(tz).strftime(TIME_FORMATS[granularity])
+
+def build_converse_request(
+    prompt: str,
+    messages: Optional[List[Dict]],
+    *,
+    model_id: str,
+    max_tokens: int,
+    temperature: float,
+    prompt_options: PromptOptions = PromptOptions(),
+) -> Dict:
+    """
+    組出 converse / converse_stream 的參數
+
+    :param prompt: 本輪使用者輸入（未提供 messages 時作為單輪對話）
+    :param messages: 完整的多輪 Converse messages（最後一則須為本輪 user 訊息）
+    :param prompt_options: 時間精度與 prompt caching 設定
+    """
+    current_time = taipei_now_str(prompt_options.time_granularity)
+
+    if messages is None:
+        messages = [{"role": "user", "content": [{"text": prompt}]}]
+
+    if prompt_options.time_in_user_turn:
+        # 時間放在最後一則 user 訊息，system prompt 不隨時間變動
+        system_prompts = build_system_prompts(None)
+        messages = messages[:-1] + [_append_content(messages[-1], build_time_prompt(current_time))]
+    else:
+        system_prompts = build_system_prompts(current_time)
+
+    if prompt_options.prompt_cache:
+        # 斷點 1：system block 之後；斷點 2：本輪 user 訊息之前的歷史前綴
+        system_prompts = system_prompts + [CACHE_POINT]
+        if len(messages) > 1:
+            messages = messages[:-2] + [_append_content(messages[-2], CACHE_POINT)] + messages[-1:]
+
+    return {
+        "modelId": model_id,
+        "messages": messages,
+        "system": system_prompts,
+        "inferenceConfig": {"maxTokens": max_tokens, "temperature": temperature},
+    }
+
+def _append_content(message: Dict, block: Dict) -> Dict:
+    """回傳附加 content block 後的新訊息（不修改 ConverseHistory 中的原訊息）"""
+    return {"role": message["role"], "content": message["content"] + [block]}
+
+def _record_usage(span, usage: Dict) -> None:
+    span.set_attribute("gen_ai.usage.input_tokens", usage.get("inputTokens", 0))
+    span.set_attribute("gen_ai.usage.output_tokens", usage.get("outputTokens", 0))
+    span.set_attribute("gen_ai.usage.cache_read_input_tokens", usage.get("cacheReadInputTokens", 0))
+    span.set_attribute("gen_ai.usage.cache_write_input_tokens", usage.get("cacheWriteInputTokens", 0))
+
+def _record_call_metrics(
+    *,
+    model_id: str,
+    region: str,
+    streaming: bool,
+    latency_ms: float,
+    usage: Dict,
+    response_metrics: Dict,
+) -> None:
+    """以 OTel metrics 記錄一次成功呼叫的延遲與 token 用量（取代從 log 解析 latency）"""
+    attributes = {"model_id": model_id, "region": region, "streaming": streaming}
+    metrics.bedrock_latency.record(latency_ms, attributes)
+    if "latencyMs" in response_metrics:
+        metrics.bedrock_model_latency.record(response_metrics["latencyMs"], attributes)
+    metrics.bedrock_input_tokens.record(usage.get("inputTokens", 0), attributes)
+    metrics.bedrock_output_tokens.record(usage.get("outputTokens", 0), attributes)
+
+def _record_error(model_id: str, client, error: Exception) -> None:
+    if isinstance(error, ClientError):
+        error_type = error.response.get("Error", {}).get("Code", "ClientError")
+    else:
+        error_type = type(error).__name__
+    metrics.bedrock_errors.add(1, {
+        "model_id": model_id,
+        "region": client.meta.region_name,
+        "error_type": error_type,
+    })
 
 def call_bedrock(
     prompt: str,
@@ -23,22 +264,77 @@ def call_bedrock(
     max_tokens: int,
     temperature: float,
     logger,
+    messages: Optional[List[Dict]] = None,
+    prompt_options: PromptOptions = PromptOptions(),
+    raise_errors: bool = False,
+    hedger: Optional[Hedger] = None,
+    regions: Optional[RegionalClientPool] = None,
+    breakers: Optional[CircuitBreakerRegistry] = None,
+    on_usage: Optional[Callable[[Dict], None]] = None,
+    admit_hedge: Optional[Callable[[], Optional[Callable[[], None]]]] = None,
 ) -> str:
+    """
+    呼叫 Converse 並回傳回應文字
+
+    :param raise_errors: True 時失敗直接拋出例外（供 gateway 判斷節流 / 5xx），
+                         否則回傳以 ERROR_PREFIX 開頭的錯誤文字
+    :param hedger: 提供時主請求過慢會對備援 region / 模型再送一次，採用先完成的結果
+    :param regions: 提供時由多 region client 集合選擇 region（節流 / 5xx 時自動換 region），忽略 client
+    :param breakers: 提供時每個 (模型, region) 各自套用斷路器
+    :param on_usage: 成功時以 Converse 回傳的 usage 呼叫（例如累計到會話 metadata）
+    :param admit_hedge: 備援請求的准入（見 Hedger.run 的 admit_backup）；未取得許可時不 hedge
+
+    本輪有 deadline（src.services.deadline）時，呼叫端最多只等到 deadline。
+    """
     start_time = time.time()
-    current_time = taipei_now_str()
-    system_prompts = build_system_prompts(current_time)
+    request = build_converse_request(
+        prompt,
+        messages,
+        model_id=model_id,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        prompt_options=prompt_options,
+    )
+
+    def converse(target_client, target_request: Dict):
+        """回傳 (client, 實際使用的 model_id, response)，hedge / 換 region 後仍能標記正確的維度"""
+        target_model = target_request["modelId"]
+        with _breaker_guard(breakers, target_model, target_client), _pool_slot(target_client):
+            try:
+                return target_client, target_model, target_client.converse(**target_request)
+            except Exception as e:
+                _record_error(target_model, target_client, e)
+                raise
 
-    messages = [{"role": "user", "content": [{"text": prompt}]}]
+    def primary():
+        if regions is None:
+            return converse(client, request)
+        return regions.call(lambda region_client: converse(region_client, request))
+
+    def invoke():
+        if hedger is None:
+            return primary()
+        backup_request = request
+        if hedger.backup_model_id:
+            backup_request = {**request, "modelId": hedger.backup_model_id}
+        return hedger.run(primary, lambda: converse(hedger.backup_client, backup_request), admit_hedge)
 
     try:
-        response = client.converse(
-            modelId=model_id,
-            messages=messages,
-            system=system_prompts,
-            inferenceConfig={"maxTokens": max_tokens, "temperature": temperature},
-        )
+        served_client, served_model, response = run_with_deadline(invoke, "bedrock.converse")
         answer = response["output"]["message"]["content"][0]["text"]
-        
+        usage = response.get("usage", {})
+        _record_usage(trace.get_current_span(), usage)
+        _record_call_metrics(
+            model_id=served_model,
+            region=served_client.meta.region_name,
+            streaming=False,
+            latency_ms=(time.time() - start_time) * 1000,
+            usage=usage,
+            response_metrics=response.get("metrics", {}),
+        )
+        if on_usage is not None:
+            on_usage(usage)
+
         logger.info("Bedrock invoked successfully", extra={
             "model_id": model_id,
             "is_success": 1,
@@ -54,4 +350,167 @@ def call_bedrock(
             "status": "error",
             "model_id": model_id,
         })
-        return f"Error: {str(e)}"
+        if raise_errors:
+            raise
+        return error_response(e)
+
+def call_bedrock_stream(
+    prompt: str,
+    *,
+    client,
+    model_id: str,
+    max_tokens: int,
+    temperature: float,
+    logger,
+    messages: Optional[List[Dict]] = None,
+    prompt_options: PromptOptions = PromptOptions(),
+    raise_errors: bool = False,
+    regions: Optional[RegionalClientPool] = None,
+    breakers: Optional[CircuitBreakerRegistry] = None,
+    on_usage: Optional[Callable[[Dict], None]] = None,
+    idle_timeout: float = 0,
+) -> Iterator[str]:
+    """
+    以 ConverseStream 逐段產生回應文字 (text delta)
+
+    呼叫端以 st.write_stream 消費即可取得完整文字；
+    首個 token 時間 (TTFT) 與 tokens/sec 會記錄在當前 span (generate_response) 上。
+    raise_errors、regions、breakers、on_usage 的行為與 call_bedrock 相同；換 region 只發生在開啟串流時，
+    已開始輸出後的錯誤不會重送。
+
+    turn deadline 只限制開啟串流與等到首個 token；之後的長回答不受 deadline 截斷，
+    改以 idle_timeout 限制兩個事件之間的等待時間（<= 0 表示不限制），逾時即關閉串流。
+    """
+    start_time = time.time()
+    request = build_converse_request(
+        prompt,
+        messages,
+        model_id=model_id,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        prompt_options=prompt_options,
+    )
+
+    span = trace.get_current_span()
+    first_token_time = None
+    usage = {}
+    response_metrics = {}
+    stream_client = None
+
+    def open_stream(target_client):
+        with _breaker_guard(breakers, model_id, target_client):
+            try:
+                return target_client, target_client.converse_stream(**request)
+            except Exception as e:
+                _record_error(model_id, target_client, e)
+                raise
+
+    try:
+        stream_client, response = run_with_deadline(
+            lambda: open_stream(client) if regions is None else regions.call(open_stream),
+            "bedrock.converse_stream",
+        )
+
+        with _pool_slot(stream_client), closing(response["stream"]):
+            # 每個串流一條讀取執行緒，等待事件時不佔用共用的 deadline 執行緒池
+            events = TimedIterator(response["stream"])
+            while True:
+                if first_token_time is None:
+                    event = events.next(remaining(), "bedrock.first_token")
+                else:
+                    event = events.next(idle_timeout if idle_timeout > 0 else None, "bedrock.stream_idle")
+                if event is None:
+                    break
+                if "contentBlockDelta" in event:
+                    text = event["contentBlockDelta"]["delta"].get("text")
+                    if not text:
+                        continue
+                    if first_token_time is None:
+                        first_token_time = time.time()
+                        span.set_attribute(
+                            "gen_ai.response.time_to_first_token_ms",
+                            (first_token_time - start_time) * 1000,
+                        )
+                    yield text
+                elif "metadata" in event:
+                    usage = event["metadata"].get("usage", {})
+                    response_metrics = event["metadata"].get("metrics", {})
+
+        end_time = time.time()
+        output_tokens = usage.get("outputTokens", 0)
+        # tokens/sec 只計算首個 token 之後的生成時間，TTFT 另外記錄
+        generation_time = end_time - (first_token_time or start_time)
+        tokens_per_second = output_tokens / generation_time if generation_time > 0 else 0.0
+
+        _record_usage(span, usage)
+        span.set_attribute("gen_ai.response.tokens_per_second", tokens_per_second)
+        _record_call_metrics(
+            model_id=model_id,
+            region=stream_client.meta.region_name,
+            streaming=True,
+            latency_ms=(end_time - start_time) * 1000,
+            usage=usage,
+            response_metrics=response_metrics,
+        )
+        if first_token_time is not None:
+            metrics.bedrock_time_to_first_token.record(
+                (first_token_time - start_time) * 1000,
+                {"model_id": model_id, "region": stream_client.meta.region_name},
+            )
+        if on_usage is not None:
+            on_usage(usage)
+
+        logger.info("Bedrock stream completed successfully", extra={
+            "model_id": model_id,
+            "is_success": 1,
+            "latency": end_time - start_time,
+            "time_to_first_token": (first_token_time or end_time) - start_time,
+            "tokens_per_second": tokens_per_second,
+            "status": "success",
+        })
+
+    except Exception as e:
+        if stream_client is not None and not isinstance(e, DeadlineExceeded):
+            # 串流開啟後的錯誤（開啟失敗已在 open_stream 記錄）
+            _record_error(model_id, stream_client, e)
+        logger.error("Bedrock stream invocation failed", extra={
+            "error": str(e),
+            "is_success": 0,
+            "status": "error",
+            "model_id": model_id,
+        })
+        if raise_errors:
+            raise
+        yield error_response(e)
+
+def summarize_conversation(
+    previous_summary: Optional[str],
+    messages: List[Dict],
+    *,
+    client,
+    model_id: str,
+    max_tokens: int,
+) -> str:
+    """
+    將較早的對話折疊進滾動摘要（供 context window 背景呼叫，失敗時直接拋出例外）
+
+    :param previous_summary: 既有摘要（第一次為 None）
+    :param messages: 要折疊的 Converse messages
+    :return: 更新後的摘要
+    """
+    transcript = "\n\n".join(
+        f"{msg['role']}: " + "\n".join(block["text"] for block in msg["content"] if "text" in block)
+        for msg in messages
+    )
+    parts = []
+    if previous_summary:
+        parts.append(f"Existing summary:\n{previous_summary}")
+    parts.append(f"New turns:\n{transcript}")
+
+    response = client.converse(
+        modelId=model_id,
+        messages=[{"role": "user", "content": [{"text": "\n\n".join(parts)}]}],
+        system=build_summary_prompts(),
+        inferenceConfig={"maxTokens": max_tokens, "temperature": 0.0},
+    )
+    return response["output"]["message"]["content"][0]["text"].strip()
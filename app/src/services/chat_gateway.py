@@ -0,0 +1,318 @@
+# src/services/chat_gateway.py
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from src.config import AppConfig
+from src.prompts import SYSTEM_PROMPT_VERSION
+from src.services.admission import AdmissionController, AdmissionRejected
+from src.services.circuit_breaker import CircuitBreakerRegistry, CircuitOpenError
+from src.services.deadline import DeadlineExceeded, deadline_scope
+from src.services.bedrock import call_bedrock, call_bedrock_stream, error_response, is_error_response
+from src.services.hedging import Hedger
+from src.services.model_router import ModelRouter
+from src.services.region_pool import RegionalClientPool
+from src.services.response_cache import ResponseCache
+from src.services.semantic_cache import SemanticCache
+from src.services.single_flight import SingleFlight
+
+# 會話 token 用量在背景寫入，不延遲回應
+_usage_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="session-usage")
+
+
+def shutdown_usage_writer() -> None:
+    """等待排入的 token 用量寫入完成（行程結束時呼叫）"""
+    _usage_executor.shutdown(wait=True)
+
+# 這些錯誤不回傳錯誤文字，而是回覆固定的 fallback 訊息（e.user_message），也不寫入快取
+FALLBACK_ERRORS = (AdmissionRejected, CircuitOpenError, DeadlineExceeded)
+
+
+@dataclass(frozen=True)
+class ChatRequest:
+    """單輪對話請求"""
+    prompt: str
+    # 送給模型的 Converse messages（已套用 context window，最後一則為本輪 user 訊息）
+    messages: List[Dict]
+    session_id: str
+    # 預估輸入 token 數（context window 的 sent_tokens）
+    input_tokens: int = 0
+
+
+class ChatGateway:
+    """
+    UI 與 Bedrock 之間的呼叫層
+
+    在 call_bedrock / call_bedrock_stream 之前依序套用：
+    模型路由（決定本輪的 model_id）-> 精確比對的回應快取 -> 語意快取 -> single-flight（合併進行中的相同請求）
+    -> 准入控制（RPM / TPM / 同時呼叫數，依 session 公平排程）；
+    整輪對話受 turn deadline 限制（串流模式只到首個 token，之後改以事件間的閒置逾時限制），
+    斷路器開啟或逾時時回覆 fallback 訊息。
+    兩種模式共用同一套邏輯，app.py 只負責 span 與 context window。
+
+    token 用量記在每個取得模型回答的會話上（single-flight 合併的會話各記一次共用呼叫的用量）；
+    快取命中沒有模型呼叫，不記用量。准入控制只向實際送出呼叫的 leader 扣除配額。
+    """
+
+    def __init__(
+        self,
+        *,
+        cfg: AppConfig,
+        client,
+        logger,
+        response_cache: Optional[ResponseCache] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        single_flight: Optional[SingleFlight] = None,
+        admission: Optional[AdmissionController] = None,
+        router: Optional[ModelRouter] = None,
+        hedger: Optional[Hedger] = None,
+        regions: Optional[RegionalClientPool] = None,
+        breakers: Optional[CircuitBreakerRegistry] = None,
+        usage_sink: Optional[Callable[[str, int, int], None]] = None,
+    ):
+        """
+        :param hedger: 只用於阻塞模式；ConverseStream 的首個 token 要等模型生成，只 hedge 開啟串流無法降低 TTFT
+        :param usage_sink: (session_id, input_tokens, output_tokens)，例如 ConversationService.add_session_usage
+        """
+        self.cfg = cfg
+        self.client = client
+        self.logger = logger
+        self.response_cache = response_cache
+        self.semantic_cache = semantic_cache
+        self.single_flight = single_flight
+        self.admission = admission
+        self.router = router
+        self.hedger = hedger
+        self.regions = regions
+        self.breakers = breakers
+        self.usage_sink = usage_sink
+
+    def complete(self, request: ChatRequest) -> str:
+        """阻塞模式：回傳完整回應文字"""
+        with deadline_scope(self.cfg.turn_deadline_seconds):
+            return self._complete(request)
+
+    def stream(self, request: ChatRequest) -> Iterator[str]:
+        """串流模式：逐段產生回應文字；快取命中時一次輸出"""
+        with deadline_scope(self.cfg.turn_deadline_seconds):
+            yield from self._stream(request)
+
+    def _complete(self, request: ChatRequest) -> str:
+        model_id = self._route(request)
+        lookup = self._lookup_caches(request.prompt, request.messages, model_id)
+        if lookup.answer is not None:
+            return lookup.answer
+
+        def invoke() -> Tuple[str, Dict]:
+            usage = {}
+            with self._admit(request):
+                started = time.perf_counter()
+                try:
+                    answer = call_bedrock(
+                        request.prompt,
+                        messages=request.messages,
+                        raise_errors=True,
+                        hedger=self.hedger,
+                        admit_hedge=self._admit_hedge(request),
+                        **self._call_kwargs(model_id, usage.update),
+                    )
+                except Exception as e:
+                    self._observe(model_id, started, e)
+                    if isinstance(e, FALLBACK_ERRORS):
+                        raise
+                    return error_response(e), usage
+                self._observe(model_id, started)
+                return answer, usage
+
+        try:
+            if self.single_flight is not None:
+                answer, usage = self.single_flight.do(
+                    self._flight_key("complete", request.messages, model_id), invoke
+                )
+            else:
+                answer, usage = invoke()
+        except FALLBACK_ERRORS as e:
+            self._log_fallback(e)
+            return e.user_message
+
+        # 合併的每個呼叫者都把共用呼叫的用量記在自己的會話上
+        self._record_session_usage(request.session_id, usage)
+
+        if not is_error_response(answer):
+            self._store_caches(lookup, answer, model_id)
+        return answer
+
+    def _stream(self, request: ChatRequest) -> Iterator[str]:
+        model_id = self._route(request)
+        lookup = self._lookup_caches(request.prompt, request.messages, model_id)
+        if lookup.answer is not None:
+            yield lookup.answer
+            return
+
+        def invoke() -> Iterator[Union[str, _SharedUsage]]:
+            usage = {}
+            # 許可在串流讀完前都不釋放（連線與配額都被佔用）
+            with self._admit(request):
+                started = time.perf_counter()
+                observed = False
+                try:
+                    for chunk in call_bedrock_stream(
+                        request.prompt,
+                        messages=request.messages,
+                        raise_errors=True,
+                        idle_timeout=self.cfg.stream_idle_timeout_seconds,
+                        **self._call_kwargs(model_id, usage.update),
+                    ):
+                        # 路由只看首個 token 的延遲：之後的時間取決於回答長度與 UI 消費的速度
+                        if not observed:
+                            observed = True
+                            self._observe(model_id, started)
+                        yield chunk
+                except Exception as e:
+                    self._observe(model_id, started, e)
+                    if isinstance(e, FALLBACK_ERRORS):
+                        raise
+                    yield error_response(e)
+                    return
+                if not observed:
+                    self._observe(model_id, started)
+            # 用量放在串流最後，single-flight 的每個訂閱者都會收到
+            yield _SharedUsage(usage)
+
+        if self.single_flight is not None:
+            source = self.single_flight.stream(self._flight_key("stream", request.messages, model_id), invoke)
+        else:
+            source = invoke()
+
+        chunks = []
+        try:
+            for chunk in source:
+                if isinstance(chunk, _SharedUsage):
+                    self._record_session_usage(request.session_id, chunk.usage)
+                    continue
+                chunks.append(chunk)
+                yield chunk
+        except FALLBACK_ERRORS as e:
+            self._log_fallback(e)
+            # 串流中途逾時時，已輸出的部分保留，後面接上 fallback 訊息
+            yield ("\n\n" if chunks else "") + e.user_message
+            return
+
+        if chunks and not is_error_response(chunks[-1]):
+            self._store_caches(lookup, "".join(chunks), model_id)
+
+    def _route(self, request: ChatRequest) -> str:
+        if self.router is None:
+            return self.cfg.model_id
+        return self.router.choose(request.prompt, request.input_tokens).model_id
+
+    def _observe(self, model_id: str, started: float, error: Optional[Exception] = None) -> None:
+        if self.router is not None:
+            self.router.observe(model_id, (time.perf_counter() - started) * 1000, error)
+
+    def _call_kwargs(self, model_id: str, on_usage: Callable[[Dict], None]) -> Dict:
+        return {
+            "client": self.client,
+            "model_id": model_id,
+            "max_tokens": self.cfg.max_tokens,
+            "temperature": self.cfg.temperature,
+            "logger": self.logger,
+            "prompt_options": self.cfg.prompt_options,
+            "regions": self.regions,
+            "breakers": self.breakers,
+            "on_usage": on_usage,
+        }
+
+    def _record_session_usage(self, session_id: str, usage: Dict) -> None:
+        if self.usage_sink is None or not usage:
+            return
+
+        def write():
+            try:
+                self.usage_sink(session_id, usage.get("inputTokens", 0), usage.get("outputTokens", 0))
+            except Exception as e:
+                self.logger.error("Failed to record session usage", extra={"session_id": session_id, "error": str(e)})
+
+        _usage_executor.submit(write)
+
+    def _log_fallback(self, error: Exception) -> None:
+        if isinstance(error, AdmissionRejected):
+            self.logger.info("Model call rejected by admission control", extra={"reason": error.reason})
+        else:
+            self.logger.warning("Model call failed fast", extra={"error": str(error)})
+
+    def _admit(self, request: ChatRequest):
+        if self.admission is None:
+            return nullcontext()
+        # 預留輸入 + 最大輸出 token（與 Bedrock 計算 TPM 配額的方式一致）
+        return self.admission.admit(request.session_id, request.input_tokens + self.cfg.max_tokens)
+
+    def _admit_hedge(self, request: ChatRequest) -> Optional[Callable[[], Optional[Callable[[], None]]]]:
+        """hedge 的備援請求同樣消耗 RPM / TPM / 同時呼叫數，不排隊：額度不足時不 hedge"""
+        if self.admission is None:
+            return None
+        return lambda: self.admission.try_admit(request.input_tokens + self.cfg.max_tokens)
+
+    def _flight_key(self, mode: str, messages: List[Dict], model_id: str) -> str:
+        """相同模式、模型參數與完整 messages 才視為同一個請求"""
+        raw = json.dumps(
+            [mode, model_id, self.cfg.max_tokens, self.cfg.temperature, SYSTEM_PROMPT_VERSION, messages],
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _lookup_caches(self, prompt: str, messages: List[Dict], model_id: str) -> "_CacheLookup":
+        lookup = _CacheLookup()
+        if self.response_cache is None and self.semantic_cache is None:
+            return lookup
+
+        # 兩層快取共用略過規則：有前文或 temperature 過高時回答不可共用
+        if not ResponseCache.is_cacheable(messages, self.cfg.temperature, self.cfg.response_cache_max_temperature):
+            ResponseCache.record_bypass()
+            return lookup
+
+        if self.response_cache is not None:
+            lookup.key = ResponseCache.make_key(prompt, model_id, self.cfg.temperature)
+            lookup.answer = self.response_cache.get(lookup.key)
+            if lookup.answer is not None:
+                return lookup
+
+        if self.semantic_cache is not None:
+            lookup.namespace = f"{model_id}|{self.cfg.temperature:.2f}|{SYSTEM_PROMPT_VERSION}"
+            try:
+                lookup.vector = self.semantic_cache.embed(prompt)
+                lookup.answer = self.semantic_cache.lookup(lookup.vector, lookup.namespace)
+                if lookup.answer is not None and lookup.key is not None:
+                    # 語意命中回填精確快取，下次相同問法不必再算 embedding
+                    self.response_cache.put(lookup.key, lookup.answer, model_id)
+            except Exception as e:
+                # embedding 失敗不影響回答，直接呼叫模型
+                self.logger.error("Semantic cache lookup failed", extra={"error": str(e)})
+                lookup.vector = None
+        return lookup
+
+    def _store_caches(self, lookup: "_CacheLookup", answer: str, model_id: str) -> None:
+        if lookup.key is not None:
+            self.response_cache.put(lookup.key, answer, model_id)
+        if lookup.vector is not None:
+            self.semantic_cache.add(lookup.vector, lookup.namespace, answer)
+
+
+@dataclass(frozen=True)
+class _SharedUsage:
+    """串流最後的 Converse usage（不輸出給 UI），讓 single-flight 的每個訂閱者記錄自己的會話用量"""
+    usage: Dict
+
+
+@dataclass
+class _CacheLookup:
+    """單次請求的快取查詢結果（未命中時保留 key / 向量供寫回）"""
+    answer: Optional[str] = None
+    key: Optional[str] = None
+    vector: Optional[object] = None
+    namespace: Optional[str] = None
@@ -0,0 +1,125 @@
+# src/services/circuit_breaker.py
+import threading
+import time
+from typing import Dict, Tuple
+
+import streamlit as st
+from opentelemetry import trace
+
+from src.services.logging import get_logger
+from src.services import metrics
+
+logger = get_logger()
+
+FALLBACK_MESSAGE = (
+    "The assistant is temporarily unavailable because the model service is degraded. "
+    "Please try again in a minute."
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """斷路器開啟中，請求未送出即失敗"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"circuit {name} is open, retry after {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+        self.user_message = FALLBACK_MESSAGE
+
+
+class CircuitBreaker:
+    """
+    單一 (模型, region) 的斷路器
+
+    - closed：正常放行，連續 failure_threshold 次失敗後開啟
+    - open：open_seconds 內直接拒絕（CircuitOpenError），不佔用 session 執行緒
+    - half_open：冷卻後放行 half_open_max_calls 個試探請求，成功則關閉，失敗則重新開啟
+    """
+
+    def __init__(self, name: str, *, failure_threshold: int, open_seconds: float, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+
+    def allow(self) -> None:
+        """放行時直接返回，否則拋出 CircuitOpenError"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self._opened_at < self.open_seconds:
+                    self._reject(self.open_seconds - (now - self._opened_at))
+                self._transition(HALF_OPEN)
+                self._half_open_calls = 0
+
+            if self.state == HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    self._reject(0.0)
+                self._half_open_calls += 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._transition(OPEN)
+
+    def record_neutral(self) -> None:
+        """呼叫沒有送出（例如送出前 deadline 已過）：不計成功或失敗，只歸還 half_open 的試探名額"""
+        with self._lock:
+            if self.state == HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def _reject(self, retry_after: float) -> None:
+        metrics.circuit_breaker_rejections.add(1, {"breaker": self.name})
+        raise CircuitOpenError(self.name, retry_after)
+
+    def _transition(self, state: str) -> None:
+        previous, self.state = self.state, state
+        attributes = {"breaker": self.name, "from_state": previous, "to_state": state}
+        trace.get_current_span().add_event("circuit_breaker.state_change", attributes)
+        metrics.circuit_breaker_transitions.add(1, attributes)
+        logger.info("Circuit breaker state changed", extra={**attributes, "failures": self._failures})
+
+
+class CircuitBreakerRegistry:
+    """依 (model_id, region) 取得斷路器，第一次使用時建立"""
+
+    def __init__(self, *, failure_threshold: int, open_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, model_id: str, region: str) -> CircuitBreaker:
+        key = (model_id, region)
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(
+                    f"{model_id}@{region}",
+                    failure_threshold=self.failure_threshold,
+                    open_seconds=self.open_seconds,
+                )
+            return breaker
+
+
+@st.cache_resource
+def get_circuit_breakers(failure_threshold: int, open_seconds: float) -> CircuitBreakerRegistry:
+    """行程內共用同一組斷路器（跨 Streamlit session 與 rerun）"""
+    return CircuitBreakerRegistry(failure_threshold=failure_threshold, open_seconds=open_seconds)
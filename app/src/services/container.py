@@ -0,0 +1,221 @@
+# src/services/container.py
+import atexit
+import logging
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Dict, Optional
+
+import streamlit as st
+from opentelemetry import trace
+
+from src.config import AppConfig
+from src.services.logging import get_logger
+from src.services.admission import get_admission_controller
+from src.services.bedrock import get_bedrock_client, summarize_conversation, warm_up_bedrock_client
+from src.services.chat_gateway import ChatGateway, shutdown_usage_writer
+from src.services.circuit_breaker import get_circuit_breakers
+from src.services.context_window import ContextWindowManager, shutdown_summarizer
+from src.services.conversation_store import STORE_DYNAMODB, ConversationStore, get_local_conversation_store
+from src.services.dynamodb_service import get_conversation_service, shutdown_compactor
+from src.services.hedging import get_hedger
+from src.services.model_router import get_model_router, parse_model_tiers
+from src.services.region_pool import RegionalClientPool, get_regional_client_pool
+from src.services.response_cache import get_response_cache
+from src.services.semantic_cache import get_semantic_cache
+from src.services.single_flight import bedrock_flights
+
+
+@dataclass
+class ServiceContainer:
+    """
+    行程內共用的服務（boto3 client / resource、logger、tracer、gateway 等）
+
+    Streamlit 每次互動都會重跑 app.py；這些物件只在第一次執行時建立，
+    之後的 rerun 只取回同一個 container。
+    """
+
+    cfg: AppConfig
+    logger: logging.Logger
+    tracer: trace.Tracer
+    client: object
+    conv_service: ConversationStore
+    context_manager: ContextWindowManager
+    gateway: ChatGateway
+    # region -> bedrock-runtime client（含主 region 與 hedge 備援 region）
+    region_clients: Dict[str, object] = field(default_factory=dict)
+    regions: Optional[RegionalClientPool] = None
+    _closed: bool = field(default=False, init=False, repr=False)
+
+    def warm_up(self) -> None:
+        """預先建立 Bedrock 與 DynamoDB 連線（DNS + TLS），第一個使用者請求不必等待握手"""
+        start_time = time.perf_counter()
+        if self.cfg.bedrock_warmup_connections > 0:
+            for region_client in self.region_clients.values():
+                warm_up_bedrock_client(region_client, self.cfg.model_id, self.cfg.bedrock_warmup_connections)
+        # 讀一個不存在的 metadata item：不回傳資料，但連線留在 boto3 的連線池中
+        self.conv_service.get_session_meta("warm-up")
+        self.logger.info("Services warmed up", extra={"duration": time.perf_counter() - start_time})
+
+    def shutdown(self) -> None:
+        """
+        行程結束時依序收尾：先等背景的摘要 / token 用量寫入 / 區段壓縮完成，再關閉對話儲存（寫完 write-behind 佇列）
+
+        由 atexit 呼叫（Streamlit 收到 SIGTERM 時會正常關閉，atexit 仍會執行）；重複呼叫無作用。
+        """
+        if self._closed:
+            return
+        self._closed = True
+        shutdown_summarizer()
+        shutdown_usage_writer()
+        shutdown_compactor()
+        self.conv_service.close()
+        self.logger.info("Services shut down")
+
+
+def build_services(cfg: AppConfig) -> ServiceContainer:
+    """依設定組出所有服務（只在建立 container 時呼叫一次）"""
+    logger = get_logger()
+
+    bedrock_client_options = dict(
+        max_pool_connections=cfg.bedrock_max_pool_connections,
+        connect_timeout=cfg.bedrock_connect_timeout,
+        # 單次讀取不超過 turn deadline（botocore 沒有單次呼叫的逾時設定）
+        read_timeout=min(cfg.bedrock_read_timeout, cfg.turn_deadline_seconds or cfg.bedrock_read_timeout),
+        max_attempts=cfg.bedrock_max_attempts,
+        retry_mode=cfg.bedrock_retry_mode,
+    )
+    endpoint_urls = cfg.bedrock_endpoint_url_map
+
+    def bedrock_client(region: str):
+        return get_bedrock_client(region, endpoint_url=endpoint_urls.get(region), **bedrock_client_options)
+
+    region_clients = {region: bedrock_client(region) for region in (cfg.aws_region, *cfg.bedrock_region_list)}
+    client = region_clients[cfg.aws_region]
+
+    # 多 region 容錯：設定兩個以上 region 時，依延遲 EWMA 與健康狀態選擇 region
+    regions = None
+    if len(cfg.bedrock_region_list) > 1:
+        regions = get_regional_client_pool(
+            cfg.bedrock_region_list,
+            {region: region_clients[region] for region in cfg.bedrock_region_list},
+        )
+
+    # 對話儲存：正式環境為 DynamoDB；本機開發 / 壓測可改用 SQLite 或記憶體
+    if cfg.conversation_store == STORE_DYNAMODB:
+        conv_service = get_conversation_service(
+            cfg.dynamodb_table_name,
+            cfg.aws_region,
+            cfg.dynamodb_write_behind,
+            cfg.session_cache_max_entries,
+            cfg.session_cache_ttl_seconds,
+            cfg.session_index_shards,
+            cfg.message_compress_threshold,
+            cfg.message_max_inline_bytes,
+            cfg.session_segment_size,
+            cfg.session_segment_keep_open,
+        )
+    else:
+        conv_service = get_local_conversation_store(cfg.conversation_store, cfg.conversation_sqlite_path)
+
+    # 歷史超過 token 預算時，較早的對話在背景折疊為滾動摘要
+    context_manager = ContextWindowManager(
+        budget_tokens=cfg.context_budget_tokens,
+        keep_turns=cfg.context_keep_turns,
+        summarize=partial(
+            summarize_conversation,
+            client=client,
+            model_id=cfg.model_id,
+            max_tokens=cfg.summary_max_tokens,
+        ),
+        conv_service=conv_service,
+    )
+
+    # 回應快取（opt-in）：行程內 LRU + 可選的 DynamoDB 共用層
+    response_cache = get_response_cache(
+        cfg.response_cache_max_entries,
+        cfg.response_cache_ttl_seconds,
+        cfg.dynamodb_table_name if cfg.response_cache_shared else None,
+        cfg.aws_region,
+    ) if cfg.response_cache_enabled else None
+
+    # 語意快取（opt-in）：embedding 最近鄰比對改寫過的問題
+    semantic_cache = get_semantic_cache(
+        client,
+        cfg.semantic_cache_embedder,
+        cfg.embedding_model_id,
+        cfg.embedding_dimensions,
+        cfg.semantic_cache_max_entries,
+        cfg.semantic_cache_threshold,
+        cfg.semantic_cache_path,
+    ) if cfg.semantic_cache_enabled else None
+
+    # Hedged request（opt-in）：備援 region 與主 region 相同時共用同一個 client
+    hedge_region = cfg.bedrock_hedge_region or cfg.aws_region
+    if cfg.bedrock_hedge_enabled:
+        region_clients.setdefault(hedge_region, bedrock_client(hedge_region))
+    hedger = get_hedger(
+        region_clients.get(hedge_region),
+        hedge_region,
+        cfg.bedrock_hedge_model_id or None,
+        cfg.bedrock_hedge_percentile,
+        cfg.bedrock_hedge_max_ratio,
+        cfg.bedrock_hedge_min_delay_ms,
+        cfg.bedrock_hedge_max_delay_ms,
+        cfg.bedrock_max_pool_connections,
+    ) if cfg.bedrock_hedge_enabled else None
+    if hedger is not None and cfg.stream_responses:
+        logger.warning(
+            "BEDROCK_HEDGE_ENABLED has no effect in streaming mode; hedging only applies when BEDROCK_STREAMING=false"
+        )
+
+    gateway = ChatGateway(
+        cfg=cfg,
+        client=client,
+        logger=logger,
+        response_cache=response_cache,
+        semantic_cache=semantic_cache,
+        single_flight=bedrock_flights if cfg.single_flight_enabled else None,
+        admission=get_admission_controller(
+            cfg.bedrock_rpm_limit,
+            cfg.bedrock_tpm_limit,
+            cfg.bedrock_max_concurrency,
+            cfg.admission_max_wait_seconds,
+        ) if cfg.admission_enabled else None,
+        router=get_model_router(
+            parse_model_tiers(cfg.model_tiers),
+            cfg.model_latency_budget_ms,
+        ) if cfg.model_router_enabled else None,
+        hedger=hedger,
+        regions=regions,
+        breakers=get_circuit_breakers(
+            cfg.circuit_breaker_failure_threshold,
+            cfg.circuit_breaker_open_seconds,
+        ) if cfg.circuit_breaker_enabled else None,
+        usage_sink=conv_service.add_session_usage,
+    )
+
+    return ServiceContainer(
+        cfg=cfg,
+        logger=logger,
+        tracer=trace.get_tracer("ai-chatbot-app"),
+        client=client,
+        conv_service=conv_service,
+        context_manager=context_manager,
+        gateway=gateway,
+        region_clients=region_clients,
+        regions=regions,
+    )
+
+
+@st.cache_resource
+def get_services(_cfg: AppConfig) -> ServiceContainer:
+    """
+    行程內唯一的 ServiceContainer（第一次執行時建立並預熱，行程結束時 shutdown）
+
+    設定來自環境變數，行程內不會改變，因此 cfg 不參與快取 key。
+    """
+    services = build_services(_cfg)
+    services.warm_up()
+    atexit.register(services.shutdown)
+    return services
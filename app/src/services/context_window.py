@@ -0,0 +1,210 @@
+# src/services/context_window.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from opentelemetry import trace
+
+from src.services.history import ConverseHistory, estimate_tokens
+from src.services.logging import get_logger
+from src.services import metrics
+
+logger = get_logger()
+
+# 摘要在背景執行，不佔用使用者請求的執行緒；同一會話同時只會有一個摘要任務
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="context-summary")
+_pending: set = set()
+_pending_lock = threading.Lock()
+
+
+def shutdown_summarizer() -> None:
+    """等待進行中的摘要寫入完成（行程結束時呼叫）"""
+    _executor.shutdown(wait=True)
+
+
+@dataclass(frozen=True)
+class ContextStats:
+    original_tokens: int
+    sent_tokens: int
+    summarized_messages: int
+    dropped_messages: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.original_tokens - self.sent_tokens)
+
+
+class ContextWindowManager:
+    """
+    將對話歷史控制在 token 預算內
+
+    - 總量未超過預算且沒有摘要：原樣送出
+    - 超過預算：最近 keep_turns 輪原文保留，較早的對話以滾動摘要取代
+    - 只載入尾段的長會話（start_index > 0）即使尾段在預算內也帶上已持久化的摘要，較早的對話不會消失
+    - 摘要在背景產生並寫入會話 metadata（summary / summary_upto_index），之後不再重算
+    - 摘要尚未追上時，先丟棄最舊的未摘要訊息以符合預算
+    """
+
+    def __init__(
+        self,
+        *,
+        budget_tokens: int,
+        keep_turns: int,
+        summarize: Callable[[Optional[str], List[Dict]], str],
+        conv_service,
+    ):
+        """
+        :param budget_tokens: 歷史（含摘要）的 token 預算
+        :param keep_turns: 永遠原文保留的最近輪數（一輪 = 一則 user + 一則 assistant）
+        :param summarize: (previous_summary, messages) -> 新摘要
+        :param conv_service: 對話儲存（ConversationStore，讀寫會話 metadata）
+        """
+        self.budget_tokens = budget_tokens
+        self.keep_turns = keep_turns
+        self.summarize = summarize
+        self.conv_service = conv_service
+
+    def build(self, session_id: str, history: ConverseHistory) -> Tuple[List[Dict], ContextStats]:
+        """
+        產生本輪要送出的 messages
+
+        :param session_id: 會話 ID
+        :param history: 當前會話的 ConverseHistory（最後一則為本輪 user 訊息）
+        :return: (messages, stats)
+        """
+        messages = history.messages
+        original_tokens = history.total_tokens
+
+        over_budget = original_tokens > self.budget_tokens
+        if over_budget or history.start_index > 0:
+            self._ensure_summary_loaded(session_id, history)
+
+        if not over_budget and not history.summary:
+            stats = ContextStats(original_tokens, original_tokens, 0, 0)
+            self._record(stats)
+            return messages, stats
+
+        keep_start = self._keep_window_start(messages)
+
+        summary = history.summary
+        covered = min(history.summary_upto, keep_start) if summary else 0
+        summary_block = (
+            {"text": f"<conversation_summary>\n{summary}\n</conversation_summary>"}
+            if summary else None
+        )
+        summary_tokens = estimate_tokens(summary_block["text"]) if summary_block else 0
+
+        # 從摘要涵蓋處開始，若仍超過預算則往後跳到下一則 user 訊息，但不進入保留視窗
+        start = covered
+        tail_tokens = sum(history.token_estimates[start:])
+        while start < keep_start and summary_tokens + tail_tokens > self.budget_tokens:
+            tail_tokens -= history.token_estimates[start]
+            start += 1
+            while start < keep_start and messages[start]["role"] != "user":
+                tail_tokens -= history.token_estimates[start]
+                start += 1
+
+        # 預算內只沿用既有摘要，不產生新摘要
+        if over_budget and covered < keep_start:
+            self._schedule_summary(session_id, history, keep_start)
+
+        window = list(messages[start:])
+        if summary_block:
+            first = window[0]
+            window[0] = {"role": first["role"], "content": [summary_block] + first["content"]}
+
+        stats = ContextStats(
+            original_tokens=original_tokens,
+            sent_tokens=summary_tokens + tail_tokens,
+            summarized_messages=covered,
+            dropped_messages=start - covered,
+        )
+        self._record(stats)
+        return window, stats
+
+    def _keep_window_start(self, messages: List[Dict]) -> int:
+        """回傳最近 keep_turns 輪的起點（必為 user 訊息）"""
+        user_seen = 0
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i]["role"] == "user":
+                user_seen += 1
+                if user_seen > self.keep_turns:
+                    return i
+        return 0
+
+    def _ensure_summary_loaded(self, session_id: str, history: ConverseHistory) -> None:
+        """第一次需要摘要時（超過預算或只載入尾段），從 metadata 讀回已持久化的摘要"""
+        if history.summary_loaded:
+            return
+        history.summary_loaded = True
+        meta = self.conv_service.get_session_meta(session_id)
+        if meta.get("summary"):
+            history.summary = meta["summary"]
+            if "summary_upto_index" in meta:
+                # 以會話的 message_index 記錄，只載入最近一段訊息時也能對應
+                history.summary_upto = history.position_of(int(meta["summary_upto_index"]))
+            else:
+                # 舊版 metadata 只記錄 messages 的位置
+                history.summary_upto = int(meta.get("summary_upto", 0))
+
+    def _schedule_summary(self, session_id: str, history: ConverseHistory, upto: int) -> None:
+        with _pending_lock:
+            if session_id in _pending:
+                return
+            _pending.add(session_id)
+
+        # 背景任務只使用排程當下的快照：下一次 rerun 可能就地重建 history（例如載入較早的訊息），
+        # 位置（messages 的 index）在重建後不再對應，截止點一律以會話的 message_index 表示
+        previous_summary = history.summary
+        folded = [
+            {"role": msg["role"], "content": list(msg["content"])}
+            for msg in history.messages[history.summary_upto if previous_summary else 0:upto]
+        ]
+        upto_index = history.message_index_at(upto)
+        _executor.submit(
+            self._run_summary, session_id, history, history.generation, previous_summary, folded, upto_index
+        )
+
+    def _run_summary(
+        self,
+        session_id: str,
+        history: ConverseHistory,
+        generation: int,
+        previous_summary: Optional[str],
+        folded: List[Dict],
+        upto_index: int,
+    ) -> None:
+        try:
+            summary = self.summarize(previous_summary, folded)
+            self.conv_service.update_session_meta(session_id, summary=summary, summary_upto_index=upto_index)
+            if history.generation == generation:
+                history.summary = summary
+                history.summary_upto = history.position_of(upto_index)
+            # 已重建的 history 尚未讀取摘要，下次需要時會從 metadata 讀回本次結果
+            metrics.context_summaries.add(1, {"status": "success"})
+            logger.info(
+                "Rolling summary updated",
+                extra={"session_id": session_id, "summary_upto_index": upto_index, "folded_messages": len(folded)}
+            )
+        except Exception as e:
+            metrics.context_summaries.add(1, {"status": "error"})
+            logger.error(
+                "Failed to update rolling summary",
+                extra={"session_id": session_id, "error": str(e)}
+            )
+        finally:
+            with _pending_lock:
+                _pending.discard(session_id)
+
+    @staticmethod
+    def _record(stats: ContextStats) -> None:
+        span = trace.get_current_span()
+        span.set_attribute("gen_ai.context.original_tokens", stats.original_tokens)
+        span.set_attribute("gen_ai.context.sent_tokens", stats.sent_tokens)
+        span.set_attribute("gen_ai.context.tokens_saved", stats.tokens_saved)
+        span.set_attribute("gen_ai.context.summarized_messages", stats.summarized_messages)
+        span.set_attribute("gen_ai.context.dropped_messages", stats.dropped_messages)
+
+        metrics.context_input_tokens.record(stats.sent_tokens)
+        metrics.context_tokens_saved.record(stats.tokens_saved)
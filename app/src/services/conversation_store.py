@@ -0,0 +1,425 @@
+# src/services/conversation_store.py
+"""
+對話儲存後端
+
+- dynamodb：ConversationService（正式環境）
+- sqlite：本機 SQLite 檔案（WAL），開發 / 單機部署，不需要 AWS
+- memory：行程內 dict，測試與壓測基準
+
+三者提供相同的方法（ConversationStore），由 AppConfig.conversation_store 選擇。
+"""
+import json
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Protocol, Tuple
+
+import pytz
+import streamlit as st
+
+from src.services.dynamodb_service import DEFAULT_USER_ID, decode_cursor, encode_cursor, session_title_for
+from src.services.logging import get_logger
+
+logger = get_logger()
+
+STORE_DYNAMODB = "dynamodb"
+STORE_SQLITE = "sqlite"
+STORE_MEMORY = "memory"
+
+
+class ConversationStore(Protocol):
+    """
+    對話儲存介面（UI、ContextWindowManager 與 ChatGateway 只依賴這些方法）
+
+    - 訊息以 (session_id, message_index) 定位，message_index 從 0 起連續遞增；重複寫入同一序號會覆寫
+    - 會話 metadata：session_title、created_at、last_active_at、message_count、token 用量，
+      以及 update_session_meta 寫入的任意欄位（例如滾動摘要）
+    - 讀取視窗回傳 (messages, 第一條消息的 message_index)；列表回傳 (sessions, 下一頁游標)
+    """
+
+    def create_session(self) -> str: ...
+
+    def save_message(self, session_id: str, message_index: int, role: str, content: str,
+                     session_title: Optional[str] = None, user_id: str = DEFAULT_USER_ID): ...
+
+    def save_messages(self, session_id: str, messages: List[Dict], start_index: int = 0,
+                      session_title: Optional[str] = None, user_id: str = DEFAULT_USER_ID): ...
+
+    def load_session(self, session_id: str) -> List[Dict]: ...
+
+    def load_session_tail(self, session_id: str, limit: int) -> Tuple[List[Dict], int]: ...
+
+    def load_messages_before(self, session_id: str, before_index: int, limit: int) -> Tuple[List[Dict], int]: ...
+
+    def list_sessions(self, limit: int = 10, cursor: Optional[str] = None,
+                      user_id: str = DEFAULT_USER_ID) -> Tuple[List[Dict], Optional[str]]: ...
+
+    def delete_session(self, session_id: str, user_id: str = DEFAULT_USER_ID): ...
+
+    def get_session_meta(self, session_id: str) -> Dict: ...
+
+    def update_session_meta(self, session_id: str, **fields): ...
+
+    def add_session_usage(self, session_id: str, input_tokens: int, output_tokens: int): ...
+
+    def close(self): ...
+
+
+class _LocalStore:
+    """本機後端共用的部分（session_id、時間戳記、列表游標）"""
+
+    def __init__(self):
+        self.tz = pytz.timezone("Asia/Taipei")
+
+    def create_session(self) -> str:
+        session_id = str(uuid.uuid4())
+        logger.info(f"Created new session: {session_id}")
+        return session_id
+
+    def save_message(
+        self,
+        session_id: str,
+        message_index: int,
+        role: str,
+        content: str,
+        session_title: Optional[str] = None,
+        user_id: str = DEFAULT_USER_ID,
+    ):
+        self.save_messages(
+            session_id,
+            [{"role": role, "content": content}],
+            start_index=message_index,
+            session_title=session_title,
+            user_id=user_id,
+        )
+
+    def save_messages(
+        self,
+        session_id: str,
+        messages: List[Dict],
+        start_index: int = 0,
+        session_title: Optional[str] = None,
+        user_id: str = DEFAULT_USER_ID,
+    ):
+        if not messages:
+            return
+        timestamp = datetime.now(self.tz).isoformat()
+        title = next(
+            (
+                session_title_for(start_index + offset, m["role"], m["content"], session_title)
+                for offset, m in enumerate(messages)
+                if start_index + offset == 1
+            ),
+            None,
+        )
+        rows = [
+            (start_index + offset, m["role"], m["content"])
+            for offset, m in enumerate(messages)
+        ]
+        self._write_messages(session_id, rows, timestamp, title, user_id)
+
+    def load_session(self, session_id: str) -> List[Dict]:
+        messages, _ = self._read_messages(session_id, None, None)
+        return messages
+
+    def load_session_tail(self, session_id: str, limit: int) -> Tuple[List[Dict], int]:
+        return self._read_messages(session_id, None, limit)
+
+    def load_messages_before(self, session_id: str, before_index: int, limit: int) -> Tuple[List[Dict], int]:
+        if before_index <= 0:
+            return [], 0
+        return self._read_messages(session_id, before_index, limit)
+
+    def list_sessions(
+        self,
+        limit: int = 10,
+        cursor: Optional[str] = None,
+        user_id: str = DEFAULT_USER_ID,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        after = None
+        if cursor:
+            position = decode_cursor(cursor)
+            after = (position["last_active_at"], position["session_id"])
+        # 多取一筆判斷是否有下一頁
+        sessions = self._read_sessions(user_id, limit + 1, after)
+        if len(sessions) <= limit:
+            return sessions, None
+        sessions = sessions[:limit]
+        last = sessions[-1]
+        return sessions, encode_cursor({"last_active_at": last["last_active_at"], "session_id": last["session_id"]})
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _window(rows: List[Tuple[int, str, str]]) -> Tuple[List[Dict], int]:
+        """依序號排序的 (message_index, role, content) 轉為讀取結果"""
+        messages = [{"role": role, "content": content} for _, role, content in rows]
+        return messages, (rows[0][0] if rows else 0)
+
+
+class InMemoryConversationStore(_LocalStore):
+    """行程內的對話儲存（不持久化）"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._messages: Dict[str, Dict[int, Tuple[str, str]]] = {}
+        self._meta: Dict[str, Dict] = {}
+
+    def _write_messages(self, session_id: str, rows: List[Tuple], timestamp: str, title: Optional[str], user_id: str):
+        with self._lock:
+            stored = self._messages.setdefault(session_id, {})
+            for message_index, role, content in rows:
+                stored[message_index] = (role, content)
+            meta = self._meta.setdefault(session_id, {})
+            meta.setdefault("created_at", timestamp)
+            meta.setdefault("session_title", "New Session")
+            meta.update(user_id=user_id, last_active_at=timestamp, message_count=rows[-1][0] + 1)
+            if title:
+                meta["session_title"] = title
+
+    def _read_messages(self, session_id: str, before_index: Optional[int], limit: Optional[int]):
+        with self._lock:
+            stored = self._messages.get(session_id, {})
+            indices = sorted(i for i in stored if before_index is None or i < before_index)
+            if limit is not None:
+                indices = indices[-limit:]
+            return self._window([(i, *stored[i]) for i in indices])
+
+    def _read_sessions(self, user_id: str, limit: int, after: Optional[Tuple[str, str]]) -> List[Dict]:
+        with self._lock:
+            candidates = [
+                (meta["last_active_at"], session_id, meta)
+                for session_id, meta in self._meta.items()
+                if meta.get("user_id") == user_id and "last_active_at" in meta
+            ]
+        candidates.sort(key=lambda entry: entry[:2], reverse=True)
+        if after is not None:
+            candidates = [entry for entry in candidates if entry[:2] < after]
+        return [
+            {
+                "session_id": session_id,
+                "session_title": meta["session_title"],
+                "created_at": meta["created_at"],
+                "last_active_at": last_active_at,
+                "message_count": meta["message_count"],
+            }
+            for last_active_at, session_id, meta in candidates[:limit]
+        ]
+
+    def delete_session(self, session_id: str, user_id: str = DEFAULT_USER_ID):
+        with self._lock:
+            self._messages.pop(session_id, None)
+            self._meta.pop(session_id, None)
+
+    def get_session_meta(self, session_id: str) -> Dict:
+        with self._lock:
+            return dict(self._meta.get(session_id, {}))
+
+    def update_session_meta(self, session_id: str, **fields):
+        with self._lock:
+            self._meta.setdefault(session_id, {}).update(fields)
+
+    def add_session_usage(self, session_id: str, input_tokens: int, output_tokens: int):
+        with self._lock:
+            meta = self._meta.setdefault(session_id, {})
+            for name, value in (("input_tokens", input_tokens), ("output_tokens", output_tokens), ("model_calls", 1)):
+                meta[name] = meta.get(name, 0) + value
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    session_id    TEXT    NOT NULL,
+    message_index INTEGER NOT NULL,
+    role          TEXT    NOT NULL,
+    content       TEXT    NOT NULL,
+    timestamp     TEXT    NOT NULL,
+    PRIMARY KEY (session_id, message_index)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id     TEXT    PRIMARY KEY,
+    user_id        TEXT    NOT NULL DEFAULT 'default',
+    session_title  TEXT    NOT NULL DEFAULT 'New Session',
+    created_at     TEXT,
+    last_active_at TEXT,
+    message_count  INTEGER NOT NULL DEFAULT 0,
+    input_tokens   INTEGER NOT NULL DEFAULT 0,
+    output_tokens  INTEGER NOT NULL DEFAULT 0,
+    model_calls    INTEGER NOT NULL DEFAULT 0,
+    -- update_session_meta 寫入的其他欄位（滾動摘要等），JSON 物件
+    extra          TEXT    NOT NULL DEFAULT '{}'
+);
+
+-- 會話列表：依使用者、最近活動降序分頁（對應 DynamoDB 的 sparse GSI）
+CREATE INDEX IF NOT EXISTS sessions_by_user
+    ON sessions (user_id, last_active_at DESC, session_id DESC)
+    WHERE last_active_at IS NOT NULL;
+"""
+
+# sessions 表的欄位；update_session_meta 的其他欄位存放於 extra
+_SESSION_COLUMNS = ("user_id", "session_title", "created_at", "last_active_at", "message_count",
+                    "input_tokens", "output_tokens", "model_calls")
+
+
+class SQLiteConversationStore(_LocalStore):
+    """
+    以 SQLite（WAL）儲存對話
+
+    整個 process 共用一個連線，讀寫都以鎖序列化（Streamlit 每次 rerun 都在新的執行緒上，
+    依執行緒建立連線會不斷累積連線與檔案描述子）。本機單一 process 的查詢都在毫秒內，序列化的成本很小；
+    WAL 讓其他 process（例如工具程式）的讀取不被寫入阻擋，busy_timeout 讓跨 process 的寫入等待而不是立即失敗。
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: 資料庫檔案路徑（不存在時建立）
+        """
+        super().__init__()
+        self.path = path
+        # RLock：_write 內的查詢與交易外的讀取共用同一把鎖
+        self._lock = threading.RLock()
+        # isolation_level=None：交易由 _write 明確控制
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 下 NORMAL 只在 checkpoint 時 fsync；斷電最多遺失最後幾筆交易，不會損毀資料庫
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        # executescript 自行提交，不放在 _write 的交易內
+        self._conn.executescript(SQLITE_SCHEMA)
+        logger.info(f"SQLiteConversationStore initialized with database: {path}")
+
+    def _query(self, query: str, params) -> List[Tuple]:
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _write_messages(self, session_id: str, rows: List[Tuple], timestamp: str, title: Optional[str], user_id: str):
+        with self._write() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO messages (session_id, message_index, role, content, timestamp)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(session_id, message_index, role, content, timestamp) for message_index, role, content in rows],
+            )
+            conn.execute(
+                "INSERT INTO sessions (session_id, user_id, session_title, created_at, last_active_at, message_count)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (session_id) DO UPDATE SET"
+                "  user_id = excluded.user_id,"
+                "  created_at = COALESCE(sessions.created_at, excluded.created_at),"
+                "  last_active_at = excluded.last_active_at,"
+                "  message_count = excluded.message_count,"
+                "  session_title = CASE WHEN ? THEN excluded.session_title ELSE sessions.session_title END",
+                (session_id, user_id, title or "New Session", timestamp, timestamp, rows[-1][0] + 1, title is not None),
+            )
+
+    def _read_messages(self, session_id: str, before_index: Optional[int], limit: Optional[int]):
+        query = "SELECT message_index, role, content FROM messages WHERE session_id = ?"
+        params: list = [session_id]
+        if before_index is not None:
+            query += " AND message_index < ?"
+            params.append(before_index)
+        if limit is None:
+            query += " ORDER BY message_index"
+        else:
+            # 由新到舊取 limit 條（主鍵倒序掃描），再轉回升序
+            query += " ORDER BY message_index DESC LIMIT ?"
+            params.append(limit)
+        rows = self._query(query, params)
+        if limit is not None:
+            rows.reverse()
+        return self._window(rows)
+
+    def _read_sessions(self, user_id: str, limit: int, after: Optional[Tuple[str, str]]) -> List[Dict]:
+        query = (
+            "SELECT session_id, session_title, created_at, last_active_at, message_count FROM sessions"
+            " WHERE user_id = ? AND last_active_at IS NOT NULL"
+        )
+        params: list = [user_id]
+        if after is not None:
+            query += " AND (last_active_at, session_id) < (?, ?)"
+            params.extend(after)
+        query += " ORDER BY last_active_at DESC, session_id DESC LIMIT ?"
+        params.append(limit)
+        rows = self._query(query, params)
+        return [
+            {
+                "session_id": session_id,
+                "session_title": session_title,
+                "created_at": created_at,
+                "last_active_at": last_active_at,
+                "message_count": message_count,
+            }
+            for session_id, session_title, created_at, last_active_at, message_count in rows
+        ]
+
+    def delete_session(self, session_id: str, user_id: str = DEFAULT_USER_ID):
+        with self._write() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        logger.info(f"Deleted session from SQLite", extra={"session_id": session_id})
+
+    def get_session_meta(self, session_id: str) -> Dict:
+        rows = self._query(
+            f"SELECT {', '.join(_SESSION_COLUMNS)}, extra FROM sessions WHERE session_id = ?",
+            (session_id,),
+        )
+        if not rows:
+            return {}
+        row = rows[0]
+        meta = {name: value for name, value in zip(_SESSION_COLUMNS, row) if value is not None}
+        meta.update(json.loads(row[-1]))
+        return meta
+
+    def update_session_meta(self, session_id: str, **fields):
+        if not fields:
+            return
+        columns = {name: value for name, value in fields.items() if name in _SESSION_COLUMNS}
+        extra = {name: value for name, value in fields.items() if name not in _SESSION_COLUMNS}
+        with self._write() as conn:
+            conn.execute("INSERT OR IGNORE INTO sessions (session_id) VALUES (?)", (session_id,))
+            assignments = [f"{name} = ?" for name in columns]
+            params = list(columns.values())
+            if extra:
+                # json_patch 合併：只覆寫傳入的欄位
+                assignments.append("extra = json_patch(extra, ?)")
+                params.append(json.dumps(extra, ensure_ascii=False))
+            conn.execute(f"UPDATE sessions SET {', '.join(assignments)} WHERE session_id = ?", (*params, session_id))
+
+    def add_session_usage(self, session_id: str, input_tokens: int, output_tokens: int):
+        with self._write() as conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, input_tokens, output_tokens, model_calls) VALUES (?, ?, ?, 1)"
+                " ON CONFLICT (session_id) DO UPDATE SET"
+                "  input_tokens = input_tokens + excluded.input_tokens,"
+                "  output_tokens = output_tokens + excluded.output_tokens,"
+                "  model_calls = model_calls + 1",
+                (session_id, input_tokens, output_tokens),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+@st.cache_resource
+def get_local_conversation_store(backend: str, sqlite_path: str = "") -> ConversationStore:
+    """行程內共用同一個本機對話儲存（sqlite / memory）"""
+    if backend == STORE_SQLITE:
+        return SQLiteConversationStore(sqlite_path)
+    if backend == STORE_MEMORY:
+        return InMemoryConversationStore()
+    raise ValueError(f"Unknown conversation store: {backend}")
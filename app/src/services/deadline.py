@@ -0,0 +1,177 @@
+# src/services/deadline.py
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Callable, Generic, Iterator, Optional, TypeVar
+
+from opentelemetry import context as otel_context
+from opentelemetry import trace
+
+from src.services import metrics
+
+T = TypeVar("T")
+
+DEADLINE_MESSAGE = "The assistant took too long to respond. Please try again."
+
+# deadline 存在 OTel context 中：single-flight / hedging 的背景執行緒已經會帶上 OTel context，
+# 不需要另外傳遞
+_DEADLINE_KEY = otel_context.create_key("chatbot.deadline")
+
+# before-send hook 的 stage：此時請求尚未送出
+SEND_STAGE = "bedrock.send"
+
+# 有 deadline 的阻塞呼叫在此執行，呼叫端最多只等到 deadline（逾時的呼叫在背景自然結束）
+_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="deadline-call")
+
+
+class DeadlineExceeded(Exception):
+    """本輪的 deadline 已過，不再等待或重試模型呼叫"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"turn deadline exceeded during {stage}")
+        self.stage = stage
+        self.user_message = DEADLINE_MESSAGE
+
+
+@contextmanager
+def deadline_scope(seconds: float) -> Iterator[float]:
+    """
+    設定本輪對話的 deadline（單調時鐘的絕對時間）；已有較早的 deadline 時沿用較早者
+
+    :param seconds: 從現在起的可用時間，<= 0 表示不設 deadline
+    """
+    if seconds <= 0:
+        yield float("inf")
+        return
+    deadline = time.monotonic() + seconds
+    current = otel_context.get_value(_DEADLINE_KEY)
+    if current is not None:
+        deadline = min(deadline, current)
+
+    token = otel_context.attach(otel_context.set_value(_DEADLINE_KEY, deadline))
+    try:
+        yield deadline
+    finally:
+        otel_context.detach(token)
+
+
+def remaining() -> Optional[float]:
+    """本輪剩餘秒數；沒有 deadline 時回傳 None"""
+    deadline = otel_context.get_value(_DEADLINE_KEY)
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check(stage: str) -> None:
+    """deadline 已過時拋出 DeadlineExceeded"""
+    left = remaining()
+    if left is not None and left <= 0:
+        _exceeded(stage)
+
+
+def run_with_deadline(fn: Callable[[], T], stage: str) -> T:
+    """
+    在 deadline 內執行阻塞呼叫；逾時時呼叫端立即收到 DeadlineExceeded
+
+    botocore 不支援單次呼叫的逾時設定，逾時的呼叫會在背景執行到 client 的 read_timeout，
+    但 Streamlit session 執行緒不會被佔住。
+    """
+    left = remaining()
+    if left is None:
+        return fn()
+    return run_with_timeout(fn, left, stage)
+
+
+def run_with_timeout(fn: Callable[[], T], timeout: float, stage: str) -> T:
+    """
+    最多等待 timeout 秒的單次阻塞呼叫（在共用執行緒池執行）；逾時時拋出 DeadlineExceeded，timeout 為 None 時直接執行
+
+    不適用於逐一讀取的串流：每個事件都經過執行緒池會佔滿 _executor，改用 TimedIterator。
+    """
+    if timeout is None:
+        return fn()
+    if timeout <= 0:
+        _exceeded(stage)
+
+    ctx = otel_context.get_current()
+
+    def task() -> T:
+        token = otel_context.attach(ctx)
+        try:
+            return fn()
+        finally:
+            otel_context.detach(token)
+
+    future = _executor.submit(task)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        _exceeded(stage)
+
+
+class TimedIterator(Generic[T]):
+    """
+    以專屬的讀取執行緒消費阻塞的 iterator（例如 ConverseStream 的事件），呼叫端每次最多等待 timeout 秒
+
+    每個串流一條執行緒，讀到的項目放進佇列，逾時只作用在 queue.get 上：
+    不佔用共用的 _executor，長串流或大量同時串流也不會讓其他呼叫排隊。
+    逾時後由呼叫端關閉底層串流，讀取執行緒隨之收到錯誤並結束。
+    """
+
+    _END = object()
+
+    def __init__(self, iterable):
+        self._items: "queue.Queue" = queue.Queue()
+        self._done = False
+        self._reader = threading.Thread(
+            target=self._read, args=(iter(iterable),), name="stream-reader", daemon=True
+        )
+        self._reader.start()
+
+    def _read(self, iterator) -> None:
+        try:
+            for item in iterator:
+                self._items.put((item, None))
+        except Exception as e:
+            self._items.put((self._END, e))
+            return
+        self._items.put((self._END, None))
+
+    def next(self, timeout: Optional[float], stage: str) -> Optional[T]:
+        """
+        取得下一個項目，iterator 結束時回傳 None；讀取時的例外在呼叫端重新拋出
+
+        :param timeout: 最多等待秒數，None 表示不限制；逾時時拋出 DeadlineExceeded
+        """
+        if self._done:
+            return None
+        if timeout is not None and timeout <= 0:
+            _exceeded(stage)
+        try:
+            item, error = self._items.get(timeout=timeout)
+        except queue.Empty:
+            _exceeded(stage)
+        if item is self._END:
+            self._done = True
+            if error is not None:
+                raise error
+            return None
+        return item
+
+
+def enforce_deadline(request=None, **kwargs) -> None:
+    """
+    botocore before-send hook：每次 HTTP 嘗試（含重試）送出前檢查 deadline
+
+    deadline 已過時不再送出，拋出的例外不在 botocore 的重試範圍內，重試序列立即結束。
+    """
+    check(SEND_STAGE)
+
+
+def _exceeded(stage: str) -> None:
+    span = trace.get_current_span()
+    span.add_event("deadline.exceeded", {"stage": stage})
+    metrics.deadline_exceeded.add(1, {"stage": stage})
+    raise DeadlineExceeded(stage)
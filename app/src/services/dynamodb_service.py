@@ -1,26 +1,173 @@
+import base64
+import json
+import threading
+import zlib
 import boto3
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Tuple
 import pytz
+import streamlit as st
+from botocore.exceptions import ClientError
 from src.services.logging import get_logger
+from src.services import metrics
+from src.services.message_codec import (
+    CODEC_ATTRIBUTES,
+    MessageDecodeError,
+    chunk_data,
+    chunk_items,
+    chunk_partition,
+    decode_content,
+    decode_segment,
+    encode_content,
+    encode_segment,
+    segment_partition,
+)
+from src.services.response_cache import LRUCache
+from src.services.write_behind import WriteBehindQueue, build_update_kwargs, record_consumed_capacity
 
 logger = get_logger()
 
+# 會話 metadata 存放於同一 partition 的 message_index = -1（不會被 load_session 讀到）：
+# 標題、created_at、last_active_at、message_count、token 用量與滾動摘要
+SESSION_META_INDEX = -1
+
+# 會話列表的 sparse GSI：只有 metadata item 帶 session_list_pk / last_active_at，訊息 item 不會進入索引。
+# partition key 為 "{user_id}#{shard}"，同一使用者的會話分散到多個 GSI partition（寫入不集中在單一熱 partition）
+SESSION_LIST_INDEX = 'session_list_pk-last_active_at-index'
+
+# 沒有登入資訊時的使用者 ID
+DEFAULT_USER_ID = 'default'
+
+# 訊息內容無法還原時顯示的文字（不讓整個會話載入失敗）
+UNREADABLE_MESSAGE = '[This message could not be loaded.]'
+
+
+def session_title_for(message_index: int, role: str, content: str, session_title: Optional[str]) -> Optional[str]:
+    """第一條用戶消息（message_index == 1）作為會話標題；其他訊息不改變標題"""
+    if message_index == 1 and role == 'user':
+        return session_title or content[:50]
+    return None
+
+
+# list_sessions 並行查詢各 shard
+_shard_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="session-index")
+
+# 會話區段壓縮在背景執行；同一會話同時只會有一個壓縮任務
+_compaction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-compaction")
+_compacting: set = set()
+_compacting_lock = threading.Lock()
+
+
+def shutdown_compactor() -> None:
+    """等待進行中的會話區段壓縮完成（行程結束時呼叫）"""
+    _compaction_executor.shutdown(wait=True)
+
+
+class ReadThroughCache:
+    """
+    以群組（使用者 / 會話）為單位失效的 read-through 快取（LRU + TTL）
+
+    每個群組有一個世代號，寫入時設為全域遞增的新值；快取值帶著讀取開始時的世代號，
+    世代不符即視為未命中。讀取期間發生的寫入因此不會被較舊的結果覆蓋。
+
+    世代號最多保留 max_entries 個群組（LRU）；被淘汰的群組改用 _floor（淘汰過的最大世代號），
+    失效前載入的快取值世代號必定小於它，不會誤命中，只是多一次未命中。
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl_seconds: float):
+        self.name = name
+        self.enabled = max_entries > 0 and ttl_seconds > 0
+        self._lru = LRUCache(max(max_entries, 1), ttl_seconds, name=name)
+        self._lock = threading.Lock()
+        self._max_groups = max(max_entries, 1)
+        self._generations: "OrderedDict[str, int]" = OrderedDict()
+        self._clock = 0
+        self._floor = 0
+
+    def get_or_load(self, group: str, key: str, loader: Callable):
+        """命中時回傳快取值；否則呼叫 loader（拋出例外時不快取）"""
+        if not self.enabled:
+            return loader()
+
+        entry_key = f"{group}#{key}"
+        with self._lock:
+            generation = self._generations.get(group, self._floor)
+        cached = self._lru.get(entry_key)
+        if cached is not None and cached[0] == generation:
+            metrics.session_cache_lookups.add(1, {"cache": self.name, "result": "hit"})
+            return cached[1]
+
+        metrics.session_cache_lookups.add(1, {"cache": self.name, "result": "miss"})
+        value = loader()
+        self._lru.put(entry_key, (generation, value))
+        return value
+
+    def invalidate(self, group: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._clock += 1
+            self._generations[group] = self._clock
+            self._generations.move_to_end(group)
+            while len(self._generations) > self._max_groups:
+                _, evicted = self._generations.popitem(last=False)
+                self._floor = max(self._floor, evicted)
+        metrics.session_cache_invalidations.add(1, {"cache": self.name})
+
 
 class ConversationService:
     """對話持久化服務"""
 
-    def __init__(self, table_name: str, region: str = "ap-northeast-1"):
+    def __init__(
+        self,
+        table_name: str,
+        region: str = "ap-northeast-1",
+        write_behind: bool = False,
+        cache_max_entries: int = 0,
+        cache_ttl_seconds: float = 0,
+        session_index_shards: int = 1,
+        compress_threshold: int = 2048,
+        max_inline_bytes: int = 350_000,
+        segment_size: int = 0,
+        segment_keep_open: int = 50,
+    ):
         """
         初始化 DynamoDB 對話服務
 
         :param table_name: DynamoDB 表名
         :param region: AWS 區域
+        :param write_behind: True 時 save_message 只放入背景佇列，批次寫入 DynamoDB
+        :param cache_max_entries: 會話列表 / 歷史讀取快取的容量，0 表示不快取
+        :param cache_ttl_seconds: 快取有效時間（其他 Pod 的寫入最多延遲這麼久才看得到）
+        :param session_index_shards: 會話列表 GSI 的 shard 數（只能調大，調小會讀不到較大 shard 的會話）
+        :param compress_threshold: 內容超過此位元組數時以 zlib 壓縮後存為 Binary
+        :param max_inline_bytes: 壓縮後仍超過此大小時拆成 chunk item（DynamoDB 單一 item 上限 400 KB）
+        :param segment_size: 每 N 則已結束的訊息在背景壓縮為一個區段 item，0 表示不在 App 內壓縮
+        :param segment_keep_open: 最近這麼多則訊息不壓縮（開啟會話的尾段讀取不需讀區段）
         """
         self.dynamodb = boto3.resource('dynamodb', region_name=region)
         self.table = self.dynamodb.Table(table_name)
         self.tz = pytz.timezone("Asia/Taipei")
+        self.session_index_shards = max(1, session_index_shards)
+        self.compress_threshold = compress_threshold
+        self.max_inline_bytes = max_inline_bytes
+        self.segment_size = segment_size
+        self.segment_keep_open = segment_keep_open
+        self.write_queue = None
+        # 本 Pod 的寫入 / 刪除立即失效對應的快取；Streamlit rerun 不再重複查詢 DynamoDB
+        self.session_list_cache = ReadThroughCache("session_list", cache_max_entries, cache_ttl_seconds)
+        self.history_cache = ReadThroughCache("session_history", cache_max_entries, cache_ttl_seconds)
+        if write_behind:
+            self.write_queue = WriteBehindQueue(
+                self.table,
+                ('session_id', 'message_index'),
+                # metadata 寫入後會話列表（GSI）才會改變，此時再失效一次
+                on_updated=lambda key, fields: self.session_list_cache.invalidate(fields.get('user_id', DEFAULT_USER_ID)),
+            )
+            self.write_queue.install_shutdown_hooks()
         logger.info(f"ConversationService initialized with table: {table_name}")
 
     def create_session(self) -> str:
@@ -39,7 +186,8 @@ class ConversationService:
         message_index: int,
         role: str,
         content: str,
-        session_title: Optional[str] = None
+        session_title: Optional[str] = None,
+        user_id: str = DEFAULT_USER_ID,
     ):
         """
         保存單條消息到 DynamoDB
@@ -49,29 +197,23 @@ class ConversationService:
         :param role: 角色 (user 或 assistant)
         :param content: 消息內容
         :param session_title: 會話標題（僅第一條消息需要）
+        :param user_id: 會話擁有者
         """
-        timestamp = datetime.now(self.tz).isoformat()
-
-        item = {
-            'session_id': session_id,
-            'message_index': message_index,
-            'role': role,
-            'content': content,
-            'timestamp': timestamp,
-            'user_id': 'default'  # 未來可擴展為真實用戶 ID
-        }
+        items = self._build_message_items(session_id, message_index, role, content, user_id)
+        item = items[-1]
 
-        # 如果是第一條消息（助手的歡迎語），設置 created_at 和 session_title
-        # 如果是第二條消息（第一條用戶消息），更新 session_title
-        if message_index == 0:
-            item['created_at'] = timestamp
-            item['session_title'] = 'New Session'
-        elif message_index == 1 and role == 'user':
-            # 第一條用戶消息，設置為會話標題
-            item['session_title'] = session_title or content[:50]
+        if self.write_queue is not None:
+            # 不阻塞請求執行緒；寫入失敗由佇列重試並記錄
+            for pending in items:
+                self.write_queue.put(pending)
+            self._touch_session(item, title=session_title_for(message_index, role, content, session_title))
+            self._schedule_compaction(session_id, message_index, message_index + 1)
+            return
 
         try:
-            self.table.put_item(Item=item)
+            self._write_items(items)
+            self._touch_session(item, title=session_title_for(message_index, role, content, session_title))
+            self._schedule_compaction(session_id, message_index, message_index + 1)
             logger.info(
                 f"Saved message to DynamoDB",
                 extra={
@@ -90,75 +232,826 @@ class ConversationService:
             )
             raise
 
-    def load_session(self, session_id: str) -> List[Dict]:
+    def save_messages(
+        self,
+        session_id: str,
+        messages: List[Dict],
+        start_index: int = 0,
+        session_title: Optional[str] = None,
+        user_id: str = DEFAULT_USER_ID,
+    ):
         """
-        加載會話的所有消息
+        一次保存多條連續消息（例如新會話的歡迎語 + 第一條用戶消息）
 
         :param session_id: 會話 ID
-        :return: 消息列表 [{"role": "user", "content": "..."}]
+        :param messages: [{"role": "...", "content": "..."}]，序號從 start_index 起算
+        :param start_index: 第一條消息的序號
+        :param session_title: 會話標題（寫在第一條用戶消息上）
+        :param user_id: 會話擁有者
         """
+        items = [
+            built
+            for offset, m in enumerate(messages)
+            for built in self._build_message_items(session_id, start_index + offset, m["role"], m["content"], user_id)
+        ]
+
+        if not items:
+            return
+        title = next(
+            (
+                session_title_for(start_index + offset, m["role"], m["content"], session_title)
+                for offset, m in enumerate(messages)
+                if start_index + offset == 1
+            ),
+            None,
+        )
+
+        if self.write_queue is not None:
+            for item in items:
+                self.write_queue.put(item)
+            self._touch_session(items[-1], title=title)
+            self._schedule_compaction(session_id, start_index, start_index + len(messages))
+            return
+
         try:
-            response = self.table.query(
-                KeyConditionExpression='session_id = :sid',
-                ExpressionAttributeValues={':sid': session_id},
-                ScanIndexForward=True  # 按 message_index 升序
+            self._write_items(items)
+            self._touch_session(items[-1], title=title)
+            self._schedule_compaction(session_id, start_index, start_index + len(messages))
+            logger.info(
+                f"Saved messages to DynamoDB",
+                extra={"session_id": session_id, "message_count": len(messages)}
+            )
+        except Exception as e:
+            logger.error(
+                f"Failed to save messages to DynamoDB",
+                extra={"session_id": session_id, "error": str(e)}
             )
+            raise
 
-            messages = [
-                {"role": item["role"], "content": item["content"]}
-                for item in response['Items']
-            ]
+    def _build_message_items(
+        self,
+        session_id: str,
+        message_index: int,
+        role: str,
+        content: str,
+        user_id: str = DEFAULT_USER_ID,
+    ) -> List[Dict]:
+        """
+        組出訊息要寫入的 item：拆分過的訊息先列出 chunk item，訊息 item 一定在最後
 
+        內容經 message_codec 編碼（超過門檻壓縮、超過單一 item 上限拆分）
+        """
+        timestamp = datetime.now(self.tz).isoformat()
+        encoded = encode_content(
+            content, compress_threshold=self.compress_threshold, max_inline_bytes=self.max_inline_bytes
+        )
+        encoding = encoded.attributes.get('encoding', 'plain')
+        metrics.message_stored_bytes.record(encoded.stored_bytes, {"encoding": encoding})
+        if encoded.original_bytes > encoded.stored_bytes:
+            metrics.message_bytes_saved.add(encoded.original_bytes - encoded.stored_bytes, {"encoding": encoding})
+
+        # 標題與 created_at 只寫在會話 metadata item（_touch_session），訊息 item 不重複保存
+        item = {
+            'session_id': session_id,
+            'message_index': message_index,
+            'role': role,
+            'timestamp': timestamp,
+            'user_id': user_id,
+            **encoded.attributes,
+        }
+        return chunk_items(session_id, message_index, encoded.chunks) + [item]
+
+    def _write_items(self, items: List[Dict]):
+        """同步寫入（write-through）；chunk item 先寫，讀取端不會看到缺 chunk 的訊息"""
+        chunks = [item for item in items if 'data' in item]
+        messages = [item for item in items if 'data' not in item]
+        if chunks:
+            with self.table.batch_writer() as batch:
+                for item in chunks:
+                    batch.put_item(Item=item)
+        if len(messages) == 1:
+            response = self.table.put_item(Item=messages[0], ReturnConsumedCapacity='TOTAL')
+            record_consumed_capacity('PutItem', response)
+        else:
+            with self.table.batch_writer() as batch:
+                for item in messages:
+                    batch.put_item(Item=item)
+
+    def close(self):
+        """寫完 write-behind 佇列（行程結束時呼叫）"""
+        if self.write_queue is not None:
+            self.write_queue.close()
+
+    def _touch_session(self, item: Dict, title: Optional[str] = None):
+        """
+        依最新寫入的訊息更新會話 metadata（last_active_at、message_count，以及標題 / created_at）
+
+        :param item: 最新寫入的訊息 item
+        :param title: 會話標題（第一條用戶消息寫入時提供）
+
+        message_count 以訊息序號推得，重複寫入同一則訊息結果不變；write-behind 模式下與訊息一起在背景寫入
+        """
+        set_fields = {
+            'user_id': item['user_id'],
+            'session_list_pk': self.session_list_key(item['user_id'], item['session_id']),
+            'last_active_at': item['timestamp'],
+            'message_count': int(item['message_index']) + 1,
+        }
+        default_fields = {'created_at': item['timestamp']}
+        if title:
+            set_fields['session_title'] = title
+        else:
+            default_fields['session_title'] = 'New Session'
+
+        key = (item['session_id'], SESSION_META_INDEX)
+        try:
+            if self.write_queue is not None:
+                self.write_queue.update(key, set_fields, default_fields)
+            else:
+                response = self.table.update_item(
+                    Key={'session_id': item['session_id'], 'message_index': SESSION_META_INDEX},
+                    ReturnConsumedCapacity='TOTAL',
+                    **build_update_kwargs(set_fields, default_fields),
+                )
+                record_consumed_capacity('UpdateItem', response)
+        finally:
+            # 訊息已寫入（或已在佇列中），metadata 更新失敗也要失效
+            self._invalidate(item['session_id'], item['user_id'])
+
+    def session_list_key(self, user_id: str, session_id: str) -> str:
+        """會話在列表 GSI 中的 partition key（以 crc32 固定分配 shard，跨行程一致）"""
+        shard = zlib.crc32(session_id.encode()) % self.session_index_shards
+        return f"{user_id}#{shard}"
+
+    def _invalidate(self, session_id: str, user_id: str = DEFAULT_USER_ID):
+        self.history_cache.invalidate(session_id)
+        self.session_list_cache.invalidate(user_id)
+
+    def delete_session(self, session_id: str, user_id: str = DEFAULT_USER_ID):
+        """
+        刪除會話的所有 item（訊息與 metadata）
+
+        :param session_id: 會話 ID
+        :param user_id: 會話擁有者（失效其會話列表快取）
+        """
+        if self.write_queue is not None:
+            # 先寫完尚未寫入的訊息，避免刪除後又被背景佇列寫回
+            self.write_queue.flush()
+
+        try:
+            query_kwargs = {
+                'KeyConditionExpression': 'session_id = :sid',
+                'ExpressionAttributeValues': {':sid': session_id},
+                'ProjectionExpression': 'session_id, message_index, chunks',
+            }
+            deleted = 0
+            with self.table.batch_writer() as batch:
+                # 訊息與 metadata，以及壓縮過的區段
+                for partition in (session_id, segment_partition(session_id)):
+                    query_kwargs['ExpressionAttributeValues'] = {':sid': partition}
+                    query_kwargs.pop('ExclusiveStartKey', None)
+                    while True:
+                        response = self.table.query(**query_kwargs)
+                        deleted += self._delete_with_chunks(batch, partition, response['Items'])
+                        last_key = response.get('LastEvaluatedKey')
+                        if not last_key:
+                            break
+                        query_kwargs['ExclusiveStartKey'] = last_key
+            logger.info(
+                f"Deleted session from DynamoDB",
+                extra={"session_id": session_id, "items": deleted}
+            )
+        except Exception as e:
+            logger.error(
+                f"Failed to delete session from DynamoDB",
+                extra={"session_id": session_id, "error": str(e)}
+            )
+            raise
+        finally:
+            self._invalidate(session_id, user_id)
+
+    @staticmethod
+    def _delete_with_chunks(batch, partition: str, items: List[Dict]) -> int:
+        """刪除 item 及其 chunk item（拆分過的內容在獨立的 partition）；回傳刪除的 item 數"""
+        deleted = 0
+        for item in items:
+            batch.delete_item(Key={'session_id': partition, 'message_index': item['message_index']})
+            deleted += 1
+            chunks = chunk_partition(partition, int(item['message_index']))
+            for number in range(int(item.get('chunks', 0))):
+                batch.delete_item(Key={'session_id': chunks, 'message_index': number})
+                deleted += 1
+        return deleted
+
+    def load_session(self, session_id: str) -> List[Dict]:
+        """
+        加載會話的所有消息（依 LastEvaluatedKey 分頁，超過 1MB 的會話也完整讀取）
+
+        :param session_id: 會話 ID
+        :return: 消息列表 [{"role": "user", "content": "..."}]
+        """
+        messages, _ = self._load_messages(session_id)
+        return messages
+
+    def load_session_tail(self, session_id: str, limit: int) -> Tuple[List[Dict], int]:
+        """
+        只加載最近 limit 條消息（倒序查詢 + Limit，讀取量與會話長度無關）
+
+        :param session_id: 會話 ID
+        :param limit: 消息數上限
+        :return: (消息列表, 第一條消息的 message_index)；更早的消息以 load_messages_before 取得
+        """
+        return self._load_messages(session_id, limit=limit)
+
+    def load_messages_before(self, session_id: str, before_index: int, limit: int) -> Tuple[List[Dict], int]:
+        """
+        加載 before_index 之前的 limit 條消息（使用者往上捲動時）
+
+        :return: (消息列表, 第一條消息的 message_index)
+        """
+        return self._load_messages(session_id, before_index=before_index, limit=limit)
+
+    def _load_messages(
+        self,
+        session_id: str,
+        before_index: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[Dict], int]:
+        """
+        依 message_index 範圍讀取消息，只投影 role / content
+
+        limit 為 None 時升序讀完整個範圍；否則由新到舊讀取 limit 條，再依序號排序。
+        """
+        if before_index is not None and before_index <= 0:
+            return [], 0
+
+        try:
+            messages, first_index = self.history_cache.get_or_load(
+                session_id,
+                f"{before_index}#{limit}",
+                lambda: self._query_messages(session_id, before_index, limit),
+            )
             logger.info(
                 f"Loaded session from DynamoDB",
-                extra={"session_id": session_id, "message_count": len(messages)}
+                extra={
+                    "session_id": session_id,
+                    "message_count": len(messages),
+                    "before_index": before_index,
+                }
             )
-            return messages
+            # 回傳副本：呼叫端（session_state）會附加新訊息
+            return [dict(m) for m in messages], first_index
 
         except Exception as e:
             logger.error(
                 f"Failed to load session from DynamoDB",
                 extra={"session_id": session_id, "error": str(e)}
             )
-            return []
+            return [], 0
 
-    def list_sessions(self, limit: int = 10) -> List[Dict]:
+    def _query_messages(
+        self,
+        session_id: str,
+        before_index: Optional[int],
+        limit: Optional[int],
+    ) -> Tuple[List[Dict], int]:
+        key_condition = 'session_id = :sid AND message_index >= :first'
+        values = {':sid': session_id, ':first': 0}
+        if before_index is not None:
+            key_condition = 'session_id = :sid AND message_index BETWEEN :first AND :last'
+            values[':last'] = before_index - 1
+
+        query_kwargs = {
+            'KeyConditionExpression': key_condition,
+            'ExpressionAttributeValues': values,
+            # role 是 DynamoDB 保留字
+            'ProjectionExpression': ', '.join(('message_index', '#role') + CODEC_ATTRIBUTES),
+            'ExpressionAttributeNames': {'#role': 'role'},
+            'ScanIndexForward': limit is None,
+            'ReturnConsumedCapacity': 'TOTAL',
+        }
+
+        items = []
+        while True:
+            if limit is not None:
+                query_kwargs['Limit'] = limit - len(items)
+            response = self.table.query(**query_kwargs)
+            record_consumed_capacity('Query', response)
+            items.extend(response['Items'])
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key or (limit is not None and len(items) >= limit):
+                break
+            query_kwargs['ExclusiveStartKey'] = last_key
+
+        by_index = {int(item['message_index']): item for item in items}
+        if self.write_queue is not None:
+            # 合併本 Pod 尚未寫入的訊息（read-your-writes）
+            for item in self.write_queue.pending_items(session_id):
+                index = int(item['message_index'])
+                if index >= 0 and (before_index is None or index < before_index):
+                    by_index[index] = item
+        if self._has_gap(by_index, limit):
+            self._fill_from_segments(session_id, by_index, before_index, limit)
+
+        indices = sorted(by_index)
+        if limit is not None:
+            indices = indices[-limit:]
+        messages = [
+            {"role": by_index[index]["role"], "content": self._decode(session_id, index, by_index[index])}
+            for index in indices
+        ]
+        return messages, (indices[0] if indices else 0)
+
+    @staticmethod
+    def _has_gap(by_index: Dict[int, Dict], limit: Optional[int]) -> bool:
+        """讀到的訊息不連續，或最前面還缺訊息（可能已壓縮為區段）"""
+        if not by_index:
+            return True
+        low, high = min(by_index), max(by_index)
+        if high - low + 1 != len(by_index):
+            return True
+        return low > 0 and (limit is None or len(by_index) < limit)
+
+    def _fill_from_segments(
+        self,
+        session_id: str,
+        by_index: Dict[int, Dict],
+        before_index: Optional[int],
+        limit: Optional[int],
+    ):
+        """
+        以會話區段補上已壓縮的訊息（compacted_upto 以下以區段為準，忽略壓縮中斷時殘留的原訊息）
+        """
+        response = self.table.get_item(
+            Key={'session_id': session_id, 'message_index': SESSION_META_INDEX},
+            ProjectionExpression='compacted_upto, segment_manifest',
+            ReturnConsumedCapacity='TOTAL',
+        )
+        record_consumed_capacity('GetItem', response)
+        meta = response.get('Item', {})
+        compacted = int(meta.get('compacted_upto', 0))
+        if not compacted:
+            return
+
+        for index in [index for index in by_index if index < compacted]:
+            del by_index[index]
+        high = compacted if before_index is None else min(compacted, before_index)
+        low = 0 if limit is None else max(0, high - (limit - len(by_index)))
+        ends = {
+            int(segment['start']): int(segment['end']) for segment in meta.get('segment_manifest', [])
+            if int(segment['start']) < high and int(segment['end']) > low
+        }
+        starts = list(ends)
+        if not starts:
+            return
+
+        partition = segment_partition(session_id)
+        query_kwargs = {
+            'KeyConditionExpression': 'session_id = :pk AND message_index BETWEEN :first AND :last',
+            'ExpressionAttributeValues': {':pk': partition, ':first': min(starts), ':last': max(starts)},
+            'ProjectionExpression': ', '.join(('message_index', 'segment_end') + CODEC_ATTRIBUTES),
+            'ReturnConsumedCapacity': 'TOTAL',
+        }
+        while True:
+            response = self.table.query(**query_kwargs)
+            record_consumed_capacity('Query', response)
+            for row in response['Items']:
+                start = int(row['message_index'])
+                messages = self._decode_segment(session_id, partition, start, ends.get(start, start), row)
+                metrics.session_segment_reads.add(1)
+                for offset, message in enumerate(messages):
+                    if low <= start + offset < high:
+                        by_index[start + offset] = message
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key:
+                break
+            query_kwargs['ExclusiveStartKey'] = last_key
+
+    def _decode_segment(self, session_id: str, partition: str, start: int, end: int, row: Dict) -> List[Dict]:
+        """還原區段內的訊息；區段損毀（或缺 chunk）時整段以 UNREADABLE_MESSAGE 代替，會話其餘部分照常載入"""
+        try:
+            return decode_segment(row, lambda count: self._load_chunks(partition, start, count))
+        except (MessageDecodeError, ValueError, zlib.error) as e:
+            logger.error(
+                f"Failed to decode session segment",
+                extra={"session_id": session_id, "message_index": start, "error": str(e)}
+            )
+            end = int(row.get('segment_end', end))
+            return [{"role": "assistant", "content": UNREADABLE_MESSAGE} for _ in range(start, end)]
+
+    def _decode(self, session_id: str, message_index: int, item: Dict) -> str:
+        try:
+            return decode_content(item, lambda count: self._load_chunks(session_id, message_index, count))
+        except (MessageDecodeError, ValueError) as e:
+            logger.error(
+                f"Failed to decode message content",
+                extra={"session_id": session_id, "message_index": message_index, "error": str(e)}
+            )
+            return UNREADABLE_MESSAGE
+
+    def _load_chunks(self, session_id: str, message_index: int, count: int) -> List[bytes]:
+        """讀取拆分訊息的 chunk（先取本 Pod 尚未寫入的，其餘查詢 chunk partition）"""
+        partition = chunk_partition(session_id, message_index)
+        rows = {}
+        if self.write_queue is not None:
+            rows = {int(row['message_index']): row for row in self.write_queue.pending_items(partition)}
+        if len(rows) < count:
+            query_kwargs = {
+                'KeyConditionExpression': 'session_id = :pk',
+                'ExpressionAttributeValues': {':pk': partition},
+                'ReturnConsumedCapacity': 'TOTAL',
+            }
+            while True:
+                response = self.table.query(**query_kwargs)
+                record_consumed_capacity('Query', response)
+                for row in response['Items']:
+                    rows.setdefault(int(row['message_index']), row)
+                last_key = response.get('LastEvaluatedKey')
+                if not last_key:
+                    break
+                query_kwargs['ExclusiveStartKey'] = last_key
+        return chunk_data(list(rows.values()))
+
+    def compact_session(self, session_id: str, segment_size: int, keep_open: int = 0) -> int:
         """
-        列出最近的會話列表
+        將已結束的連續訊息（每 segment_size 則）壓縮為一個區段 item，並記錄於 metadata 的 segment_manifest
 
-        :param limit: 返回的會話數量限制
-        :return: 會話列表 [{"session_id": "...", "session_title": "...", "created_at": "..."}]
+        每個區段依序：寫入區段 item → 條件更新 metadata（compacted_upto 未被其他程序推進）→ 刪除原訊息。
+        任一步中斷後都可重跑：區段 item 以起始序號為 key 覆寫；metadata 已記錄的範圍讀取時以區段為準，
+        殘留的原訊息於下次執行時刪除。
+
+        :param session_id: 會話 ID
+        :param segment_size: 每個區段的訊息數
+        :param keep_open: 最近這麼多則訊息不壓縮
+        :return: 本次新增的區段數
         """
+        response = self.table.get_item(
+            Key={'session_id': session_id, 'message_index': SESSION_META_INDEX},
+            ProjectionExpression='message_count, compacted_upto',
+            ConsistentRead=True,
+        )
+        meta = response.get('Item')
+        if not meta:
+            return 0
+        compacted = int(meta.get('compacted_upto', 0))
+        message_count = int(meta.get('message_count', 0))
+
+        # 上次執行在刪除原訊息前中斷
+        self._delete_messages(session_id, 0, compacted)
+
+        written = 0
+        while compacted + segment_size <= message_count - keep_open:
+            end = compacted + segment_size
+            items = self._query_range(session_id, compacted, end)
+            if [int(item['message_index']) for item in items] != list(range(compacted, end)):
+                logger.warning(
+                    f"Session has missing messages, compaction stopped",
+                    extra={"session_id": session_id, "segment_start": compacted}
+                )
+                break
+
+            messages = []
+            for item in items:
+                index = int(item['message_index'])
+                content = decode_content(item, lambda count: self._load_chunks(session_id, index, count))
+                # timestamp / user_id 只供匯出使用（load_session 只讀 role / content）
+                messages.append({
+                    "role": item['role'],
+                    "content": content,
+                    "timestamp": item.get('timestamp'),
+                    "user_id": item.get('user_id'),
+                })
+            encoded = encode_segment(messages, max_inline_bytes=self.max_inline_bytes)
+            partition = segment_partition(session_id)
+            self._write_items(chunk_items(partition, compacted, encoded.chunks) + [{
+                'session_id': partition,
+                'message_index': compacted,
+                'segment_end': end,
+                # 區段內最新一則訊息的時間（增量匯出以 timestamp 篩選）
+                'timestamp': items[-1].get('timestamp', ''),
+                **encoded.attributes,
+            }])
+
+            if not self._advance_manifest(session_id, compacted, end):
+                break
+            self._delete_messages(session_id, compacted, end)
+            metrics.session_segments_compacted.add(1)
+            compacted = end
+            written += 1
+
+        if written:
+            self.history_cache.invalidate(session_id)
+            logger.info(
+                f"Compacted session into segments",
+                extra={"session_id": session_id, "segments": written, "compacted_upto": compacted}
+            )
+        return written
+
+    def _schedule_compaction(self, session_id: str, previous_count: int, message_count: int):
+        """訊息數跨過區段邊界（扣除不壓縮的尾段）時，在背景壓縮該會話"""
+        if self.segment_size <= 0:
+            return
+        closed_before = max(0, previous_count - self.segment_keep_open) // self.segment_size
+        closed_after = max(0, message_count - self.segment_keep_open) // self.segment_size
+        if closed_after <= closed_before:
+            return
+
+        with _compacting_lock:
+            if session_id in _compacting:
+                return
+            _compacting.add(session_id)
+        _compaction_executor.submit(self._run_compaction, session_id)
+
+    def _run_compaction(self, session_id: str):
         try:
-            response = self.table.query(
-                IndexName='user_id-created_at-index',
-                KeyConditionExpression='user_id = :uid',
-                ExpressionAttributeValues={':uid': 'default'},
-                ScanIndexForward=False,  # 降序（最新的在前）
-                Limit=limit * 2  # 多查一些，因為需要過濾
-            )
-
-            # 只取每個會話的第一條用戶消息（message_index == 1）
-            sessions = []
-            seen_sessions = set()
-
-            for item in response['Items']:
-                session_id = item['session_id']
-                # 避免重複，只取每個會話一次
-                if session_id not in seen_sessions and item.get('message_index') == 1:
-                    sessions.append({
-                        "session_id": session_id,
-                        "session_title": item.get("session_title", "Untitled"),
-                        "created_at": item.get("created_at", item["timestamp"])
-                    })
-                    seen_sessions.add(session_id)
-
-                if len(sessions) >= limit:
+            if self.write_queue is not None:
+                # 區段只由已寫入 DynamoDB 的訊息組成
+                self.write_queue.flush()
+            self.compact_session(session_id, self.segment_size, self.segment_keep_open)
+        except Exception as e:
+            logger.error(
+                f"Failed to compact session",
+                extra={"session_id": session_id, "error": str(e)}
+            )
+        finally:
+            with _compacting_lock:
+                _compacting.discard(session_id)
+
+    def _query_range(self, session_id: str, start_index: int, end_index: int) -> List[Dict]:
+        """以強一致讀取 [start_index, end_index) 的訊息 item"""
+        query_kwargs = {
+            'KeyConditionExpression': 'session_id = :sid AND message_index BETWEEN :first AND :last',
+            'ExpressionAttributeValues': {':sid': session_id, ':first': start_index, ':last': end_index - 1},
+            'ProjectionExpression': ', '.join(('message_index', '#role', '#ts', 'user_id') + CODEC_ATTRIBUTES),
+            'ExpressionAttributeNames': {'#role': 'role', '#ts': 'timestamp'},
+            'ConsistentRead': True,
+            'ReturnConsumedCapacity': 'TOTAL',
+        }
+        items = []
+        while True:
+            response = self.table.query(**query_kwargs)
+            record_consumed_capacity('Query', response)
+            items.extend(response['Items'])
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key:
+                return items
+            query_kwargs['ExclusiveStartKey'] = last_key
+
+    def _advance_manifest(self, session_id: str, start_index: int, end_index: int) -> bool:
+        """
+        將區段加入 segment_manifest 並推進 compacted_upto
+
+        :return: False 表示 compacted_upto 已被其他程序推進（本區段已由其他程序記錄）
+        """
+        values = {':end': end_index, ':empty': [], ':segment': [{'start': start_index, 'end': end_index}]}
+        if start_index == 0:
+            condition = 'attribute_not_exists(compacted_upto)'
+        else:
+            condition = 'compacted_upto = :start'
+            values[':start'] = start_index
+        try:
+            self.table.update_item(
+                Key={'session_id': session_id, 'message_index': SESSION_META_INDEX},
+                UpdateExpression=(
+                    'SET compacted_upto = :end, '
+                    'segment_manifest = list_append(if_not_exists(segment_manifest, :empty), :segment)'
+                ),
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values,
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            logger.info(
+                f"Session segment already recorded by another compactor",
+                extra={"session_id": session_id, "segment_start": start_index}
+            )
+            return False
+
+    def _delete_messages(self, session_id: str, start_index: int, end_index: int):
+        """刪除 [start_index, end_index) 的原訊息（已壓縮為區段）"""
+        if end_index <= start_index:
+            return
+        query_kwargs = {
+            'KeyConditionExpression': 'session_id = :sid AND message_index BETWEEN :first AND :last',
+            'ExpressionAttributeValues': {':sid': session_id, ':first': start_index, ':last': end_index - 1},
+            'ProjectionExpression': 'message_index, chunks',
+        }
+        with self.table.batch_writer() as batch:
+            while True:
+                response = self.table.query(**query_kwargs)
+                self._delete_with_chunks(batch, session_id, response['Items'])
+                last_key = response.get('LastEvaluatedKey')
+                if not last_key:
                     break
+                query_kwargs['ExclusiveStartKey'] = last_key
+
+    def get_session_meta(self, session_id: str) -> Dict:
+        """
+        讀取會話 metadata
+
+        :param session_id: 會話 ID
+        :return: metadata 欄位（不存在時為空 dict）
+        """
+        try:
+            response = self.table.get_item(
+                Key={'session_id': session_id, 'message_index': SESSION_META_INDEX}
+            )
+            item = response.get('Item', {})
+            item.pop('session_id', None)
+            item.pop('message_index', None)
+            return item
+
+        except Exception as e:
+            logger.error(
+                f"Failed to load session metadata from DynamoDB",
+                extra={"session_id": session_id, "error": str(e)}
+            )
+            return {}
+
+    def update_session_meta(self, session_id: str, **fields):
+        """
+        更新會話 metadata（只覆寫傳入的欄位）
+
+        :param session_id: 會話 ID
+        :param fields: 要寫入的欄位，例如 summary / summary_upto_index
+        """
+        if not fields:
+            return
+
+        try:
+            self.table.update_item(
+                Key={'session_id': session_id, 'message_index': SESSION_META_INDEX},
+                **build_update_kwargs(fields),
+            )
+            logger.info(
+                f"Updated session metadata in DynamoDB",
+                extra={"session_id": session_id, "fields": sorted(fields)}
+            )
+        except Exception as e:
+            logger.error(
+                f"Failed to update session metadata in DynamoDB",
+                extra={"session_id": session_id, "error": str(e)}
+            )
+            raise
 
+    def add_session_usage(self, session_id: str, input_tokens: int, output_tokens: int):
+        """
+        累加會話的 token 用量（ADD 為原子操作，多個 Pod 同時寫入也不會遺失）
+
+        :param session_id: 會話 ID
+        :param input_tokens: 本輪輸入 token 數
+        :param output_tokens: 本輪輸出 token 數
+        """
+        try:
+            self.table.update_item(
+                Key={'session_id': session_id, 'message_index': SESSION_META_INDEX},
+                UpdateExpression="ADD input_tokens :i, output_tokens :o, model_calls :one",
+                ExpressionAttributeValues={':i': input_tokens, ':o': output_tokens, ':one': 1},
+            )
+        except Exception as e:
+            logger.error(
+                f"Failed to update session usage in DynamoDB",
+                extra={"session_id": session_id, "error": str(e)}
+            )
+            raise
+
+    def list_sessions(
+        self,
+        limit: int = 10,
+        cursor: Optional[str] = None,
+        user_id: str = DEFAULT_USER_ID,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        列出使用者最近活動的會話（sparse GSI；各 shard 並行查詢後依 last_active_at 合併）
+
+        :param limit: 每頁會話數量
+        :param cursor: 上一頁回傳的游標，None 表示第一頁
+        :param user_id: 會話擁有者
+        :return: (會話列表 [{"session_id", "session_title", "created_at", "last_active_at", "message_count"}],
+                  下一頁游標；沒有下一頁時為 None)
+        """
+        try:
+            # 側邊欄每次 rerun 都會呼叫；本 Pod 有寫入時才重新查詢
+            sessions, next_cursor = self.session_list_cache.get_or_load(
+                user_id,
+                f"{cursor}#{limit}",
+                lambda: self._query_sessions(user_id, limit, decode_cursor(cursor) if cursor else None),
+            )
             logger.info(f"Listed {len(sessions)} sessions")
-            return sessions
+            return [dict(session) for session in sessions], next_cursor
 
         except Exception as e:
             logger.error(f"Failed to list sessions: {str(e)}")
-            return []
+            return [], None
+
+    def _query_sessions(
+        self,
+        user_id: str,
+        limit: int,
+        positions: Optional[Dict[str, Optional[Dict]]],
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        scatter-gather：每個 shard 各查最多 limit 筆，合併後取前 limit 筆
+
+        :param positions: 各 shard 的 ExclusiveStartKey（None 表示從頭）；已讀完的 shard 不在其中
+        """
+        if positions is None:
+            positions = {str(shard): None for shard in range(self.session_index_shards)}
+
+        def query_shard(shard: str, start_key: Optional[Dict]):
+            query_kwargs = {
+                'IndexName': SESSION_LIST_INDEX,
+                'KeyConditionExpression': 'session_list_pk = :pk',
+                'ExpressionAttributeValues': {':pk': f"{user_id}#{shard}"},
+                'ScanIndexForward': False,  # 降序（最近活動的在前）
+                'Limit': limit,
+                'ReturnConsumedCapacity': 'TOTAL',
+            }
+            if start_key:
+                query_kwargs['ExclusiveStartKey'] = start_key
+            response = self.table.query(**query_kwargs)
+            record_consumed_capacity('Query', response)
+            return response['Items'], response.get('LastEvaluatedKey')
+
+        shards = list(positions)
+        if len(shards) == 1:
+            results = [query_shard(shards[0], positions[shards[0]])]
+        else:
+            results = list(_shard_executor.map(query_shard, shards, [positions[s] for s in shards]))
+
+        candidates = [
+            (item, shard)
+            for shard, (items, _) in zip(shards, results)
+            for item in items
+        ]
+        candidates.sort(key=lambda pair: (pair[0]['last_active_at'], pair[0]['session_id']), reverse=True)
+        page = candidates[:limit]
+
+        # 下一頁從每個 shard 實際採用的最後一筆之後繼續；沒有採用任何一筆的 shard 維持原位置
+        next_positions = {}
+        for shard, (items, last_key) in zip(shards, results):
+            taken = [item for item, item_shard in page if item_shard == shard]
+            if len(taken) < len(items):
+                next_positions[shard] = self._index_key(taken[-1]) if taken else positions[shard]
+            elif last_key:
+                next_positions[shard] = last_key
+
+        sessions = [
+            {
+                "session_id": item["session_id"],
+                "session_title": item.get("session_title", "Untitled"),
+                "created_at": item.get("created_at", item["last_active_at"]),
+                "last_active_at": item["last_active_at"],
+                "message_count": int(item.get("message_count", 0)),
+            }
+            for item, _ in page
+        ]
+        return sessions, (encode_cursor(next_positions) if next_positions else None)
+
+    @staticmethod
+    def _index_key(item: Dict) -> Dict:
+        """GSI 查詢的 ExclusiveStartKey（索引 key + 表 key）"""
+        return {
+            name: item[name]
+            for name in ('session_list_pk', 'last_active_at', 'session_id', 'message_index')
+        }
+
+
+def encode_cursor(positions: Dict) -> str:
+    """各 shard 的查詢位置轉為不透明的游標字串（UI 不需要知道索引的 key 結構與 shard 數）"""
+    raw = json.dumps(positions, default=int, separators=(',', ':'), sort_keys=True)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Dict:
+    return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+
+
+@st.cache_resource
+def get_conversation_service(
+    table_name: str,
+    region: str,
+    write_behind: bool,
+    cache_max_entries: int = 0,
+    cache_ttl_seconds: float = 0,
+    session_index_shards: int = 1,
+    compress_threshold: int = 2048,
+    max_inline_bytes: int = 350_000,
+    segment_size: int = 0,
+    segment_keep_open: int = 50,
+) -> ConversationService:
+    """行程內共用同一個 ConversationService（write-behind 佇列、背景執行緒與讀取快取只建立一次）"""
+    return ConversationService(
+        table_name=table_name,
+        region=region,
+        write_behind=write_behind,
+        cache_max_entries=cache_max_entries,
+        cache_ttl_seconds=cache_ttl_seconds,
+        session_index_shards=session_index_shards,
+        compress_threshold=compress_threshold,
+        max_inline_bytes=max_inline_bytes,
+        segment_size=segment_size,
+        segment_keep_open=segment_keep_open,
+    )
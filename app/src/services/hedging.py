@@ -0,0 +1,202 @@
+# src/services/hedging.py
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Optional, Tuple, TypeVar
+
+import streamlit as st
+from opentelemetry import context as otel_context
+from opentelemetry import trace
+
+from src.services import metrics
+
+T = TypeVar("T")
+
+
+class HedgePolicy:
+    """
+    決定何時送出備援請求
+
+    - 延遲門檻取主請求最近 window 筆完成時間的 percentile（夾在 min / max 之間），
+      樣本不足 min_samples 筆時不 hedge
+    - 備援請求數以 credit 控制：每個主請求累積 max_ratio 個 credit，送出備援消耗 1 個，
+      長期額外請求率不超過 max_ratio；credit 上限允許短暫突發
+    """
+
+    def __init__(
+        self,
+        *,
+        percentile: float,
+        max_ratio: float,
+        min_delay_ms: float,
+        max_delay_ms: float,
+        window: int = 500,
+        min_samples: int = 20,
+        max_credit: float = 10.0,
+    ):
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_delay_ms = min_delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.min_samples = min_samples
+        self.max_credit = max_credit
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._credit = 0.0
+
+    def delay_ms(self) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            values = sorted(self._latencies)
+        threshold = values[min(len(values) - 1, int(self.percentile * len(values)))]
+        return min(self.max_delay_ms, max(self.min_delay_ms, threshold))
+
+    def on_primary(self) -> None:
+        with self._lock:
+            self._credit = min(self.max_credit, self._credit + self.max_ratio)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._credit < 1.0:
+                return False
+            self._credit -= 1.0
+            return True
+
+    def observe(self, latency_ms: float) -> None:
+        with self._lock:
+            self._latencies.append(latency_ms)
+
+
+class Hedger:
+    """
+    Hedged request：主請求超過延遲門檻仍未完成時，對備援目標（另一個 region 或模型）
+    再送一次，採用先成功的結果
+
+    已送出的 Converse 呼叫無法中止，輸的一方只是被捨棄（仍會計費）；
+    尚未開始執行的請求會被取消。只用於阻塞模式（call_bedrock），串流模式不 hedge。
+    """
+
+    def __init__(self, policy: HedgePolicy, *, backup_client, backup_model_id: Optional[str], max_workers: int):
+        self.policy = policy
+        self.backup_client = backup_client
+        # None 表示沿用主請求的模型（只換 region）
+        self.backup_model_id = backup_model_id
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bedrock-hedge")
+
+    def run(
+        self,
+        primary: Callable[[], T],
+        backup: Callable[[], T],
+        admit_backup: Optional[Callable[[], Optional[Callable[[], None]]]] = None,
+    ) -> T:
+        """
+        執行主請求，必要時送出備援請求
+
+        主請求在門檻前失敗時直接拋出（重試由 botocore 負責）；
+        已 hedge 時其中一方失敗會等待另一方，兩者皆失敗才拋出主請求的例外。
+
+        :param admit_backup: 送出備援前取得准入許可（例如 AdmissionController.try_admit）；
+                             回傳 None 時不 hedge，否則回傳的 release 函式在備援請求結束或被取消時呼叫
+        """
+        span = trace.get_current_span()
+        self.policy.on_primary()
+        delay_ms = self.policy.delay_ms()
+
+        started = time.perf_counter()
+        if delay_ms is None:
+            metrics.bedrock_hedge_calls.add(1, {"outcome": "warming_up"})
+            span.set_attribute("gen_ai.hedge.outcome", "warming_up")
+            result = primary()
+            self.policy.observe((time.perf_counter() - started) * 1000)
+            return result
+
+        def observe_primary(future: Future) -> None:
+            # 主請求的完成時間不論輸贏都記錄，延遲分佈才不會因 hedge 而偏低
+            if not future.cancelled() and future.exception() is None:
+                self.policy.observe((time.perf_counter() - started) * 1000)
+
+        primary_future = self._submit(primary)
+        primary_future.add_done_callback(observe_primary)
+
+        done, _ = wait([primary_future], timeout=delay_ms / 1000)
+        if done:
+            metrics.bedrock_hedge_calls.add(1, {"outcome": "not_needed"})
+            span.set_attribute("gen_ai.hedge.outcome", "not_needed")
+            return primary_future.result()
+
+        if not self.policy.try_acquire():
+            metrics.bedrock_hedge_calls.add(1, {"outcome": "budget_exhausted"})
+            span.set_attribute("gen_ai.hedge.outcome", "budget_exhausted")
+            return primary_future.result()
+
+        release = admit_backup() if admit_backup is not None else None
+        if admit_backup is not None and release is None:
+            # 准入額度已滿時備援只會加重負載（credit 不退回，負載高時本來就該少 hedge）
+            metrics.bedrock_hedge_calls.add(1, {"outcome": "admission_rejected"})
+            span.set_attribute("gen_ai.hedge.outcome", "admission_rejected")
+            return primary_future.result()
+
+        metrics.bedrock_hedge_calls.add(1, {"outcome": "hedged"})
+        span.set_attribute("gen_ai.hedge.outcome", "hedged")
+        span.set_attribute("gen_ai.hedge.delay_ms", delay_ms)
+        backup_future = self._submit(backup)
+        if release is not None:
+            backup_future.add_done_callback(lambda _: release())
+
+        winner, result = self._first_success(primary_future, backup_future)
+        metrics.bedrock_hedge_wins.add(1, {"winner": winner})
+        span.set_attribute("gen_ai.hedge.winner", winner)
+        return result
+
+    def _submit(self, fn: Callable[[], T]) -> "Future[T]":
+        # 帶上呼叫端的 OTel context，logger / span 屬性仍歸屬於 generate_response
+        ctx = otel_context.get_current()
+
+        def task():
+            token = otel_context.attach(ctx)
+            try:
+                return fn()
+            finally:
+                otel_context.detach(token)
+
+        return self._executor.submit(task)
+
+    @staticmethod
+    def _first_success(primary: "Future[T]", backup: "Future[T]") -> Tuple[str, T]:
+        names = {primary: "primary", backup: "backup"}
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    return names[future], future.result()
+        raise primary.exception()
+
+
+@st.cache_resource
+def get_hedger(
+    _backup_client,
+    backup_region: str,
+    backup_model_id: Optional[str],
+    percentile: float,
+    max_ratio: float,
+    min_delay_ms: float,
+    max_delay_ms: float,
+    max_workers: int,
+) -> Hedger:
+    """
+    行程內共用同一個 Hedger（延遲分佈與 credit 跨 session 累積）
+
+    backup_region 只用於 cache key（_backup_client 不參與 hash）。
+    """
+    policy = HedgePolicy(
+        percentile=percentile,
+        max_ratio=max_ratio,
+        min_delay_ms=min_delay_ms,
+        max_delay_ms=max_delay_ms,
+    )
+    return Hedger(policy, backup_client=_backup_client, backup_model_id=backup_model_id, max_workers=max_workers)
@@ -0,0 +1,94 @@
+# src/services/history.py
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗估文字的 token 數
+
+    ASCII 約 4 字元 / token，中日韓等非 ASCII 字元約 1 字元 / token。
+    只用於預算與指標，不追求精確。
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    ascii_chars = len(text) - non_ascii
+    return max(1, ascii_chars // 4 + non_ascii) if text else 0
+
+
+class ConverseHistory:
+    """
+    以 Converse API 的 messages 格式維護單一會話的對話紀錄
+
+    - 每輪只轉換新增的訊息 (incremental)，不重建整段歷史
+    - 每則訊息的 token 估計值與 messages 一起快取
+    - 保證符合 Converse 規則：第一則為 user、角色交替 (同角色連續時合併)
+    - 只載入最近一段訊息時（tail window），start_index 為第一則訊息在會話中的 message_index
+    """
+
+    def __init__(self, start_index: int = 0):
+        # 每次整段重建加一：背景任務（例如摘要）以此判斷取得快照之後歷史是否已重建
+        self.generation = 0
+        self._reset(start_index)
+
+    def _reset(self, start_index: int) -> None:
+        self.messages: List[Dict] = []
+        self.token_estimates: List[int] = []
+        # 每則 Converse 訊息來源的第一則聊天訊息 message_index（合併後仍可對應回會話位置）
+        self.source_indices: List[int] = []
+        self.total_tokens = 0
+        self.start_index = start_index
+        self._synced = 0
+
+        # 滾動摘要：涵蓋 messages[:summary_upto]（由 context window 維護）
+        self.summary: Optional[str] = None
+        self.summary_upto = 0
+        self.summary_loaded = False
+
+    def sync(self, chat_messages: List[Dict], start_index: int = 0) -> "ConverseHistory":
+        """
+        將 st.session_state.messages 中尚未轉換的訊息附加進來
+
+        :param chat_messages: [{"role": "user", "content": "..."}]
+        :param start_index: chat_messages[0] 的 message_index（載入較早訊息後會變小）
+        :return: self
+        """
+        if len(chat_messages) < self._synced or start_index != self.start_index:
+            # 會話被替換（例如載入另一個會話）或往前載入了較早的訊息，整段重建
+            self.generation += 1
+            self._reset(start_index)
+
+        for offset, msg in enumerate(chat_messages[self._synced:], start=self._synced):
+            self.append(msg["role"], msg["content"], start_index + offset)
+        self._synced = len(chat_messages)
+        return self
+
+    def append(self, role: str, content: str, message_index: Optional[int] = None) -> None:
+        """附加單則訊息並更新 token 估計值"""
+        if message_index is None:
+            message_index = self.start_index + self._synced
+        if role not in ("user", "assistant") or not content:
+            return
+        # Converse 要求第一則訊息必須是 user（例如略過歡迎語）
+        if not self.messages and role != "user":
+            return
+
+        tokens = estimate_tokens(content)
+        if self.messages and self.messages[-1]["role"] == role:
+            # 同角色連續（例如上一輪回應未寫入）時合併為同一則訊息
+            self.messages[-1]["content"].append({"text": content})
+            self.token_estimates[-1] += tokens
+        else:
+            self.messages.append({"role": role, "content": [{"text": content}]})
+            self.token_estimates.append(tokens)
+            self.source_indices.append(message_index)
+        self.total_tokens += tokens
+
+    def position_of(self, message_index: int) -> int:
+        """會話中的 message_index 對應到 messages 的位置（第一則來源 >= message_index 的訊息）"""
+        return bisect_left(self.source_indices, message_index)
+
+    def message_index_at(self, position: int) -> int:
+        """messages[position] 的來源 message_index；超出範圍時為下一則訊息的序號"""
+        if position < len(self.source_indices):
+            return self.source_indices[position]
+        return self.start_index + self._synced
@@ -0,0 +1,146 @@
+# src/services/message_codec.py
+"""
+對話訊息內容的儲存格式
+
+- 版本 0（無 codec 欄位）：content 為字串，舊資料維持可讀
+- 版本 1：codec = 1，encoding 記錄壓縮方式
+  - encoding = "plain"：content 字串（未超過門檻）
+  - encoding = "zlib"：content_z 為壓縮後的 Binary
+  - chunks = N：壓縮後仍超過單一 item 上限時，資料拆到 N 個 chunk item，
+    存放於獨立的 partition（chunk_partition），訊息的序號範圍查詢與 Limit 不受影響
+
+壓縮過的會話區段（segment）：一段連續訊息的 JSON 以同樣的格式存放於 segment_partition，
+sort key 為區段第一則訊息的序號，segment_end 為區段結束序號（不含）
+"""
+import json
+import zlib
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+CODEC_VERSION = 1
+
+ENCODING_PLAIN = "plain"
+ENCODING_ZLIB = "zlib"
+
+# chunk / 區段 item 的 partition key 標記（與訊息 item 同表，Scan 時以此區分）
+CHUNK_MARKER = "#chunk#"
+SEGMENT_SUFFIX = "#segment"
+
+# 讀取時需要的欄位（ProjectionExpression）
+CODEC_ATTRIBUTES = ("content", "content_z", "codec", "encoding", "chunks")
+
+
+@dataclass(frozen=True)
+class EncodedContent:
+    # 寫在訊息 item 上的欄位
+    attributes: Dict
+    # chunk item 的資料（依序）；未拆分時為空
+    chunks: List[bytes]
+    original_bytes: int
+    stored_bytes: int
+
+
+class MessageDecodeError(Exception):
+    """訊息內容無法還原（未知版本 / 編碼，或 chunk 缺漏）"""
+
+
+def chunk_partition(session_id: str, message_index: int) -> str:
+    """chunk item 的 partition key；sort key 為 chunk 序號"""
+    return f"{session_id}{CHUNK_MARKER}{message_index}"
+
+
+def segment_partition(session_id: str) -> str:
+    """會話區段 item 的 partition key"""
+    return f"{session_id}{SEGMENT_SUFFIX}"
+
+
+def encode_content(content: str, *, compress_threshold: int, max_inline_bytes: int) -> EncodedContent:
+    """
+    依大小選擇儲存方式
+
+    :param compress_threshold: UTF-8 位元組數超過此值才壓縮（小訊息壓縮省不了 WCU）
+    :param max_inline_bytes: 單一 item 內可存放的資料上限，超過時拆成 chunk（DynamoDB item 上限 400 KB）
+    """
+    raw = content.encode("utf-8")
+    if len(raw) <= compress_threshold:
+        return EncodedContent({"content": content}, [], len(raw), len(raw))
+
+    compressed = zlib.compress(raw, 6)
+    if len(compressed) >= len(raw) and len(raw) <= max_inline_bytes:
+        # 不可壓縮的內容（例如 base64）維持字串
+        return EncodedContent(
+            {"content": content, "codec": CODEC_VERSION, "encoding": ENCODING_PLAIN}, [], len(raw), len(raw)
+        )
+
+    attributes = {"codec": CODEC_VERSION, "encoding": ENCODING_ZLIB}
+    if len(compressed) <= max_inline_bytes:
+        attributes["content_z"] = compressed
+        return EncodedContent(attributes, [], len(raw), len(compressed))
+
+    chunks = [compressed[i:i + max_inline_bytes] for i in range(0, len(compressed), max_inline_bytes)]
+    attributes["chunks"] = len(chunks)
+    return EncodedContent(attributes, chunks, len(raw), len(compressed))
+
+
+def decode_content(item: Dict, fetch_chunks: Optional[Callable[[int], List[bytes]]] = None) -> str:
+    """
+    還原訊息內容
+
+    :param item: 訊息 item（至少包含 CODEC_ATTRIBUTES 中存在的欄位）
+    :param fetch_chunks: chunks 數 -> 依序的 chunk 資料（只有拆分過的訊息會呼叫）
+    """
+    version = int(item.get("codec", 0))
+    if version == 0:
+        return item["content"]
+    if version != CODEC_VERSION:
+        raise MessageDecodeError(f"unsupported codec version {version}")
+
+    encoding = item.get("encoding")
+    if encoding == ENCODING_PLAIN:
+        return item["content"]
+    if encoding != ENCODING_ZLIB:
+        raise MessageDecodeError(f"unsupported encoding {encoding}")
+
+    if "chunks" in item:
+        if fetch_chunks is None:
+            raise MessageDecodeError("chunked message without a chunk reader")
+        count = int(item["chunks"])
+        chunks = fetch_chunks(count)
+        if len(chunks) != count:
+            raise MessageDecodeError(f"expected {count} chunks, found {len(chunks)}")
+        data = b"".join(chunks)
+    else:
+        data = _to_bytes(item["content_z"])
+    return zlib.decompress(data).decode("utf-8")
+
+
+def chunk_items(session_id: str, message_index: int, chunks: List[bytes]) -> List[Dict]:
+    partition = chunk_partition(session_id, message_index)
+    return [
+        {"session_id": partition, "message_index": number, "data": data}
+        for number, data in enumerate(chunks)
+    ]
+
+
+def _to_bytes(value) -> bytes:
+    # boto3 resource 讀回 Binary 時為 boto3.dynamodb.types.Binary
+    return bytes(value.value) if hasattr(value, "value") else bytes(value)
+
+
+def chunk_data(rows: List[Dict]) -> List[bytes]:
+    """chunk item 依序號排序後的資料"""
+    rows = sorted(rows, key=lambda row: int(row["message_index"]))
+    return [_to_bytes(row["data"]) for row in rows]
+
+
+def encode_segment(messages: List[Dict], *, max_inline_bytes: int) -> EncodedContent:
+    """一段連續訊息 [{"role", "content"}] 一律壓縮存放"""
+    payload = json.dumps(messages, ensure_ascii=False, separators=(",", ":"))
+    return encode_content(payload, compress_threshold=0, max_inline_bytes=max_inline_bytes)
+
+
+def decode_segment(item: Dict, fetch_chunks: Optional[Callable[[int], List[bytes]]] = None) -> List[Dict]:
+    messages = json.loads(decode_content(item, fetch_chunks))
+    if len(messages) != int(item["segment_end"]) - int(item["message_index"]):
+        raise MessageDecodeError("segment length does not match its index range")
+    return messages
@@ -0,0 +1,265 @@
+# src/services/metrics.py
+"""
+應用層 OpenTelemetry metrics instruments
+
+MeterProvider 由 opentelemetry-instrument (ADOT) 在啟動時設定，
+這裡只透過 API 取得 meter；未設定 provider 時為 no-op。
+"""
+from opentelemetry import metrics
+
+meter = metrics.get_meter("ai-chatbot-app")
+
+# --- App ---
+app_rerun_setup_duration = meter.create_histogram(
+    "chatbot.app.rerun.setup.duration",
+    unit="ms",
+    description="Time from script start to services ready on each Streamlit rerun",
+)
+
+# --- Context window ---
+context_input_tokens = meter.create_histogram(
+    "chatbot.context.input_tokens",
+    unit="{token}",
+    description="Estimated history tokens sent to the model per turn",
+)
+context_tokens_saved = meter.create_histogram(
+    "chatbot.context.tokens_saved",
+    unit="{token}",
+    description="Estimated history tokens removed by the context window per turn",
+)
+context_summaries = meter.create_counter(
+    "chatbot.context.summaries",
+    unit="{summary}",
+    description="Rolling summaries generated, by status",
+)
+
+# --- Response cache ---
+response_cache_lookups = meter.create_counter(
+    "chatbot.response_cache.lookups",
+    unit="{lookup}",
+    description="Response cache lookups, by result (hit/miss/bypass) and tier",
+)
+cache_evictions = meter.create_counter(
+    "chatbot.cache.evictions",
+    unit="{entry}",
+    description="Entries evicted from in-process caches, by cache and reason",
+)
+
+# --- Semantic cache ---
+semantic_cache_lookups = meter.create_counter(
+    "chatbot.semantic_cache.lookups",
+    unit="{lookup}",
+    description="Semantic cache lookups, by result (hit/miss)",
+)
+semantic_cache_similarity = meter.create_histogram(
+    "chatbot.semantic_cache.similarity",
+    unit="1",
+    description="Cosine similarity of the nearest cached prompt",
+)
+semantic_cache_search_duration = meter.create_histogram(
+    "chatbot.semantic_cache.search.duration",
+    unit="ms",
+    description="Nearest-neighbour search time in the semantic index (excluding embedding)",
+)
+
+# --- Single-flight ---
+single_flight_calls = meter.create_counter(
+    "chatbot.single_flight.calls",
+    unit="{call}",
+    description="Calls entering single-flight, by role (leader issues the request, follower is coalesced)",
+)
+
+# --- Bedrock calls ---
+bedrock_latency = meter.create_histogram(
+    "chatbot.bedrock.latency",
+    unit="ms",
+    description="Client-observed Converse / ConverseStream latency, by model_id, region and streaming",
+)
+bedrock_model_latency = meter.create_histogram(
+    "chatbot.bedrock.model_latency",
+    unit="ms",
+    description="Service-reported latency (metrics.latencyMs), by model_id, region and streaming",
+)
+bedrock_time_to_first_token = meter.create_histogram(
+    "chatbot.bedrock.time_to_first_token",
+    unit="ms",
+    description="Time until the first text delta of a ConverseStream call, by model_id and region",
+)
+bedrock_input_tokens = meter.create_histogram(
+    "chatbot.bedrock.input_tokens",
+    unit="{token}",
+    description="Input tokens per call as reported in usage, by model_id and region",
+)
+bedrock_output_tokens = meter.create_histogram(
+    "chatbot.bedrock.output_tokens",
+    unit="{token}",
+    description="Output tokens per call as reported in usage, by model_id and region",
+)
+bedrock_errors = meter.create_counter(
+    "chatbot.bedrock.errors",
+    unit="{error}",
+    description="Failed Bedrock call attempts, by model_id, region and error_type",
+)
+
+# --- Bedrock client pool ---
+bedrock_pool_in_use = meter.create_up_down_counter(
+    "chatbot.bedrock.pool.in_use",
+    unit="{connection}",
+    description="Bedrock calls currently holding a pooled connection, by region",
+)
+bedrock_pool_utilization = meter.create_histogram(
+    "chatbot.bedrock.pool.utilization",
+    unit="1",
+    description="Pool usage (in-use / max_pool_connections) observed when a call starts",
+)
+bedrock_pool_saturated = meter.create_counter(
+    "chatbot.bedrock.pool.saturated",
+    unit="{call}",
+    description="Calls started while the pool was exhausted (a new TLS connection is opened and discarded)",
+)
+
+# --- Multi-region client pool ---
+bedrock_region_latency = meter.create_histogram(
+    "chatbot.bedrock.region.latency",
+    unit="ms",
+    description="Successful Bedrock call latency by region (stream calls: time until the stream opens)",
+)
+bedrock_region_errors = meter.create_counter(
+    "chatbot.bedrock.region.errors",
+    unit="{error}",
+    description="Throttling / 5xx / connection errors by region and error code",
+)
+bedrock_region_failovers = meter.create_counter(
+    "chatbot.bedrock.region.failovers",
+    unit="{call}",
+    description="Calls retried in another region, by from_region and to_region",
+)
+
+# --- Hedged requests ---
+bedrock_hedge_calls = meter.create_counter(
+    "chatbot.bedrock.hedge.calls",
+    unit="{call}",
+    description="Hedge-eligible Converse calls, by outcome (warming_up/not_needed/hedged/budget_exhausted/admission_rejected)",
+)
+bedrock_hedge_wins = meter.create_counter(
+    "chatbot.bedrock.hedge.wins",
+    unit="{call}",
+    description="Hedged calls by which request finished first (primary/backup)",
+)
+
+# --- Circuit breaker / deadline ---
+circuit_breaker_transitions = meter.create_counter(
+    "chatbot.circuit_breaker.transitions",
+    unit="{transition}",
+    description="Circuit breaker state changes, by breaker (model@region), from_state and to_state",
+)
+circuit_breaker_rejections = meter.create_counter(
+    "chatbot.circuit_breaker.rejections",
+    unit="{call}",
+    description="Calls failed fast because the breaker was open",
+)
+deadline_exceeded = meter.create_counter(
+    "chatbot.deadline.exceeded",
+    unit="{call}",
+    description="Model calls abandoned because the turn deadline or the stream idle timeout passed, by stage",
+)
+
+# --- Admission control ---
+admission_queue_depth = meter.create_up_down_counter(
+    "chatbot.admission.queue_depth",
+    unit="{request}",
+    description="Model calls waiting for admission",
+)
+admission_wait = meter.create_histogram(
+    "chatbot.admission.wait",
+    unit="s",
+    description="Time a model call waited for admission",
+)
+admission_rejections = meter.create_counter(
+    "chatbot.admission.rejections",
+    unit="{request}",
+    description="Model calls rejected before being sent, by reason",
+)
+
+# --- Model router ---
+router_decisions = meter.create_counter(
+    "chatbot.router.decisions",
+    unit="{request}",
+    description="Model routing decisions, by chosen tier and reason (complexity/downgrade/all_degraded)",
+)
+router_model_latency = meter.create_histogram(
+    "chatbot.router.model.latency",
+    unit="ms",
+    description="End-to-end model call latency observed by the router, by model_id",
+)
+
+# --- DynamoDB write-behind ---
+dynamodb_write_queue_depth = meter.create_up_down_counter(
+    "chatbot.dynamodb.write_queue.depth",
+    unit="{item}",
+    description="Items accepted by the write-behind queue and not yet written",
+)
+dynamodb_flush_duration = meter.create_histogram(
+    "chatbot.dynamodb.write_queue.flush.duration",
+    unit="ms",
+    description="BatchWriteItem round-trip time per flushed batch",
+)
+dynamodb_flush_items = meter.create_histogram(
+    "chatbot.dynamodb.write_queue.flush.items",
+    unit="{item}",
+    description="Items written per flushed batch",
+)
+dynamodb_write_retries = meter.create_counter(
+    "chatbot.dynamodb.write_queue.retries",
+    unit="{item}",
+    description="Items re-queued after UnprocessedItems or a failed batch",
+)
+dynamodb_write_dropped = meter.create_counter(
+    "chatbot.dynamodb.write_queue.dropped",
+    unit="{item}",
+    description="Items and metadata updates given up on (non-retryable error or retry limit), by reason",
+)
+dynamodb_write_queue_full = meter.create_counter(
+    "chatbot.dynamodb.write_queue.full",
+    unit="{put}",
+    description="put() calls that had to wait because the write-behind queue was full",
+)
+
+# --- DynamoDB message storage ---
+dynamodb_consumed_capacity = meter.create_counter(
+    "chatbot.dynamodb.consumed_capacity",
+    unit="{capacity_unit}",
+    description="Capacity units reported by DynamoDB (ReturnConsumedCapacity), by operation",
+)
+message_stored_bytes = meter.create_histogram(
+    "chatbot.dynamodb.message.stored_bytes",
+    unit="By",
+    description="Stored content size per message after encoding, by encoding",
+)
+message_bytes_saved = meter.create_counter(
+    "chatbot.dynamodb.message.bytes_saved",
+    unit="By",
+    description="Content bytes saved by compression (original - stored)",
+)
+session_segments_compacted = meter.create_counter(
+    "chatbot.dynamodb.session.segments_compacted",
+    unit="{segment}",
+    description="Closed message runs packed into a compressed session segment",
+)
+session_segment_reads = meter.create_counter(
+    "chatbot.dynamodb.session.segment_reads",
+    unit="{segment}",
+    description="Session segments read to fill compacted history",
+)
+
+# --- Session read cache ---
+session_cache_lookups = meter.create_counter(
+    "chatbot.session_cache.lookups",
+    unit="{lookup}",
+    description="Session list / history read-through cache lookups, by cache and result (hit/miss)",
+)
+session_cache_invalidations = meter.create_counter(
+    "chatbot.session_cache.invalidations",
+    unit="{invalidation}",
+    description="Session cache invalidations caused by writes and deletes, by cache",
+)
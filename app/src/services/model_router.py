@@ -0,0 +1,203 @@
+# src/services/model_router.py
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional, Tuple
+
+import streamlit as st
+from botocore.exceptions import ClientError
+from opentelemetry import trace
+
+from src.services.history import estimate_tokens
+from src.services import metrics
+
+# 多步驟排錯 / 需要推理的問題
+MULTI_STEP_PATTERN = re.compile(
+    r"troubleshoot|debug|diagnos|root cause|post-?mortem|step[- ]by[- ]step|migrat|design|"
+    r"compare|trade-?off|why (is|does|did|do|are)|traceback|exception|stack ?trace|"
+    r"crashloop|oomkilled|error:|failed|timeout|排查|除錯|為什麼|比較",
+    re.IGNORECASE,
+)
+# 簡短的事實型問題
+FACTUAL_PATTERN = re.compile(
+    r"^\s*(what|what's|which|who|when|where|define|list|is there|does|can)\b|是什麼|指令",
+    re.IGNORECASE,
+)
+
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"}
+
+
+@dataclass(frozen=True)
+class ModelTier:
+    name: str
+    model_id: str
+
+
+@dataclass(frozen=True)
+class RouteDecision:
+    tier: str
+    model_id: str
+    preferred_tier: str
+    reason: str
+
+
+def parse_model_tiers(spec: str) -> Tuple[ModelTier, ...]:
+    """
+    解析 "fast=amazon.nova-micro-v1:0,standard=...,strong=..."（由快到強排列）
+    """
+    tiers = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, model_id = part.partition("=")
+        tiers.append(ModelTier(name.strip(), model_id.strip()))
+    return tuple(tiers)
+
+
+def is_throttling_error(error: Exception) -> bool:
+    return (
+        isinstance(error, ClientError)
+        and error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    )
+
+
+class _LatencyWindow:
+    """單一模型最近一段時間的延遲樣本"""
+
+    def __init__(self, window_seconds: float, max_samples: int = 200):
+        self.window_seconds = window_seconds
+        self.samples: Deque[Tuple[float, float]] = deque(maxlen=max_samples)
+        self.throttled_until = 0.0
+
+    def add(self, now: float, latency_ms: float) -> None:
+        self.samples.append((now, latency_ms))
+
+    def percentile(self, now: float, q: float) -> Optional[float]:
+        values = sorted(ms for t, ms in self.samples if now - t <= self.window_seconds)
+        # 樣本太少時不下判斷，避免單次慢請求就觸發降級
+        if len(values) < 5:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class ModelRouter:
+    """
+    依問題複雜度與模型負載選擇模型層級
+
+    - 簡短的事實型問題 -> 最快的層級；長問題、含 log / 程式碼、多步驟排錯 -> 最強的層級
+    - 偏好的模型近期被節流，或最近的 p95 超過延遲預算時，自動降一級（往較快的模型）
+    - 決策與各模型的 p50 / p95 記錄在 generate_response span 上，方便調整策略
+    """
+
+    def __init__(
+        self,
+        tiers: Tuple[ModelTier, ...],
+        *,
+        latency_budget_ms: float,
+        long_prompt_tokens: int = 400,
+        long_context_tokens: int = 4000,
+        throttle_cooldown_seconds: float = 30.0,
+        window_seconds: float = 300.0,
+    ):
+        if not tiers:
+            raise ValueError("ModelRouter requires at least one model tier")
+        self.tiers = tiers
+        self.latency_budget_ms = latency_budget_ms
+        self.long_prompt_tokens = long_prompt_tokens
+        self.long_context_tokens = long_context_tokens
+        self.throttle_cooldown_seconds = throttle_cooldown_seconds
+        self._lock = threading.Lock()
+        self._windows: Dict[str, _LatencyWindow] = {
+            tier.model_id: _LatencyWindow(window_seconds) for tier in tiers
+        }
+
+    def classify(self, prompt: str, input_tokens: int) -> int:
+        """回傳偏好的層級 index（0 為最快）"""
+        strongest = len(self.tiers) - 1
+        prompt_tokens = estimate_tokens(prompt)
+
+        if (
+            "```" in prompt
+            or prompt.count("\n") >= 8
+            or prompt_tokens > self.long_prompt_tokens
+            or input_tokens > self.long_context_tokens
+            or MULTI_STEP_PATTERN.search(prompt)
+        ):
+            return strongest
+        if prompt_tokens <= 40 and FACTUAL_PATTERN.search(prompt):
+            return 0
+        return min(1, strongest)
+
+    def choose(self, prompt: str, input_tokens: int) -> RouteDecision:
+        preferred = self.classify(prompt, input_tokens)
+        now = time.monotonic()
+
+        decision = None
+        last_reason = ""
+        with self._lock:
+            for index in range(preferred, -1, -1):
+                degraded = self._degraded_reason(self.tiers[index], now)
+                if degraded is None:
+                    reason = "complexity" if index == preferred else f"downgrade:{last_reason}"
+                    decision = self._decision(index, preferred, reason)
+                    break
+                last_reason = degraded
+            if decision is None:
+                # 所有候選都降級時仍使用偏好的模型，交由准入控制 / 重試處理
+                decision = self._decision(preferred, preferred, "all_degraded")
+            snapshot = {
+                tier.name: (self._windows[tier.model_id].percentile(now, 0.5),
+                            self._windows[tier.model_id].percentile(now, 0.95))
+                for tier in self.tiers
+            }
+
+        span = trace.get_current_span()
+        span.set_attribute("gen_ai.router.tier", decision.tier)
+        span.set_attribute("gen_ai.router.preferred_tier", decision.preferred_tier)
+        span.set_attribute("gen_ai.router.reason", decision.reason)
+        span.set_attribute("gen_ai.request.model", decision.model_id)
+        for name, (p50, p95) in snapshot.items():
+            if p95 is not None:
+                span.set_attribute(f"gen_ai.router.latency_p50_ms.{name}", p50)
+                span.set_attribute(f"gen_ai.router.latency_p95_ms.{name}", p95)
+        metrics.router_decisions.add(1, {"tier": decision.tier, "reason": decision.reason.split(":")[0]})
+        return decision
+
+    def observe(self, model_id: str, latency_ms: float, error: Optional[Exception] = None) -> None:
+        """
+        回報一次模型呼叫的結果（成功的延遲或錯誤）
+
+        :param latency_ms: 阻塞模式為整個呼叫的時間，串流模式為首個 token 的時間（不含 UI 消費串流的時間）
+        """
+        window = self._windows.get(model_id)
+        if window is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if error is not None:
+                if is_throttling_error(error):
+                    window.throttled_until = now + self.throttle_cooldown_seconds
+                return
+            window.add(now, latency_ms)
+        metrics.router_model_latency.record(latency_ms, {"model_id": model_id})
+
+    def _degraded_reason(self, tier: ModelTier, now: float) -> Optional[str]:
+        window = self._windows[tier.model_id]
+        if window.throttled_until > now:
+            return "throttled"
+        p95 = window.percentile(now, 0.95)
+        if p95 is not None and p95 > self.latency_budget_ms:
+            return "slow"
+        return None
+
+    def _decision(self, index: int, preferred: int, reason: str) -> RouteDecision:
+        tier = self.tiers[index]
+        return RouteDecision(tier.name, tier.model_id, self.tiers[preferred].name, reason)
+
+
+@st.cache_resource
+def get_model_router(tiers: Tuple[ModelTier, ...], latency_budget_ms: float) -> ModelRouter:
+    """行程內共用同一個 router（延遲與節流狀態跨 session 累積）"""
+    return ModelRouter(tiers, latency_budget_ms=latency_budget_ms)
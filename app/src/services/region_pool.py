@@ -0,0 +1,179 @@
+# src/services/region_pool.py
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+import streamlit as st
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+from opentelemetry import trace
+
+from src.services import metrics
+from src.services.circuit_breaker import CircuitOpenError
+
+T = TypeVar("T")
+
+# 換 region 重送有機會成功的錯誤（節流、暫時性的服務端錯誤）
+FAILOVER_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+}
+
+
+def failover_reason(error: Exception) -> Optional[str]:
+    """可以換 region 重送時回傳錯誤分類，否則回傳 None（例如 ValidationException）"""
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code", "")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        if code in FAILOVER_ERROR_CODES or status == 429 or status >= 500:
+            return code or str(status)
+        return None
+    if isinstance(error, (BotoConnectionError, HTTPClientError)):
+        return type(error).__name__
+    return None
+
+
+@dataclass
+class RegionHealth:
+    """單一 region 的被動健康狀態（只依實際請求的結果更新）"""
+    region: str
+    latency_ewma_ms: Optional[float] = None
+    error_ewma: float = 0.0
+    consecutive_failures: int = 0
+    unhealthy_until: float = 0.0
+
+    def healthy(self, now: float) -> bool:
+        return self.unhealthy_until <= now
+
+    def score(self) -> float:
+        # 沒有樣本的 region 排在有樣本的之後（依設定順序），錯誤率高的 region 分數加重
+        if self.latency_ewma_ms is None:
+            return float("inf")
+        return self.latency_ewma_ms * (1.0 + 4.0 * self.error_ewma)
+
+
+class RegionalClientPool:
+    """
+    多 region 的 bedrock-runtime client 集合
+
+    - 每個 region 以 EWMA 追蹤延遲與錯誤率，請求送往分數最好的健康 region
+    - 節流 / 5xx / 連線錯誤時標記該 region 暫時不健康（冷卻時間隨連續失敗加倍），改送下一個 region
+    - 少量請求（explore_ratio）送往次佳的健康 region，讓延遲估計不會過時
+    """
+
+    def __init__(
+        self,
+        clients: Dict[str, object],
+        *,
+        alpha: float = 0.2,
+        base_cooldown_seconds: float = 5.0,
+        max_cooldown_seconds: float = 60.0,
+        explore_ratio: float = 0.02,
+    ):
+        """
+        :param clients: region -> client（dict 順序即偏好順序，第一個為主 region）
+        :param alpha: EWMA 權重（越大越快反映最近的延遲）
+        """
+        if not clients:
+            raise ValueError("RegionalClientPool requires at least one region")
+        self.clients = clients
+        self.alpha = alpha
+        self.base_cooldown_seconds = base_cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self.explore_ratio = explore_ratio
+        self._lock = threading.Lock()
+        self._health = {region: RegionHealth(region) for region in clients}
+
+    def ordered_regions(self) -> List[str]:
+        """依健康狀態與分數排序的 region（不健康的 region 仍排在最後作為最後手段）"""
+        now = time.monotonic()
+        with self._lock:
+            preference = list(self.clients)
+            regions = sorted(
+                preference,
+                key=lambda r: (not self._health[r].healthy(now), self._health[r].score(), preference.index(r)),
+            )
+            healthy = [r for r in regions if self._health[r].healthy(now)]
+        if len(healthy) > 1 and random.random() < self.explore_ratio:
+            regions.remove(healthy[1])
+            regions.insert(0, healthy[1])
+        return regions
+
+    def call(self, fn: Callable[[object], T]) -> T:
+        """
+        以最佳 region 的 client 執行 fn，可換 region 的錯誤發生時依序嘗試下一個
+
+        :param fn: client -> 結果（例如 lambda c: c.converse(**request)）
+        """
+        span = trace.get_current_span()
+        regions = self.ordered_regions()
+        last_error: Optional[Exception] = None
+
+        for attempt, region in enumerate(regions):
+            if attempt > 0:
+                metrics.bedrock_region_failovers.add(1, {"from_region": regions[attempt - 1], "to_region": region})
+                span.add_event("bedrock.region.failover", {"region": region, "reason": str(last_error)})
+
+            started = time.perf_counter()
+            try:
+                result = fn(self.clients[region])
+            except CircuitOpenError as e:
+                # 斷路器開啟的 region 直接跳過，請求沒有送出，不影響延遲與錯誤統計
+                last_error = e
+                continue
+            except Exception as e:
+                reason = failover_reason(e)
+                if reason is None:
+                    # 請求本身的問題（例如 ValidationException），與 region 健康無關
+                    raise
+                self.observe(region, (time.perf_counter() - started) * 1000, error=reason)
+                last_error = e
+                continue
+
+            self.observe(region, (time.perf_counter() - started) * 1000)
+            span.set_attribute("gen_ai.request.region", region)
+            span.set_attribute("gen_ai.region.attempts", attempt + 1)
+            return result
+
+        raise last_error
+
+    def observe(self, region: str, latency_ms: float, error: Optional[str] = None) -> None:
+        """
+        回報一次呼叫結果
+
+        :param error: 可換 region 的錯誤分類（見 failover_reason）；成功時為 None
+        """
+        attributes = {"region": region}
+        with self._lock:
+            health = self._health[region]
+            health.error_ewma = (1 - self.alpha) * health.error_ewma + self.alpha * (1.0 if error else 0.0)
+            if error is None:
+                health.consecutive_failures = 0
+                health.unhealthy_until = 0.0
+                if health.latency_ewma_ms is None:
+                    health.latency_ewma_ms = latency_ms
+                else:
+                    health.latency_ewma_ms = (1 - self.alpha) * health.latency_ewma_ms + self.alpha * latency_ms
+            else:
+                health.consecutive_failures += 1
+                cooldown = min(
+                    self.max_cooldown_seconds,
+                    self.base_cooldown_seconds * 2 ** (health.consecutive_failures - 1),
+                )
+                health.unhealthy_until = time.monotonic() + cooldown
+
+        if error is None:
+            metrics.bedrock_region_latency.record(latency_ms, attributes)
+        else:
+            metrics.bedrock_region_errors.add(1, {**attributes, "error": error})
+
+
+@st.cache_resource
+def get_regional_client_pool(regions: Tuple[str, ...], _clients: Dict[str, object]) -> RegionalClientPool:
+    """行程內共用同一組 region 健康狀態（regions 作為 cache key，_clients 不參與 hash）"""
+    return RegionalClientPool({region: _clients[region] for region in regions})
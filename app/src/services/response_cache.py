@@ -0,0 +1,188 @@
+# src/services/response_cache.py
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import boto3
+import streamlit as st
+from opentelemetry import trace
+
+from src.prompts import SYSTEM_PROMPT_VERSION
+from src.services.logging import get_logger
+from src.services import metrics
+
+logger = get_logger()
+
+# 共用層與對話表放在同一張表，以前綴區隔；不帶 user_id / created_at，不會進入 GSI
+SHARED_KEY_PREFIX = "response-cache#"
+
+
+def normalize_prompt(prompt: str) -> str:
+    """大小寫、空白與結尾標點不影響快取命中"""
+    return re.sub(r"\s+", " ", prompt).strip().rstrip("?？!！.。").lower()
+
+
+class LRUCache:
+    """執行緒安全、帶 TTL 的 LRU（Streamlit 每個 session 各自一條執行緒）"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, name: str = "local"):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._items[key]
+                metrics.cache_evictions.add(1, {"cache": self.name, "reason": "expired"})
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value) -> None:
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                metrics.cache_evictions.add(1, {"cache": self.name, "reason": "capacity"})
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class DynamoDBCacheTier:
+    """跨 Pod 共用的快取層，存放於對話表（TTL 屬性 ttl_timestamp）"""
+
+    def __init__(self, table_name: str, region: str, ttl_seconds: float):
+        self.table = boto3.resource('dynamodb', region_name=region).Table(table_name)
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            response = self.table.get_item(
+                Key={'session_id': SHARED_KEY_PREFIX + key, 'message_index': 0}
+            )
+        except Exception as e:
+            logger.error("Failed to read shared response cache", extra={"error": str(e)})
+            return None
+
+        item = response.get('Item')
+        # 表的 TTL 刪除有延遲（且 prod 未啟用），讀取時自行檢查是否過期
+        if not item or int(item.get('ttl_timestamp', 0)) < time.time():
+            return None
+        return item['content']
+
+    def put(self, key: str, value: str, model_id: str) -> None:
+        try:
+            self.table.put_item(Item={
+                'session_id': SHARED_KEY_PREFIX + key,
+                'message_index': 0,
+                'role': 'assistant',
+                'content': value,
+                'model_id': model_id,
+                'ttl_timestamp': int(time.time() + self.ttl_seconds),
+            })
+        except Exception as e:
+            logger.error("Failed to write shared response cache", extra={"error": str(e)})
+
+
+class ResponseCache:
+    """
+    重複問題的兩層回應快取
+
+    - key：正規化 prompt + model_id + temperature + system prompt 版本
+    - 第一層：行程內 LRU（TTL）；第二層（可選）：DynamoDB 共用層，命中時回填第一層
+    - 會話已有前文或 temperature 高於門檻時自動略過
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int,
+        ttl_seconds: float,
+        shared_tier: Optional[DynamoDBCacheTier] = None,
+    ):
+        self.local = LRUCache(max_entries, ttl_seconds, name="response")
+        self.shared = shared_tier
+
+    @staticmethod
+    def make_key(prompt: str, model_id: str, temperature: float) -> str:
+        raw = "\x1f".join([
+            normalize_prompt(prompt), model_id, f"{temperature:.2f}", SYSTEM_PROMPT_VERSION,
+        ])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_cacheable(messages: Optional[List[Dict]], temperature: float, max_temperature: float) -> bool:
+        """只快取沒有前文的單輪問題；回答內容取決於前文時不可共用"""
+        has_context = messages is not None and len(messages) > 1
+        return not has_context and temperature <= max_temperature
+
+    def get(self, key: str) -> Optional[str]:
+        span = trace.get_current_span()
+
+        value = self.local.get(key)
+        if value is not None:
+            self._record(span, "hit", "local")
+            return value
+
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.put(key, value)
+                self._record(span, "hit", "shared")
+                return value
+
+        self._record(span, "miss", None)
+        return None
+
+    def put(self, key: str, value: str, model_id: str) -> None:
+        self.local.put(key, value)
+        if self.shared is not None:
+            self.shared.put(key, value, model_id)
+
+    @staticmethod
+    def record_bypass() -> None:
+        ResponseCache._record(trace.get_current_span(), "bypass", None)
+
+    @staticmethod
+    def _record(span, result: str, tier: Optional[str]) -> None:
+        span.set_attribute("gen_ai.response_cache.result", result)
+        attributes = {"result": result}
+        if tier:
+            span.set_attribute("gen_ai.response_cache.tier", tier)
+            attributes["tier"] = tier
+        metrics.response_cache_lookups.add(1, attributes)
+
+
+@st.cache_resource
+def get_response_cache(
+    max_entries: int,
+    ttl_seconds: float,
+    shared_table_name: Optional[str] = None,
+    region: str = "ap-northeast-1",
+) -> ResponseCache:
+    """行程內共用同一個快取（跨 Streamlit session 與 rerun）"""
+    shared_tier = (
+        DynamoDBCacheTier(shared_table_name, region, ttl_seconds)
+        if shared_table_name else None
+    )
+    return ResponseCache(
+        max_entries=max_entries,
+        ttl_seconds=ttl_seconds,
+        shared_tier=shared_tier,
+    )
@@ -0,0 +1,406 @@
+# src/services/semantic_cache.py
+import atexit
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import streamlit as st
+from opentelemetry import trace
+
+from src.services.logging import get_logger
+from src.services import metrics
+
+logger = get_logger()
+
+
+class HashingEmbedder:
+    """
+    本地替代 embedder（feature hashing，無需呼叫 Bedrock）
+
+    以詞與相鄰詞對做 hashing，適合測試與離線環境；
+    語意能力遠不如 Bedrock embedding，只能處理用詞接近的改寫。
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    def embed(self, text: str) -> np.ndarray:
+        tokens = re.findall(r"\w+", text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in features:
+            # 不能用 hash()：PYTHONHASHSEED 使每個行程的結果不同
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dimensions] += 1.0 if (h >> 31) & 1 else -1.0
+        return vector
+
+
+class BedrockEmbedder:
+    """以 Bedrock embedding model（Titan Text Embeddings V2）產生向量"""
+
+    def __init__(self, client, model_id: str, dimensions: int = 256):
+        self.client = client
+        self.model_id = model_id
+        self.dimensions = dimensions
+
+    def embed(self, text: str) -> np.ndarray:
+        response = self.client.invoke_model(
+            modelId=self.model_id,
+            body=json.dumps({"inputText": text, "dimensions": self.dimensions, "normalize": True}),
+        )
+        payload = json.loads(response["body"].read())
+        return np.asarray(payload["embedding"], dtype=np.float32)
+
+
+class SemanticIndex:
+    """
+    NumPy 向量索引（cosine 最近鄰），支援 LRU 淘汰與 memory-mapped 持久化
+
+    - 向量正規化後存放於 (capacity, dim) float32 矩陣，有 path 時為 .npy memmap
+    - 筆數少時整批暴力搜尋；達 TRAIN_MIN 筆後以 spherical k-means 建立粗分群 (IVF)，
+      查詢只掃描最接近的 nprobe 個分群，10 萬筆時單次查詢維持在 1ms 以內
+    - 分群在背景執行緒以當下的快照計算，完成後才在鎖內換上；計算期間查詢沿用舊分群（或暴力搜尋）
+    - 每筆向量帶 namespace，查詢只比對同一 namespace 的項目
+    - payload 以 append-only JSONL 記錄（同一 slot 以最後一筆為準），重啟時重建
+    """
+
+    TRAIN_MIN = 2048
+    KMEANS_ITERATIONS = 8
+
+    def __init__(self, dim: int, capacity: int, path: Optional[str] = None, nprobe: int = 6):
+        self.dim = dim
+        self.capacity = capacity
+        self.path = path
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._rng = np.random.default_rng(0)
+
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._payloads: List[Optional[Dict]] = [None] * capacity
+        self._high_water = 0
+        self._free: List[int] = []
+        # namespace 以整數代碼存放，搜尋時以向量化比較過濾
+        self._namespace_codes: Dict[str, int] = {}
+        self._namespaces = np.full(capacity, -1, dtype=np.int32)
+
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[List[int]] = []
+        self._assign = np.full(capacity, -1, dtype=np.int32)
+        self._trained_size = 0
+        # 背景分群期間新增 / 覆寫的 slot，換上新分群時重新指派
+        self._training = False
+        self._dirty: set = set()
+
+        self._log = None
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._vectors = self._open_vectors(os.path.join(path, "vectors.npy"))
+            self._load_entries(os.path.join(path, "entries.jsonl"))
+        else:
+            self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return int(self._valid.sum())
+
+    def search(self, vector: np.ndarray, namespace: str = "") -> Tuple[int, float]:
+        """
+        回傳同一 namespace 內最相似的 (slot, cosine similarity)；沒有候選項目時回傳 (-1, -1.0)
+
+        :param vector: 已正規化的查詢向量
+        :param namespace: 只比對以此 namespace 加入的項目
+        """
+        with self._lock:
+            code = self._namespace_codes.get(namespace)
+            if code is None:
+                return -1, -1.0
+            if self._centroids is None:
+                candidates = np.flatnonzero(self._valid[:self._high_water])
+            else:
+                centroid_scores = self._centroids @ vector
+                nprobe = min(self.nprobe, len(self._lists))
+                probe = np.argpartition(centroid_scores, -nprobe)[-nprobe:]
+                candidates = np.fromiter(
+                    itertools.chain.from_iterable(self._lists[i] for i in probe),
+                    dtype=np.int64,
+                )
+            candidates = candidates[self._namespaces[candidates] == code]
+
+            if len(candidates) == 0:
+                return -1, -1.0
+
+            scores = self._vectors[candidates] @ vector
+            best = int(np.argmax(scores))
+            slot = int(candidates[best])
+            self._last_used[slot] = time.time()
+            return slot, float(scores[best])
+
+    def payload(self, slot: int) -> Optional[Dict]:
+        return self._payloads[slot]
+
+    def add(self, vector: np.ndarray, payload: Dict, namespace: str = "") -> int:
+        """加入一筆向量；已滿時淘汰最久未使用的一筆"""
+        with self._lock:
+            slot = self._allocate_slot()
+            now = time.time()
+            self._vectors[slot] = vector
+            self._valid[slot] = True
+            self._last_used[slot] = now
+            self._payloads[slot] = payload
+            self._namespaces[slot] = self._namespace_code(namespace)
+            self._append_entry(slot, namespace, payload, now)
+
+            if self._centroids is not None:
+                self._assign_slots(np.array([slot]))
+            if self._training:
+                self._dirty.add(slot)
+            self._maybe_train()
+            return slot
+
+    def flush(self) -> None:
+        with self._lock:
+            if isinstance(self._vectors, np.memmap):
+                self._vectors.flush()
+            if self._log is not None:
+                self._log.flush()
+
+    # ------------------------------------------------------------------
+    # slot 管理
+    # ------------------------------------------------------------------
+
+    def _allocate_slot(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._high_water < self.capacity:
+            self._high_water += 1
+            return self._high_water - 1
+
+        # LRU 淘汰
+        last_used = np.where(self._valid, self._last_used, np.inf)
+        slot = int(np.argmin(last_used))
+        self._remove_from_list(slot)
+        self._valid[slot] = False
+        self._payloads[slot] = None
+        metrics.cache_evictions.add(1, {"cache": "semantic", "reason": "capacity"})
+        return slot
+
+    def _namespace_code(self, namespace: str) -> int:
+        return self._namespace_codes.setdefault(namespace, len(self._namespace_codes))
+
+    def _remove_from_list(self, slot: int) -> None:
+        list_id = self._assign[slot]
+        if list_id >= 0:
+            self._lists[list_id].remove(slot)
+            self._assign[slot] = -1
+
+    # ------------------------------------------------------------------
+    # 粗分群 (IVF)
+    # ------------------------------------------------------------------
+
+    def _maybe_train(self) -> None:
+        """達到門檻時在背景執行緒重新分群（呼叫端持有 _lock）"""
+        if self._training:
+            return
+        count = len(self)
+        if count < self.TRAIN_MIN:
+            return
+        # 資料量成長 4 倍後重新分群，避免早期的分群在資料變多後失衡
+        if self._centroids is not None and count < self._trained_size * 4:
+            return
+        self._training = True
+        self._dirty = set()
+        threading.Thread(
+            target=self._train, args=(np.flatnonzero(self._valid),), name="semantic-index-train", daemon=True
+        ).start()
+
+    def _train(self, slots: np.ndarray) -> None:
+        """
+        以 slots 的快照計算分群並換上；k-means 與指派不持有鎖，add / search 不會被擋住
+
+        計算期間被覆寫的 slot 可能讀到新舊混合的向量，這些 slot 都在 _dirty 中，換上時重新指派。
+        """
+        started = time.time()
+        try:
+            nlist = int(np.clip(2 * np.sqrt(len(slots)), 16, 2048))
+            sample_size = min(len(slots), nlist * 32)
+            sample = self._vectors[self._rng.choice(slots, sample_size, replace=False)]
+
+            centroids = sample[self._rng.choice(sample_size, nlist, replace=False)].copy()
+            for _ in range(self.KMEANS_ITERATIONS):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                order = np.argsort(labels, kind="stable")
+                present, starts = np.unique(labels[order], return_index=True)
+                sums = np.add.reduceat(sample[order], starts, axis=0)
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                centroids[present] = sums / np.maximum(norms, 1e-12)
+                # 空分群重新抽樣
+                empty = np.setdiff1d(np.arange(nlist), present)
+                if len(empty):
+                    centroids[empty] = sample[self._rng.choice(sample_size, len(empty), replace=False)]
+
+            lists: List[List[int]] = [[] for _ in range(nlist)]
+            assign = np.full(self.capacity, -1, dtype=np.int32)
+            for start in range(0, len(slots), 16384):
+                chunk = slots[start:start + 16384]
+                labels = np.argmax(self._vectors[chunk] @ centroids.T, axis=1)
+                assign[chunk] = labels
+                for slot, label in zip(chunk.tolist(), labels.tolist()):
+                    lists[label].append(slot)
+
+            with self._lock:
+                # 快照之後新增或覆寫（含被淘汰後重用）的 slot 以新分群重新指派
+                for slot in self._dirty:
+                    if assign[slot] >= 0:
+                        lists[assign[slot]].remove(slot)
+                        assign[slot] = -1
+                self._centroids = centroids
+                self._lists = lists
+                self._assign = assign
+                dirty = np.array(sorted(slot for slot in self._dirty if self._valid[slot]), dtype=np.int64)
+                if len(dirty):
+                    self._assign_slots(dirty)
+                self._trained_size = len(slots)
+        except Exception as e:
+            logger.error("Semantic index clustering failed", extra={"error": str(e)})
+            return
+        finally:
+            with self._lock:
+                self._training = False
+                self._dirty = set()
+
+        logger.info("Semantic index clustered", extra={
+            "entries": len(slots), "nlist": nlist, "duration": time.time() - started,
+        })
+
+    def _assign_slots(self, slots: np.ndarray) -> None:
+        labels = np.argmax(self._vectors[slots] @ self._centroids.T, axis=1)
+        for slot, label in zip(slots.tolist(), labels.tolist()):
+            self._lists[label].append(slot)
+            self._assign[slot] = label
+
+    # ------------------------------------------------------------------
+    # 持久化
+    # ------------------------------------------------------------------
+
+    def _open_vectors(self, vectors_path: str) -> np.memmap:
+        if os.path.exists(vectors_path):
+            vectors = np.load(vectors_path, mmap_mode="r+")
+            if vectors.shape == (self.capacity, self.dim) and vectors.dtype == np.float32:
+                return vectors
+            logger.info("Semantic index shape changed, rebuilding", extra={"path": vectors_path})
+            del vectors
+        return np.lib.format.open_memmap(
+            vectors_path, mode="w+", dtype=np.float32, shape=(self.capacity, self.dim)
+        )
+
+    def _load_entries(self, log_path: str) -> None:
+        entries: Dict[int, Dict] = {}
+        lines = 0
+        if os.path.exists(log_path):
+            with open(log_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 行程中途被終止時最後一行可能不完整
+                        continue
+                    lines += 1
+                    entries[record["slot"]] = record
+
+        for slot, record in entries.items():
+            if slot >= self.capacity:
+                continue
+            self._valid[slot] = True
+            self._last_used[slot] = record["t"]
+            self._payloads[slot] = record["payload"]
+            # 舊版記錄沒有 ns 欄位，namespace 在 payload 內
+            self._namespaces[slot] = self._namespace_code(record.get("ns", record["payload"].get("ns", "")))
+        self._high_water = int(np.flatnonzero(self._valid).max()) + 1 if entries else 0
+        self._free = np.flatnonzero(~self._valid[:self._high_water]).tolist()
+
+        if lines > 2 * max(len(entries), 1):
+            # 覆寫過多次的 log 重新整理，只保留目前有效的記錄
+            tmp_path = log_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for record in entries.values():
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, log_path)
+
+        self._log = open(log_path, "a", encoding="utf-8")
+        if len(self) >= self.TRAIN_MIN:
+            # 啟動時尚無查詢，直接在目前執行緒分群
+            self._training = True
+            self._train(np.flatnonzero(self._valid))
+        logger.info("Semantic index loaded", extra={"path": self.path, "entries": len(self)})
+
+    def _append_entry(self, slot: int, namespace: str, payload: Dict, timestamp: float) -> None:
+        # 向量先寫入 memmap，記錄後寫；中途失敗時該 slot 沒有記錄，重啟後視為空位
+        if self._log is not None:
+            record = {"slot": slot, "t": timestamp, "ns": namespace, "payload": payload}
+            self._log.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._log.flush()
+
+
+class SemanticCache:
+    """
+    語意快取：以 embedding 最近鄰比對改寫過的相同問題
+
+    namespace（model_id + temperature + system prompt 版本）不同的項目不會命中。
+    """
+
+    def __init__(self, *, embedder, index: SemanticIndex, threshold: float):
+        self.embedder = embedder
+        self.index = index
+        self.threshold = threshold
+
+    def embed(self, prompt: str) -> np.ndarray:
+        vector = np.asarray(self.embedder.embed(prompt), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, vector: np.ndarray, namespace: str) -> Optional[str]:
+        span = trace.get_current_span()
+        started = time.perf_counter()
+        slot, score = self.index.search(vector, namespace)
+        metrics.semantic_cache_search_duration.record((time.perf_counter() - started) * 1000)
+
+        payload = self.index.payload(slot) if slot >= 0 else None
+        hit = payload is not None and score >= self.threshold
+
+        span.set_attribute("gen_ai.semantic_cache.result", "hit" if hit else "miss")
+        span.set_attribute("gen_ai.semantic_cache.similarity", score)
+        metrics.semantic_cache_lookups.add(1, {"result": "hit" if hit else "miss"})
+        if slot >= 0:
+            metrics.semantic_cache_similarity.record(score)
+        return payload["answer"] if hit else None
+
+    def add(self, vector: np.ndarray, namespace: str, answer: str) -> None:
+        self.index.add(vector, {"ns": namespace, "answer": answer}, namespace)
+
+
+@st.cache_resource
+def get_semantic_cache(
+    _client,
+    embedder: str,
+    embedding_model_id: str,
+    dimensions: int,
+    max_entries: int,
+    threshold: float,
+    path: Optional[str] = None,
+) -> SemanticCache:
+    """行程內共用同一個語意快取；path 為空時不持久化"""
+    if embedder == "hashing":
+        embedder_impl = HashingEmbedder(dimensions)
+    else:
+        embedder_impl = BedrockEmbedder(_client, embedding_model_id, dimensions)
+
+    index = SemanticIndex(dimensions, max_entries, path=path or None)
+    atexit.register(index.flush)
+    return SemanticCache(embedder=embedder_impl, index=index, threshold=threshold)
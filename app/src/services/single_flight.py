@@ -0,0 +1,125 @@
+# src/services/single_flight.py
+import threading
+from typing import Callable, Dict, Iterator, Tuple, TypeVar
+
+from opentelemetry import context as otel_context
+from opentelemetry import trace
+
+from src.services import metrics
+
+T = TypeVar("T")
+
+
+class _Flight:
+    """一次進行中的呼叫；串流模式下 chunks 依序累積，供所有等待者讀取"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks: list = []
+        self.result = None
+        self.error = None
+        self.done = False
+
+
+class SingleFlight:
+    """
+    行程內的 single-flight：相同 key 的呼叫進行中時，後到者等待同一個結果
+
+    Streamlit 每個 session 是獨立執行緒，事故時大量使用者貼上同一段錯誤訊息，
+    相同請求只會送出一次模型呼叫。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """阻塞模式：第一個呼叫者執行 fn，其餘呼叫者等待並共用結果（含例外）"""
+        flight, leader = self._join(key)
+        if leader:
+            try:
+                flight.result = fn()
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                self._finish(key, flight)
+            return flight.result
+
+        with flight.cond:
+            flight.cond.wait_for(lambda: flight.done)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stream(self, key: str, fn: Callable[[], Iterator[T]]) -> Iterator[T]:
+        """
+        串流模式：來源 generator 在背景執行緒消費，所有呼叫者（含第一個）都是訂閱者
+
+        後到者先取得已產生的 chunks，再隨來源即時收到後續 chunks；
+        任何訂閱者中途離開（例如頁面 rerun）都不會影響其他人。
+        """
+        flight, leader = self._join(key)
+        if leader:
+            # 帶上呼叫端的 OTel context，模型呼叫的 span 屬性仍記在 leader 的 span 上
+            ctx = otel_context.get_current()
+            threading.Thread(
+                target=self._pump,
+                args=(key, flight, fn, ctx),
+                name=f"single-flight-{self.name}",
+                daemon=True,
+            ).start()
+        return self._subscribe(flight)
+
+    def _join(self, key: str) -> Tuple[_Flight, bool]:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        role = "leader" if leader else "follower"
+        trace.get_current_span().set_attribute("gen_ai.single_flight.role", role)
+        metrics.single_flight_calls.add(1, {"flight": self.name, "role": role})
+        return flight, leader
+
+    def _finish(self, key: str, flight: _Flight) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.cond:
+            flight.done = True
+            flight.cond.notify_all()
+
+    def _pump(self, key: str, flight: _Flight, fn: Callable[[], Iterator[T]], ctx) -> None:
+        token = otel_context.attach(ctx)
+        try:
+            for chunk in fn():
+                with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            otel_context.detach(token)
+            self._finish(key, flight)
+
+    @staticmethod
+    def _subscribe(flight: _Flight) -> Iterator[T]:
+        position = 0
+        while True:
+            with flight.cond:
+                flight.cond.wait_for(lambda: len(flight.chunks) > position or flight.done)
+                new_chunks = flight.chunks[position:]
+                done = flight.done
+            yield from new_chunks
+            position += len(new_chunks)
+            if done:
+                break
+        if flight.error is not None:
+            raise flight.error
+
+
+# 行程內共用（跨 Streamlit session 與 rerun）
+bedrock_flights = SingleFlight("bedrock")
@@ -0,0 +1,378 @@
+# src/services/write_behind.py
+import atexit
+import random
+import signal
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from botocore.exceptions import ClientError
+
+from src.services.logging import get_logger
+from src.services import metrics
+
+logger = get_logger()
+
+# BatchWriteItem 單次最多 25 筆
+MAX_BATCH_ITEMS = 25
+
+# 節流與服務端暫時性錯誤才重試；其餘 ClientError（ValidationException、AccessDenied、
+# item 超過 400 KB 等）重送也不會成功
+RETRYABLE_ERROR_CODES = frozenset({
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "InternalServerError",
+    "ServiceUnavailable",
+    "TransactionConflictException",
+})
+
+
+def is_retryable(error: Exception) -> bool:
+    """ClientError 依錯誤碼判斷；連線逾時等非 ClientError 一律視為暫時性錯誤"""
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES
+    return True
+
+
+def record_consumed_capacity(operation: str, response: Dict) -> None:
+    """記錄 ReturnConsumedCapacity='TOTAL' 回傳的容量單位（BatchWriteItem 回傳 list）"""
+    consumed = response.get("ConsumedCapacity")
+    if not consumed:
+        return
+    for entry in consumed if isinstance(consumed, list) else [consumed]:
+        metrics.dynamodb_consumed_capacity.add(entry.get("CapacityUnits", 0), {"operation": operation})
+
+
+def build_update_kwargs(set_fields: Dict, default_fields: Optional[Dict] = None) -> Dict:
+    """
+    組出 UpdateItem 的 UpdateExpression 參數
+
+    :param set_fields: 直接覆寫的欄位（SET name = value）
+    :param default_fields: 只在欄位不存在時寫入（SET name = if_not_exists(name, value)）
+    """
+    names, values, clauses = {}, {}, []
+    for i, (name, value) in enumerate(set_fields.items()):
+        names[f"#s{i}"] = name
+        values[f":s{i}"] = value
+        clauses.append(f"#s{i} = :s{i}")
+    # 同一欄位同時出現時以 SET 為準（同一個 UpdateExpression 不能重複路徑）
+    defaults = {k: v for k, v in (default_fields or {}).items() if k not in set_fields}
+    for i, (name, value) in enumerate(defaults.items()):
+        names[f"#d{i}"] = name
+        values[f":d{i}"] = value
+        clauses.append(f"#d{i} = if_not_exists(#d{i}, :d{i})")
+    return {
+        "UpdateExpression": "SET " + ", ".join(clauses),
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": values,
+    }
+
+
+class WriteBehindQueue:
+    """
+    DynamoDB 寫入的 write-behind 佇列
+
+    - put() 只放入記憶體即返回；背景執行緒把待寫項目合併成 BatchWriteItem（每批最多 25 筆）
+    - 同一個 key 尚未寫入前再次 put 會覆蓋舊值（只寫最後一版）
+    - update() 對同一個 key 的欄位更新會合併，每個 key 只送一次 UpdateItem（例如會話 metadata）
+    - UnprocessedItems 與暫時性錯誤以 full-jitter 指數退避重試，每個項目最多 max_attempts 次；
+      不可重試的錯誤（整批失敗時逐筆重送找出壞項目）與超過次數的項目記錄 error log 後丟棄，不擋住其他寫入
+    - 寫入完成前項目保留在 pending 中，同一個 Pod 內的讀取可以合併（read-your-writes）
+    - pending 達 max_pending 時 put() 會等待背景執行緒寫出空間（背壓），記憶體不會無限增長
+    - 會話還有訊息未寫入時不送它的 metadata 更新，metadata 不會領先訊息
+    - atexit / SIGTERM 時同步寫完剩餘項目，Pod 滾動更新不會遺失訊息
+    """
+
+    def __init__(
+        self,
+        table,
+        key_names: Tuple[str, str],
+        *,
+        linger_seconds: float = 0.05,
+        base_backoff_seconds: float = 0.05,
+        max_backoff_seconds: float = 5.0,
+        max_attempts: int = 8,
+        max_pending: int = 5000,
+        on_updated: Optional[Callable[[Tuple, Dict], None]] = None,
+    ):
+        """
+        :param table: boto3 DynamoDB Table resource
+        :param key_names: (partition key, sort key) 欄位名稱
+        :param linger_seconds: 收到第一筆後等待湊批的時間
+        :param max_attempts: 每個項目 / 更新的最多嘗試次數，超過即丟棄
+        :param max_pending: 待寫項目上限，達上限時 put() 等待
+        :param on_updated: UpdateItem 成功後以 (key, set_fields) 呼叫（例如失效讀取快取）
+        """
+        self.table = table
+        self.key_names = key_names
+        self.linger_seconds = linger_seconds
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.max_attempts = max(max_attempts, 1)
+        self.max_pending = max(max_pending, 1)
+        self.on_updated = on_updated
+
+        self._cond = threading.Condition()
+        self._pending: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        # key -> (set_fields, default_fields)
+        self._updates: "OrderedDict[Tuple, Tuple[Dict, Dict]]" = OrderedDict()
+        # key -> 已失敗次數
+        self._attempts: Dict[Tuple, int] = {}
+        self._update_attempts: Dict[Tuple, int] = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="dynamodb-write-behind", daemon=True)
+        self._thread.start()
+
+    def put(self, item: Dict) -> None:
+        key = self._key(item)
+        with self._cond:
+            if key not in self._pending and len(self._pending) >= self.max_pending and not self._closed:
+                metrics.dynamodb_write_queue_full.add(1)
+                logger.warning("Write-behind queue full, waiting", extra={"items": len(self._pending)})
+                while key not in self._pending and len(self._pending) >= self.max_pending and not self._closed:
+                    self._cond.wait()
+            if self._closed:
+                raise RuntimeError("write-behind queue is closed")
+            if key not in self._pending:
+                metrics.dynamodb_write_queue_depth.add(1)
+            self._pending[key] = item
+            # 新版本重新計算嘗試次數
+            self._attempts.pop(key, None)
+            self._cond.notify()
+
+    def update(self, key: Tuple, set_fields: Dict, default_fields: Optional[Dict] = None) -> None:
+        """
+        排入一次 UpdateItem；尚未送出前同一個 key 的更新會合併
+
+        set_fields 以較新的值為準，default_fields 以最早的值為準（對應 if_not_exists）
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("write-behind queue is closed")
+            self._merge_update(key, set_fields, default_fields or {})
+            self._cond.notify()
+
+    def pending_items(self, partition_key: str) -> List[Dict]:
+        """尚未寫入 DynamoDB 的項目（供讀取時合併）"""
+        with self._cond:
+            return [item for key, item in self._pending.items() if key[0] == partition_key]
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """等待目前所有待寫項目寫入；逾時回傳 False"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify()
+            while self._pending or self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 20.0) -> None:
+        """停止接收新項目並寫完剩餘項目（atexit / SIGTERM）"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            remaining = len(self._pending) + len(self._updates)
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            left = len(self._pending) + len(self._updates)
+        if left:
+            logger.error("Write-behind queue closed with unwritten items", extra={"items": left})
+        else:
+            logger.info("Write-behind queue drained", extra={"items": remaining})
+
+    def install_shutdown_hooks(self) -> None:
+        """註冊 atexit；在主執行緒時另外串接 SIGTERM handler（保留原本的 handler）"""
+        atexit.register(self.close)
+        if threading.current_thread() is not threading.main_thread():
+            # Streamlit 的 script 執行緒不能設定 signal handler；
+            # Streamlit 收到 SIGTERM 時會正常關閉 server，atexit 仍會執行
+            return
+
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def on_sigterm(signum, frame):
+            self.close()
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                raise SystemExit(128 + signum)
+
+        signal.signal(signal.SIGTERM, on_sigterm)
+
+    # ------------------------------------------------------------------
+    # 背景寫入
+    # ------------------------------------------------------------------
+
+    def _run(self) -> None:
+        attempt = 0
+        while True:
+            with self._cond:
+                while not self._pending and not self._updates and not self._closed:
+                    self._cond.wait()
+                if not self._pending and not self._updates and self._closed:
+                    return
+
+            if not self._closed:
+                # 湊批：同一輪的 user / assistant 訊息、多個 session 的寫入合併成一次請求
+                time.sleep(self.linger_seconds)
+
+            with self._cond:
+                batch = list(self._pending.items())[:MAX_BATCH_ITEMS]
+
+            retry: Set[Tuple] = set()
+            if batch:
+                started = time.perf_counter()
+                rejected: Dict[Tuple, str] = {}
+                try:
+                    retry = self._write(batch)
+                except Exception as e:
+                    if is_retryable(e):
+                        logger.warning("Write-behind batch failed", extra={"items": len(batch), "error": str(e)})
+                        retry = {key for key, _ in batch}
+                    else:
+                        # 整批被拒時不知道是哪一筆，逐筆重送找出壞項目
+                        retry, rejected = self._write_each(batch)
+
+                written = [(key, item) for key, item in batch if key not in retry and key not in rejected]
+                self._complete(written)
+                for key, item in batch:
+                    if key in rejected:
+                        self._drop(key, item, "rejected", rejected[key])
+                for key, item in batch:
+                    if key in retry:
+                        self._count_attempt(key, item)
+                metrics.dynamodb_flush_duration.record((time.perf_counter() - started) * 1000)
+                metrics.dynamodb_flush_items.record(len(written))
+
+            # 訊息寫入後再更新 metadata（每個 key 合併為一次 UpdateItem）
+            retry |= self._apply_updates()
+
+            if retry:
+                metrics.dynamodb_write_retries.add(len(retry))
+                attempt += 1
+                time.sleep(self._backoff(attempt))
+            else:
+                attempt = 0
+
+    def _write(self, batch: List[Tuple[Tuple, Dict]]) -> set:
+        response = self.table.meta.client.batch_write_item(
+            RequestItems={self.table.name: [{"PutRequest": {"Item": item}} for _, item in batch]},
+            ReturnConsumedCapacity="TOTAL",
+        )
+        record_consumed_capacity("BatchWriteItem", response)
+        return {
+            self._key(request["PutRequest"]["Item"])
+            for request in response.get("UnprocessedItems", {}).get(self.table.name, [])
+        }
+
+    def _write_each(self, batch: List[Tuple[Tuple, Dict]]) -> Tuple[Set[Tuple], Dict[Tuple, str]]:
+        """逐筆 PutItem；回傳 (可重試的 key, 不可重試的 key -> 錯誤訊息)"""
+        retry, rejected = set(), {}
+        for key, item in batch:
+            try:
+                response = self.table.put_item(Item=item, ReturnConsumedCapacity="TOTAL")
+                record_consumed_capacity("PutItem", response)
+            except Exception as e:
+                if is_retryable(e):
+                    retry.add(key)
+                else:
+                    rejected[key] = str(e)
+        return retry, rejected
+
+    def _complete(self, written: List[Tuple[Tuple, Dict]]) -> None:
+        with self._cond:
+            for key, item in written:
+                # 寫入期間被新版本覆蓋的項目保留，下一批再寫
+                if self._pending.get(key) is item:
+                    del self._pending[key]
+                    self._attempts.pop(key, None)
+                    metrics.dynamodb_write_queue_depth.add(-1)
+            self._cond.notify_all()
+
+    def _count_attempt(self, key: Tuple, item: Dict) -> None:
+        with self._cond:
+            if self._pending.get(key) is not item:
+                return
+            self._attempts[key] = attempts = self._attempts.get(key, 0) + 1
+        if attempts >= self.max_attempts:
+            self._drop(key, item, "retry_limit", f"gave up after {attempts} attempts")
+
+    def _drop(self, key: Tuple, item: Dict, reason: str, error: str) -> None:
+        """放棄寫入一個項目（寫入期間被新版本覆蓋時保留新版本）"""
+        with self._cond:
+            if self._pending.get(key) is not item:
+                return
+            del self._pending[key]
+            self._attempts.pop(key, None)
+            metrics.dynamodb_write_queue_depth.add(-1)
+            self._cond.notify_all()
+        metrics.dynamodb_write_dropped.add(1, {"reason": reason, "operation": "BatchWriteItem"})
+        # 內容不寫入 log，只留下足以追查的 key 與錯誤
+        logger.error("Write-behind item dropped", extra={"key": str(key), "reason": reason, "error": error})
+
+    def _apply_updates(self) -> Set[Tuple]:
+        with self._cond:
+            # 同一個 partition 還有訊息未寫入（含剛才失敗的批次）時先不更新 metadata
+            waiting = {key[0] for key in self._pending}
+            updates = [(key, update) for key, update in self._updates.items() if key[0] not in waiting]
+
+        failed = set()
+        for key, update in updates:
+            set_fields, default_fields = update
+            try:
+                response = self.table.update_item(
+                    Key=dict(zip(self.key_names, key)),
+                    ReturnConsumedCapacity="TOTAL",
+                    **build_update_kwargs(set_fields, default_fields),
+                )
+                record_consumed_capacity("UpdateItem", response)
+            except Exception as e:
+                with self._cond:
+                    self._update_attempts[key] = attempts = self._update_attempts.get(key, 0) + 1
+                if is_retryable(e) and attempts < self.max_attempts:
+                    logger.warning("Write-behind update failed", extra={"key": str(key), "error": str(e)})
+                    failed.add(key)
+                    continue
+                reason = "retry_limit" if is_retryable(e) else "rejected"
+                metrics.dynamodb_write_dropped.add(1, {"reason": reason, "operation": "UpdateItem"})
+                logger.error("Write-behind update dropped", extra={"key": str(key), "reason": reason, "error": str(e)})
+            else:
+                if self.on_updated is not None:
+                    self.on_updated(key, set_fields)
+            with self._cond:
+                # 送出期間被合併了新欄位的項目保留，下一輪再送
+                if self._updates.get(key) is update:
+                    del self._updates[key]
+                    self._update_attempts.pop(key, None)
+                    metrics.dynamodb_write_queue_depth.add(-1)
+
+        with self._cond:
+            self._cond.notify_all()
+        return failed
+
+    def _merge_update(self, key: Tuple, set_fields: Dict, default_fields: Dict) -> None:
+        current = self._updates.get(key)
+        if current is None:
+            metrics.dynamodb_write_queue_depth.add(1)
+            self._updates[key] = (dict(set_fields), dict(default_fields))
+            return
+        # 以新的 tuple 取代（背景執行緒以物件身分判斷送出期間是否有新更新）
+        self._updates[key] = (
+            {**current[0], **set_fields},
+            {**default_fields, **current[1]},
+        )
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter：多個 Pod 同時被節流時錯開重試時間
+        return random.uniform(0, min(self.max_backoff_seconds, self.base_backoff_seconds * 2 ** attempt))
+
+    def _key(self, item: Dict) -> Tuple:
+        partition, sort = self.key_names
+        return item[partition], item[sort]
@@ -0,0 +1,91 @@
+# src/tools/compact_sessions.py
+"""
+將整個對話表中的長會話壓縮為區段（與 App 內 SESSION_SEGMENT_SIZE 的背景壓縮相同的流程）
+
+    DYNAMODB_TABLE_NAME=ai-chatbot-conversations-dev \\
+        python -m src.tools.compact_sessions --segment-size 50 --keep-open 50 --dry-run
+
+以平行 Scan 找出會話 metadata item（message_index = -1），訊息數扣除不壓縮的尾段後
+還有完整區段可壓縮的會話逐一呼叫 ConversationService.compact_session。
+可重複執行：已壓縮的範圍不會重寫，上次中斷留下的原訊息會在這次刪除。
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List
+
+from src.config import AppConfig
+from src.services.dynamodb_service import SESSION_META_INDEX, ConversationService
+
+
+def scan_session_meta(service: ConversationService, total_segments: int) -> Iterator[Dict]:
+    """平行 Scan 整張表，只回傳會話 metadata item"""
+
+    def scan_segment(segment: int) -> List[Dict]:
+        scan_kwargs = {
+            'Segment': segment,
+            'TotalSegments': total_segments,
+            'FilterExpression': 'message_index = :meta',
+            'ProjectionExpression': 'session_id, message_count, compacted_upto',
+            'ExpressionAttributeValues': {':meta': SESSION_META_INDEX},
+        }
+        items = []
+        while True:
+            response = service.table.scan(**scan_kwargs)
+            items.extend(response['Items'])
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key:
+                return items
+            scan_kwargs['ExclusiveStartKey'] = last_key
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        for items in executor.map(scan_segment, range(total_segments)):
+            yield from items
+
+
+def main() -> None:
+    cfg = AppConfig()
+    parser = argparse.ArgumentParser(description="Pack closed message runs of long sessions into compressed segments")
+    parser.add_argument("--table", default=cfg.dynamodb_table_name, help="defaults to DYNAMODB_TABLE_NAME")
+    parser.add_argument("--region", default=cfg.aws_region)
+    parser.add_argument("--segment-size", type=int, default=cfg.session_segment_size or 50)
+    parser.add_argument("--keep-open", type=int, default=cfg.session_segment_keep_open,
+                        help="most recent messages left uncompacted")
+    parser.add_argument("--scan-segments", type=int, default=4, help="parallel Scan segments")
+    parser.add_argument("--dry-run", action="store_true", help="only list sessions that would be compacted")
+    args = parser.parse_args()
+    if not args.table:
+        parser.error("--table or DYNAMODB_TABLE_NAME is required")
+
+    logging.getLogger("app").setLevel(logging.WARNING)
+    service = ConversationService(
+        args.table,
+        region=args.region,
+        compress_threshold=cfg.message_compress_threshold,
+        max_inline_bytes=cfg.message_max_inline_bytes,
+    )
+
+    started = time.monotonic()
+    scanned = candidates = segments = failed = 0
+    for meta in scan_session_meta(service, args.scan_segments):
+        scanned += 1
+        closed = int(meta.get('message_count', 0)) - args.keep_open - int(meta.get('compacted_upto', 0))
+        if closed < args.segment_size:
+            continue
+        candidates += 1
+        if args.dry_run:
+            print(f"{meta['session_id']}: {closed // args.segment_size} segment(s)")
+            continue
+        try:
+            segments += service.compact_session(meta['session_id'], args.segment_size, args.keep_open)
+        except Exception as e:
+            failed += 1
+            print(f"{meta['session_id']}: failed ({e})")
+
+    print(f"scanned {scanned} sessions, {candidates} to compact, {segments} segments written, "
+          f"{failed} failed in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+# src/tools/export_conversations.py
+"""
+將對話表匯出為分區檔案（分析用）
+
+    DYNAMODB_TABLE_NAME=ai-chatbot-conversations-dev \\
+        python -m src.tools.export_conversations --output ./export --segments 8 --capacity-fraction 0.25
+    python -m src.tools.export_conversations --output ./export --format parquet --incremental
+
+平行分段 Scan（--segments，每段一個執行緒），所有執行緒共用 --capacity-fraction × 表讀取容量的預算，
+依每頁實際的 ConsumedCapacity 扣除（on-demand 表沒有佈建容量，以 --capacity-rcu 指定）。
+每頁的 item 經 generator 逐筆轉為訊息列：拆分的訊息讀回 chunk、壓縮的區段展開為原本的訊息，
+寫入 date=YYYY-MM-DD/（訊息 timestamp 的日期）分區；每個檔案最多 --rows-per-file 列。
+每個執行緒最多同時開 --max-open-files 個分區檔案（LRU），超過時關閉最久沒寫入的檔案，
+該分區之後的列寫到新的檔案；記憶體上限約為 --segments × --max-open-files 個檔案的寫入緩衝
+（parquet 每檔最多一個 row group：--row-group-size 列且不超過 ROW_GROUP_MAX_BYTES）。
+
+增量匯出（--incremental）：<output>/_watermark.json 記錄上次匯出到的 timestamp，
+本次匯出 (上次水位, 開始時間 - --settle-seconds] 的訊息，write-behind 尚未寫入的訊息留給下次。
+檔案先以 .inprogress 寫入，全部成功後才改名並更新水位；中斷後重跑會清掉殘留檔並重匯同一區間。
+parquet 需要 pyarrow（App 映像檔不需要，只在執行匯出的環境安裝）。
+"""
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Dict, Iterator, List, Optional
+
+import boto3
+import pytz
+
+from src.config import AppConfig
+from src.services.dynamodb_service import SESSION_META_INDEX
+from src.services.message_codec import (
+    CHUNK_MARKER,
+    SEGMENT_SUFFIX,
+    MessageDecodeError,
+    chunk_data,
+    chunk_partition,
+    decode_content,
+    decode_segment,
+)
+
+WATERMARK_FILE = "_watermark.json"
+IN_PROGRESS = ".inprogress"
+FORMAT_JSONL = "jsonl.gz"
+FORMAT_PARQUET = "parquet"
+# parquet row group 緩衝的內容位元組上限（長訊息較多時提早寫出 row group）
+ROW_GROUP_MAX_BYTES = 32 * 1024 * 1024
+
+# 與 ConversationService 寫入的 timestamp 相同時區（ISO 字串可直接比較大小）
+TZ = pytz.timezone("Asia/Taipei")
+
+
+class CapacityLimiter:
+    """所有 Scan 執行緒共用的讀取容量預算（每秒 units_per_second RCU，依實際 ConsumedCapacity 扣除）"""
+
+    def __init__(self, units_per_second: float):
+        self.rate = units_per_second
+        self.available = units_per_second
+        self.updated = time.monotonic()
+        self.consumed = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        """預算為負（上一頁透支）時等待補回"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.available = min(self.rate, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available > 0:
+                    return
+                # 至少補回 0.1 單位再檢查，避免預算剛好為 0 時空轉
+                delay = max(-self.available, 0.1) / self.rate
+            time.sleep(delay)
+
+    def consume(self, response: Dict) -> None:
+        units = float(response.get("ConsumedCapacity", {}).get("CapacityUnits", 0))
+        with self.lock:
+            self.available -= units
+            self.consumed += units
+
+
+def scan_segment(table, segment: int, total_segments: int, limiter: CapacityLimiter,
+                 filter_kwargs: Dict, page_size: int) -> Iterator[Dict]:
+    """逐頁 Scan 一個分段，逐筆產出 item"""
+    scan_kwargs = {
+        "Segment": segment,
+        "TotalSegments": total_segments,
+        "Limit": page_size,
+        "ReturnConsumedCapacity": "TOTAL",
+        **filter_kwargs,
+    }
+    while True:
+        limiter.wait()
+        response = table.scan(**scan_kwargs)
+        limiter.consume(response)
+        yield from response["Items"]
+        last_key = response.get("LastEvaluatedKey")
+        if not last_key:
+            return
+        scan_kwargs["ExclusiveStartKey"] = last_key
+
+
+def read_chunks(table, limiter: CapacityLimiter, partition: str, count: int) -> List[bytes]:
+    query_kwargs = {
+        "KeyConditionExpression": "session_id = :pk",
+        "ExpressionAttributeValues": {":pk": partition},
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+    rows = []
+    while True:
+        limiter.wait()
+        response = table.query(**query_kwargs)
+        limiter.consume(response)
+        rows.extend(response["Items"])
+        last_key = response.get("LastEvaluatedKey")
+        if not last_key:
+            return chunk_data(rows)
+        query_kwargs["ExclusiveStartKey"] = last_key
+
+
+def build_filter(since: Optional[str], until: str) -> Dict:
+    """
+    Scan 的 FilterExpression 參數
+
+    訊息 item 依 timestamp 篩選 (since, until]；區段 item 的 timestamp 是最後一則訊息的時間，
+    匯出期間壓縮的區段可能晚於 until（原訊息 item 已刪除），因此只以 since 篩選，
+    區段內的每則訊息在 to_rows 再依 (since, until] 篩選。
+    """
+    # 排除 metadata（message_index = -1）、chunk item 與沒有 timestamp 的回應快取 item
+    filter_expression = (
+        "message_index > :meta AND NOT contains(session_id, :chunk)"
+        " AND (#ts <= :until OR contains(session_id, :segment))"
+    )
+    values = {":meta": SESSION_META_INDEX, ":chunk": CHUNK_MARKER, ":segment": SEGMENT_SUFFIX, ":until": until}
+    if since:
+        filter_expression += " AND #ts > :since"
+        values[":since"] = since
+    return {
+        "FilterExpression": filter_expression,
+        "ExpressionAttributeNames": {"#ts": "timestamp"},
+        "ExpressionAttributeValues": values,
+    }
+
+
+def to_rows(items: Iterator[Dict], table, limiter: CapacityLimiter, since: Optional[str], until: Optional[str],
+            stats: Dict) -> Iterator[Dict]:
+    """
+    訊息 item / 區段 item 轉為匯出的訊息列（無法還原的 item 計入 stats["skipped"]）
+
+    只產出 timestamp 在 (since, until] 的訊息：區段內較早的訊息在壓縮前已由上次增量匯出，
+    晚於 until 的留給下次。
+    """
+    for item in items:
+        partition = item["session_id"]
+        start = int(item["message_index"])
+        fetch_chunks = partial(read_chunks, table, limiter, chunk_partition(partition, start))
+        try:
+            if partition.endswith(SEGMENT_SUFFIX):
+                messages = decode_segment(item, fetch_chunks)
+                session_id = partition[:-len(SEGMENT_SUFFIX)]
+            else:
+                messages = [{**item, "content": decode_content(item, fetch_chunks)}]
+                session_id = partition
+        except (MessageDecodeError, ValueError, zlib.error) as e:
+            stats["skipped"] += 1
+            logging.getLogger("app").warning(
+                "Skipped undecodable item", extra={"session_id": partition, "message_index": start, "error": str(e)}
+            )
+            continue
+
+        for offset, message in enumerate(messages):
+            timestamp = message.get("timestamp") or None
+            if since and (timestamp is None or timestamp <= since):
+                continue
+            if until and timestamp is not None and timestamp > until:
+                continue
+            yield {
+                "session_id": session_id,
+                "message_index": start + offset,
+                "role": message["role"],
+                "content": message["content"],
+                "timestamp": timestamp,
+                "user_id": message.get("user_id"),
+            }
+
+
+class JsonlGzFile:
+    extension = ".jsonl.gz"
+
+    def __init__(self, path: str, row_group_size: int):
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.rows = 0
+
+    def write(self, row: Dict) -> None:
+        self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.rows += 1
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetFile:
+    """
+    緩衝滿 row_group_size 列或 ROW_GROUP_MAX_BYTES 位元組時寫出一個 row group
+
+    記憶體用量是緩衝的列加上 ParquetWriter 本身的狀態（欄位統計、壓縮緩衝），
+    緩衝上限只限制前者；每個開著的檔案各自佔用一份。
+    """
+
+    extension = ".parquet"
+
+    def __init__(self, path: str, row_group_size: int):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ("session_id", pa.string()),
+            ("message_index", pa.int64()),
+            ("role", pa.string()),
+            ("content", pa.string()),
+            ("timestamp", pa.string()),
+            ("user_id", pa.string()),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        self.row_group_size = row_group_size
+        self.buffer: List[Dict] = []
+        self.buffer_bytes = 0
+        self.rows = 0
+
+    def write(self, row: Dict) -> None:
+        self.buffer.append(row)
+        self.buffer_bytes += len(row["content"])
+        self.rows += 1
+        if len(self.buffer) >= self.row_group_size or self.buffer_bytes >= ROW_GROUP_MAX_BYTES:
+            self._flush()
+
+    def _flush(self) -> None:
+        self.writer.write_table(self.pa.Table.from_pylist(self.buffer, schema=self.schema))
+        self.buffer.clear()
+        self.buffer_bytes = 0
+
+    def close(self) -> None:
+        if self.buffer:
+            self._flush()
+        self.writer.close()
+
+
+class PartitionedWriter:
+    """
+    依 date=YYYY-MM-DD 分區寫入；每個分區同時只開一個檔案，滿 rows_per_file 列換檔
+
+    最多同時開 max_open_files 個檔案：Scan 順序與日期無關，一年的資料會有上百個分區，
+    超過時關閉最久沒寫入的分區檔案，該分區再有資料時開新檔。
+    """
+
+    def __init__(self, output: str, prefix: str, file_format: str, rows_per_file: int, row_group_size: int,
+                 max_open_files: int = 16):
+        self.output = output
+        self.prefix = prefix
+        self.file_class = ParquetFile if file_format == FORMAT_PARQUET else JsonlGzFile
+        self.rows_per_file = rows_per_file
+        self.row_group_size = row_group_size
+        self.max_open_files = max(max_open_files, 1)
+        # 分區 -> 檔案，依最近寫入排序
+        self.open_files: "OrderedDict[str, object]" = OrderedDict()
+        self.paths: List[str] = []
+
+    def write(self, row: Dict) -> None:
+        partition = f"date={(row['timestamp'] or 'unknown')[:10]}"
+        file = self.open_files.get(partition)
+        if file is not None:
+            self.open_files.move_to_end(partition)
+        else:
+            if len(self.open_files) >= self.max_open_files:
+                _, evicted = self.open_files.popitem(last=False)
+                evicted.close()
+            directory = os.path.join(self.output, partition)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(
+                directory, f"{self.prefix}-{len(self.paths):05d}{self.file_class.extension}{IN_PROGRESS}"
+            )
+            file = self.open_files[partition] = self.file_class(path, self.row_group_size)
+            self.paths.append(path)
+        file.write(row)
+        if file.rows >= self.rows_per_file:
+            file.close()
+            del self.open_files[partition]
+
+    def close(self) -> None:
+        for file in self.open_files.values():
+            file.close()
+        self.open_files.clear()
+
+
+def load_watermark(output: str) -> Optional[str]:
+    path = os.path.join(output, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["until"]
+
+
+def save_watermark(output: str, until: str, rows: int, files: int) -> None:
+    """先寫暫存檔再 rename，水位檔不會是寫一半的狀態"""
+    path = os.path.join(output, WATERMARK_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"until": until, "rows": rows, "files": files, "exported_at": datetime.now(TZ).isoformat()}, f)
+    os.replace(path + ".tmp", path)
+
+
+def main() -> None:
+    cfg = AppConfig()
+    parser = argparse.ArgumentParser(description="Export conversation messages to partitioned JSONL.gz / Parquet files")
+    parser.add_argument("--table", default=cfg.dynamodb_table_name, help="defaults to DYNAMODB_TABLE_NAME")
+    parser.add_argument("--region", default=cfg.aws_region)
+    parser.add_argument("--output", required=True, help="output directory")
+    parser.add_argument("--format", choices=(FORMAT_JSONL, FORMAT_PARQUET), default=FORMAT_JSONL)
+    parser.add_argument("--segments", type=int, default=4, help="parallel Scan segments (one thread each)")
+    parser.add_argument("--capacity-fraction", type=float, default=0.25,
+                        help="share of the table's read capacity the export may use")
+    parser.add_argument("--capacity-rcu", type=float, default=0,
+                        help="read capacity to take the fraction of; required for on-demand tables")
+    parser.add_argument("--page-size", type=int, default=500, help="Scan Limit per page")
+    parser.add_argument("--rows-per-file", type=int, default=100_000)
+    parser.add_argument("--row-group-size", type=int, default=10_000, help="parquet rows buffered per row group")
+    parser.add_argument("--max-open-files", type=int, default=16,
+                        help="open partition files per segment thread; the least recently written is closed")
+    parser.add_argument("--incremental", action="store_true", help="resume from the watermark in the output directory")
+    parser.add_argument("--since", help="export messages with timestamp after this ISO time (overrides the watermark)")
+    parser.add_argument("--settle-seconds", type=int, default=300,
+                        help="leave the most recent messages for the next run (late write-behind writes)")
+    args = parser.parse_args()
+    if not args.table:
+        parser.error("--table or DYNAMODB_TABLE_NAME is required")
+    if args.format == FORMAT_PARQUET:
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            parser.error("--format parquet requires pyarrow (pip install pyarrow)")
+
+    logging.getLogger("app").setLevel(logging.WARNING)
+    table = boto3.resource("dynamodb", region_name=args.region).Table(args.table)
+    capacity = args.capacity_rcu or float(table.provisioned_throughput.get("ReadCapacityUnits", 0))
+    if capacity <= 0:
+        parser.error("the table is on-demand; set --capacity-rcu")
+    limiter = CapacityLimiter(capacity * args.capacity_fraction)
+
+    os.makedirs(args.output, exist_ok=True)
+    # 上次中斷留下的未完成檔案
+    for leftover in glob.glob(os.path.join(args.output, "**", f"*{IN_PROGRESS}"), recursive=True):
+        os.remove(leftover)
+
+    since = args.since or (load_watermark(args.output) if args.incremental else None)
+    until = (datetime.now(TZ) - timedelta(seconds=args.settle_seconds)).isoformat(timespec="microseconds")
+    filter_kwargs = build_filter(since, until)
+    # 檔名帶執行 ID，不覆寫先前匯出的檔案
+    run_id = f"{datetime.now(TZ):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+    def export_segment(segment: int) -> Dict:
+        stats = {"rows": 0, "skipped": 0, "paths": []}
+        writer = PartitionedWriter(args.output, f"part-{run_id}-{segment:03d}", args.format,
+                                   args.rows_per_file, args.row_group_size, args.max_open_files)
+        try:
+            items = scan_segment(table, segment, args.segments, limiter, filter_kwargs, args.page_size)
+            for row in to_rows(items, table, limiter, since, until, stats):
+                writer.write(row)
+                stats["rows"] += 1
+        finally:
+            writer.close()
+            stats["paths"] = writer.paths
+        return stats
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.segments) as executor:
+        results = list(executor.map(export_segment, range(args.segments)))
+
+    paths = [path for result in results for path in result["paths"]]
+    for path in paths:
+        os.replace(path, path[:-len(IN_PROGRESS)])
+    rows = sum(result["rows"] for result in results)
+    save_watermark(args.output, until, rows, len(paths))
+
+    print(f"exported {rows} messages ({sum(r['skipped'] for r in results)} skipped) to {len(paths)} files "
+          f"from {since or 'the beginning'} to {until}; {limiter.consumed:.0f} RCU in "
+          f"{time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# src/tools/fake_bedrock.py
+"""
+本地的假 Bedrock Converse 端點（每個 "region" 一個 port），用於離線測試多 region 容錯
+
+    python -m src.tools.fake_bedrock \\
+        --region ap-northeast-1:8701:latency_ms=400,throttle_rate=0.3 \\
+        --region us-east-1:8702:latency_ms=900
+
+    BEDROCK_REGIONS=ap-northeast-1,us-east-1 \\
+    BEDROCK_ENDPOINT_URLS=ap-northeast-1=http://localhost:8701,us-east-1=http://localhost:8702 \\
+    AWS_ACCESS_KEY_ID=test AWS_SECRET_ACCESS_KEY=test streamlit run app.py
+
+支援 Converse 與 ConverseStream（application/vnd.amazon.eventstream），
+依設定的延遲、抖動、節流率與 5xx 比例回應；以 assistant 開頭的對話回傳 ValidationException（對應連線預熱）。
+"""
+import argparse
+import json
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+PATH_PATTERN = re.compile(r"^/model/(?P<model_id>[^/]+)/(?P<operation>converse|converse-stream)$")
+
+
+@dataclass
+class RegionBehavior:
+    region: str
+    port: int
+    latency_ms: float = 300.0
+    jitter_ms: float = 100.0
+    throttle_rate: float = 0.0
+    error_rate: float = 0.0
+    # 串流時每個 text delta 之間的間隔
+    delta_interval_ms: float = 20.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "RegionBehavior":
+        """解析 region:port[:key=value,key=value]"""
+        parts = spec.split(":", 2)
+        behavior = cls(region=parts[0], port=int(parts[1]))
+        if len(parts) == 3:
+            for option in parts[2].split(","):
+                key, _, value = option.partition("=")
+                setattr(behavior, key.strip(), float(value))
+        return behavior
+
+
+def encode_event(event_type: str, payload: Dict) -> bytes:
+    """編碼一則 AWS event stream 訊息（prelude + headers + payload + CRC32）"""
+    headers = b"".join(
+        _encode_header(name, value)
+        for name, value in (
+            (":event-type", event_type),
+            (":content-type", "application/json"),
+            (":message-type", "event"),
+        )
+    )
+    body = json.dumps(payload).encode("utf-8")
+    prelude = struct.pack(">II", 12 + len(headers) + len(body) + 4, len(headers))
+    message = prelude + struct.pack(">I", zlib.crc32(prelude)) + headers + body
+    return message + struct.pack(">I", zlib.crc32(message))
+
+
+def _encode_header(name: str, value: str) -> bytes:
+    name_bytes, value_bytes = name.encode("utf-8"), value.encode("utf-8")
+    # header value type 7 = string
+    return struct.pack(">B", len(name_bytes)) + name_bytes + struct.pack(">BH", 7, len(value_bytes)) + value_bytes
+
+
+def build_answer(region: str, messages: List[Dict]) -> str:
+    last_text = " ".join(
+        block.get("text", "") for block in messages[-1].get("content", []) if "text" in block
+    ) if messages else ""
+    return f"[fake {region}] You asked: {last_text[:200]}"
+
+
+def make_handler(behavior: RegionBehavior):
+    class ConverseHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            match = PATH_PATTERN.match(self.path)
+            if match is None:
+                return self._error(404, "UnknownOperationException", f"Unknown path {self.path}")
+
+            request = json.loads(body or b"{}")
+            messages = request.get("messages", [])
+            if not messages or messages[0].get("role") != "user":
+                return self._error(400, "ValidationException", "A conversation must start with a user message.")
+
+            time.sleep(max(0.0, behavior.latency_ms + random.uniform(-1, 1) * behavior.jitter_ms) / 1000)
+
+            roll = random.random()
+            if roll < behavior.throttle_rate:
+                return self._error(429, "ThrottlingException", "Too many requests, please wait before trying again.")
+            if roll < behavior.throttle_rate + behavior.error_rate:
+                return self._error(503, "ServiceUnavailableException", "Service unavailable.")
+
+            answer = build_answer(behavior.region, messages)
+            usage = {
+                "inputTokens": len(json.dumps(messages)) // 4,
+                "outputTokens": len(answer) // 4,
+            }
+            usage["totalTokens"] = usage["inputTokens"] + usage["outputTokens"]
+
+            if match.group("operation") == "converse":
+                self._send_json(200, {
+                    "output": {"message": {"role": "assistant", "content": [{"text": answer}]}},
+                    "stopReason": "end_turn",
+                    "usage": usage,
+                    "metrics": {"latencyMs": int(behavior.latency_ms)},
+                })
+            else:
+                self._send_stream(answer, usage)
+
+        def _send_stream(self, answer: str, usage: Dict) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.amazon.eventstream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            self._write_chunk(encode_event("messageStart", {"role": "assistant"}))
+            for word in re.findall(r"\S+\s*", answer):
+                self._write_chunk(encode_event("contentBlockDelta", {
+                    "contentBlockIndex": 0, "delta": {"text": word},
+                }))
+                time.sleep(behavior.delta_interval_ms / 1000)
+            self._write_chunk(encode_event("contentBlockStop", {"contentBlockIndex": 0}))
+            self._write_chunk(encode_event("messageStop", {"stopReason": "end_turn"}))
+            self._write_chunk(encode_event("metadata", {
+                "usage": usage, "metrics": {"latencyMs": int(behavior.latency_ms)},
+            }))
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, data: bytes) -> None:
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _error(self, status: int, code: str, message: str) -> None:
+            self._send_json(status, {"message": message}, {"x-amzn-ErrorType": code})
+
+        def _send_json(self, status: int, payload: Dict, headers: Dict = None) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ConverseHandler
+
+
+def serve(behaviors: List[RegionBehavior]) -> List[ThreadingHTTPServer]:
+    """在背景執行緒啟動每個 region 的假端點，回傳 server 供呼叫端關閉"""
+    servers = []
+    for behavior in behaviors:
+        server = ThreadingHTTPServer(("127.0.0.1", behavior.port), make_handler(behavior))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name=f"fake-bedrock-{behavior.region}", daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Bedrock Converse endpoints, one port per region")
+    parser.add_argument(
+        "--region",
+        action="append",
+        required=True,
+        help="region:port[:latency_ms=300,jitter_ms=100,throttle_rate=0,error_rate=0,delta_interval_ms=20]",
+    )
+    args = parser.parse_args()
+
+    behaviors = [RegionBehavior.parse(spec) for spec in args.region]
+    serve(behaviors)
+    for behavior in behaviors:
+        print(f"{behavior.region}: http://127.0.0.1:{behavior.port} {behavior}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# src/tools/session_index_loadtest.py
+"""
+會話列表 GSI 分片的寫入壓測（本地 stand-in，不需要 AWS）
+
+    python -m src.tools.session_index_loadtest --shards 1,2,4,8,16 --partition-wcu 200 --duration 3
+
+DynamoDB 每個 GSI partition 的寫入上限約 1000 WCU/s；GSI 被節流時基底表的寫入也會被節流。
+stand-in 以每個 GSI partition key 一個 token bucket 模擬這個上限（--partition-wcu，預設縮小以便本地觀察），
+寫入者以 ConversationService.save_message 寫入（與正式環境相同的 metadata 更新路徑），
+節流時與 SDK 一樣以 full-jitter 退避重試。結束後以 list_sessions 逐頁讀回，確認 scatter-gather 合併正確。
+"""
+import argparse
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from src.services.dynamodb_service import DEFAULT_USER_ID, SESSION_LIST_INDEX, ConversationService
+
+SET_CLAUSE = re.compile(r"(#\w+) = (?:if_not_exists\(#\w+, (:\w+)\)|(:\w+))")
+
+
+class TokenBucket:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_take(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class PartitionedTableStandIn:
+    """
+    只實作 ConversationService 寫入 / 列表用到的 Table API 的記憶體 stand-in
+
+    - put_item / update_item（SET 與 if_not_exists）
+    - 帶 session_list_pk 的更新會消耗該 GSI partition 的寫入額度，用完時拋出
+      ProvisionedThroughputExceededException
+    - query 只支援會話列表 GSI（降序、Limit、ExclusiveStartKey）
+    """
+
+    name = "session-index-loadtest"
+
+    def __init__(self, partition_wcu: float):
+        self.partition_wcu = partition_wcu
+        self._items: Dict[Tuple, Dict] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def put_item(self, Item: Dict, **kwargs) -> Dict:
+        with self._lock:
+            self._items[(Item["session_id"], Item["message_index"])] = dict(Item)
+        return {}
+
+    def update_item(self, Key: Dict, UpdateExpression: str, ExpressionAttributeNames: Dict,
+                    ExpressionAttributeValues: Dict, **kwargs) -> Dict:
+        key = (Key["session_id"], Key["message_index"])
+        updates = []
+        for match in SET_CLAUSE.finditer(UpdateExpression):
+            name_ref, default_ref, value_ref = match.groups()
+            updates.append((ExpressionAttributeNames[name_ref], ExpressionAttributeValues[default_ref or value_ref],
+                            default_ref is not None))
+
+        partition = next((value for name, value, _ in updates if name == "session_list_pk"), None)
+        if partition is not None and not self._bucket(partition).try_take():
+            raise ClientError(
+                {"Error": {"Code": "ProvisionedThroughputExceededException", "Message": partition}},
+                "UpdateItem",
+            )
+
+        with self._lock:
+            item = self._items.setdefault(key, dict(Key))
+            for name, value, if_not_exists in updates:
+                if not if_not_exists or name not in item:
+                    item[name] = value
+        return {}
+
+    def query(self, IndexName: str, ExpressionAttributeValues: Dict, Limit: int,
+              ExclusiveStartKey: Optional[Dict] = None, **kwargs) -> Dict:
+        assert IndexName == SESSION_LIST_INDEX
+        partition = ExpressionAttributeValues[":pk"]
+        with self._lock:
+            items = [dict(item) for item in self._items.values()
+                     if item.get("session_list_pk") == partition and "last_active_at" in item]
+        items.sort(key=lambda item: (item["last_active_at"], item["session_id"]), reverse=True)
+
+        if ExclusiveStartKey:
+            start = (ExclusiveStartKey["last_active_at"], ExclusiveStartKey["session_id"])
+            items = [item for item in items if (item["last_active_at"], item["session_id"]) < start]
+        page = items[:Limit]
+        response = {"Items": page}
+        if len(items) > Limit:
+            last = page[-1]
+            response["LastEvaluatedKey"] = {
+                name: last[name] for name in ("session_list_pk", "last_active_at", "session_id", "message_index")
+            }
+        return response
+
+    def _bucket(self, partition: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(partition)
+            if bucket is None:
+                bucket = self._buckets[partition] = TokenBucket(self.partition_wcu)
+            return bucket
+
+
+def run(shards: int, partition_wcu: float, workers: int, duration: float, messages_per_session: int) -> Dict:
+    table = PartitionedTableStandIn(partition_wcu)
+    service = ConversationService("session-index-loadtest", region="us-east-1", session_index_shards=shards)
+    service.table = table
+
+    stop_at = time.monotonic() + duration
+    lock = threading.Lock()
+    totals = {"writes": 0, "throttled": 0, "sessions": 0}
+
+    def worker() -> None:
+        writes = throttled = sessions = 0
+        while time.monotonic() < stop_at:
+            session_id = str(uuid.uuid4())
+            sessions += 1
+            for index in range(messages_per_session):
+                attempt = 0
+                while True:
+                    try:
+                        service.save_message(session_id, index, "user" if index % 2 else "assistant",
+                                             "load test", user_id=DEFAULT_USER_ID)
+                        writes += 1
+                        break
+                    except ClientError:
+                        throttled += 1
+                        attempt += 1
+                        time.sleep(random.uniform(0, min(0.2, 0.005 * 2 ** attempt)))
+                if time.monotonic() >= stop_at:
+                    break
+        with lock:
+            totals["writes"] += writes
+            totals["throttled"] += throttled
+            totals["sessions"] += sessions
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    # 逐頁讀回：每個會話恰好出現一次，且依 last_active_at 降序
+    listed: List[Dict] = []
+    cursor = None
+    while True:
+        page, cursor = service.list_sessions(limit=50, cursor=cursor)
+        listed.extend(page)
+        if not cursor:
+            break
+    ordered = all(a["last_active_at"] >= b["last_active_at"] for a, b in zip(listed, listed[1:]))
+
+    return {
+        "shards": shards,
+        "writes_per_second": totals["writes"] / elapsed,
+        "throttled": totals["throttled"],
+        "sessions": totals["sessions"],
+        "listed": len({s["session_id"] for s in listed}),
+        "ordered": ordered,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Session list GSI write-sharding load test against a local stand-in")
+    parser.add_argument("--shards", default="1,2,4,8,16", help="comma-separated shard counts to compare")
+    parser.add_argument("--partition-wcu", type=float, default=200.0, help="writes/s per GSI partition")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per shard count")
+    parser.add_argument("--messages-per-session", type=int, default=4)
+    args = parser.parse_args()
+
+    # 節流時 save_message 會記錄錯誤；壓測期間只看彙總結果
+    logging.getLogger("app").setLevel(logging.CRITICAL)
+
+    print(f"{'shards':>6} {'writes/s':>10} {'throttled':>10} {'sessions':>9} {'listed':>7} {'ordered':>8}")
+    for shards in (int(s) for s in args.shards.split(",")):
+        result = run(shards, args.partition_wcu, args.workers, args.duration, args.messages_per_session)
+        print(f"{result['shards']:>6} {result['writes_per_second']:>10.0f} {result['throttled']:>10} "
+              f"{result['sessions']:>9} {result['listed']:>7} {str(result['ordered']):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# src/tools/storage_benchmark.py
+"""
+對話儲存後端的逐操作延遲基準（同一組操作跑在每個後端上）
+
+    python -m src.tools.storage_benchmark --backends memory,sqlite
+    python -m src.tools.storage_benchmark --backends dynamodb --table ai-chatbot-conversations-dev \\
+        --save benchmark-baseline.json
+    python -m src.tools.storage_benchmark --backends dynamodb --table ai-chatbot-conversations-dev \\
+        --baseline benchmark-baseline.json --max-regression 0.25
+
+每個會話：save_messages（歡迎語 + 第一條用戶消息）、逐則 save_message、
+load_session / load_session_tail / load_messages_before / get_session_meta，
+最後逐頁 list_sessions 並 delete_session。DynamoDB 後端關閉讀取快取，量測的是實際的儲存路徑；
+DynamoDB Local 可以 AWS_ENDPOINT_URL_DYNAMODB 指定。
+--baseline 比較 p95，超過 --max-regression 的操作列出並以非零狀態結束。
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+from src.services.conversation_store import (
+    STORE_DYNAMODB,
+    STORE_MEMORY,
+    STORE_SQLITE,
+    ConversationStore,
+    InMemoryConversationStore,
+    SQLiteConversationStore,
+)
+from src.services.dynamodb_service import ConversationService
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def make_content(index: int, content_bytes: int, large_every: int) -> str:
+    # 每 large_every 則一則長回答（表格 / 程式碼），其餘為一般長度
+    size = content_bytes * 20 if large_every and index % large_every == large_every - 1 else content_bytes
+    line = f"line {index}: the quick brown fox jumps over the lazy dog. "
+    return (line * (size // len(line) + 1))[:size]
+
+
+def run(store: ConversationStore, sessions: int, messages: int, content_bytes: int, large_every: int,
+        page_size: int) -> Dict[str, List[float]]:
+    """對 store 執行整組操作，回傳 操作名稱 -> 每次呼叫的秒數"""
+    timings: Dict[str, List[float]] = defaultdict(list)
+    user_id = f"benchmark-{uuid.uuid4()}"
+
+    def timed(operation: str, call: Callable):
+        start = time.perf_counter()
+        result = call()
+        timings[operation].append(time.perf_counter() - start)
+        return result
+
+    session_ids = []
+    for _ in range(sessions):
+        session_id = store.create_session()
+        session_ids.append(session_id)
+        timed("save_messages", lambda: store.save_messages(
+            session_id,
+            [{"role": "assistant", "content": "Hello!"}, {"role": "user", "content": make_content(1, content_bytes, 0)}],
+            user_id=user_id,
+        ))
+        for index in range(2, messages):
+            role = "assistant" if index % 2 == 0 else "user"
+            content = make_content(index, content_bytes, large_every)
+            timed("save_message", lambda: store.save_message(session_id, index, role, content, user_id=user_id))
+
+        loaded = timed("load_session", lambda: store.load_session(session_id))
+        if len(loaded) != messages:
+            raise RuntimeError(f"{session_id}: loaded {len(loaded)} of {messages} messages")
+        _, first_index = timed("load_session_tail", lambda: store.load_session_tail(session_id, page_size))
+        timed("load_messages_before", lambda: store.load_messages_before(session_id, first_index, page_size))
+        timed("get_session_meta", lambda: store.get_session_meta(session_id))
+
+    # 寫入完成後才讀列表（write-behind 佇列先寫完；GSI 為最終一致，少列幾筆只警告）
+    write_queue = getattr(store, "write_queue", None)
+    if write_queue is not None:
+        write_queue.flush()
+    listed = set()
+    cursor = None
+    while True:
+        page, cursor = timed("list_sessions", lambda: store.list_sessions(limit=page_size, cursor=cursor, user_id=user_id))
+        listed.update(session["session_id"] for session in page)
+        if not cursor:
+            break
+    if listed != set(session_ids):
+        print(f"  warning: listed {len(listed)} of {len(session_ids)} sessions", file=sys.stderr)
+
+    for session_id in session_ids:
+        timed("delete_session", lambda: store.delete_session(session_id, user_id=user_id))
+    return timings
+
+
+def summarize(timings: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    return {
+        operation: {
+            "count": len(samples),
+            "p50_ms": percentile(samples, 0.50) * 1000,
+            "p95_ms": percentile(samples, 0.95) * 1000,
+            "p99_ms": percentile(samples, 0.99) * 1000,
+        }
+        for operation, samples in timings.items()
+    }
+
+
+def build_store(backend: str, args) -> ConversationStore:
+    if backend == STORE_MEMORY:
+        return InMemoryConversationStore()
+    if backend == STORE_SQLITE:
+        return SQLiteConversationStore(args.sqlite_path or os.path.join(tempfile.mkdtemp(), "benchmark.db"))
+    if backend == STORE_DYNAMODB:
+        if not args.table:
+            raise SystemExit("--table is required for the dynamodb backend")
+        return ConversationService(args.table, region=args.region, write_behind=args.write_behind)
+    raise SystemExit(f"unknown backend: {backend}")
+
+
+def find_regressions(results: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    regressions = []
+    for backend, operations in results.items():
+        for operation, stats in operations.items():
+            previous = baseline.get(backend, {}).get(operation)
+            if previous and stats["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+                regressions.append(
+                    f"{backend}.{operation}: p95 {stats['p95_ms']:.2f} ms > baseline {previous['p95_ms']:.2f} ms"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-operation latency of the conversation storage backends")
+    parser.add_argument("--backends", default="memory,sqlite", help="comma-separated: memory,sqlite,dynamodb")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=40, help="messages per session")
+    parser.add_argument("--content-bytes", type=int, default=600)
+    parser.add_argument("--large-every", type=int, default=10, help="every Nth message is 20x larger; 0 disables")
+    parser.add_argument("--page-size", type=int, default=10, help="history window / session list page size")
+    parser.add_argument("--sqlite-path", default="", help="defaults to a temporary file")
+    parser.add_argument("--table", default=os.getenv("DYNAMODB_TABLE_NAME", ""))
+    parser.add_argument("--region", default="ap-northeast-1")
+    parser.add_argument("--write-behind", action="store_true", help="dynamodb: queue writes like the app does")
+    parser.add_argument("--save", help="write results as JSON (use as a later --baseline)")
+    parser.add_argument("--baseline", help="JSON from an earlier --save to compare p95 against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed p95 increase vs baseline")
+    args = parser.parse_args()
+
+    logging.getLogger("app").setLevel(logging.WARNING)
+
+    results = {}
+    for backend in (b.strip() for b in args.backends.split(",") if b.strip()):
+        store = build_store(backend, args)
+        try:
+            results[backend] = summarize(
+                run(store, args.sessions, args.messages, args.content_bytes, args.large_every, args.page_size)
+            )
+        finally:
+            store.close()
+
+        print(f"\n{backend}")
+        print(f"{'operation':<22} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for operation, stats in results[backend].items():
+            print(f"{operation:<22} {stats['count']:>6} {stats['p50_ms']:>9.3f} "
+                  f"{stats['p95_ms']:>9.3f} {stats['p99_ms']:>9.3f}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.max_regression)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo p95 regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
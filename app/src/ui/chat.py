@@ -1,61 +1,93 @@
 # src/ui/chat.py
 import streamlit as st
 from dataclasses import dataclass
+from itertools import chain
 from typing import Optional
+from src.services.dynamodb_service import DEFAULT_USER_ID
+from src.services.history import ConverseHistory
 
 @dataclass
 class ChatMessage:
     role: str
     content: str
 
-def init_session(conv_service, session_id: Optional[str] = None) -> str:
+GREETING = "Hello! I'm an AI Chat Robot. You can configure avatars in the sidebar."
+
+def current_user_id(header_name: str) -> str:
+    """
+    取得目前使用者 ID（由驗證代理設定的 header），沒有時為 DEFAULT_USER_ID
+
+    :param header_name: header 名稱，空字串表示不區分使用者
+    """
+    if not header_name:
+        return DEFAULT_USER_ID
+    return st.context.headers.get(header_name) or DEFAULT_USER_ID
+
+def init_session(conv_service, session_id: Optional[str] = None, tail_messages: int = 0) -> str:
     """
     初始化會話
-    - 如果提供 session_id，從 DynamoDB 加載歷史消息
-    - 否則創建新會話
+    - 如果提供 session_id，從 DynamoDB 加載歷史消息（tail_messages > 0 時只加載最近幾條）
+    - 否則創建新會話（只存在於記憶體，第一條用戶消息送出時才寫入 DynamoDB）
 
-    :param conv_service: ConversationService 實例
+    :param conv_service: 對話儲存（ConversationStore）
     :param session_id: 可選的會話 ID（用於加載歷史會話）
+    :param tail_messages: 只加載最近的消息數，0 表示全部加載
     :return: 當前會話 ID
     """
     if "session_id" not in st.session_state:
+        messages, start_index = [], 0
         if session_id:
-            # 加載歷史會話
-            st.session_state["session_id"] = session_id
-            messages = conv_service.load_session(session_id)
-            if messages:
-                st.session_state["messages"] = messages
+            if tail_messages > 0:
+                messages, start_index = conv_service.load_session_tail(session_id, tail_messages)
             else:
-                # 加載失敗，創建新會話
-                st.session_state["session_id"] = conv_service.create_session()
-                st.session_state["messages"] = [
-                    {"role": "assistant", "content": "Hello! I'm an AI Chat Robot. You can configure avatars in the sidebar."}
-                ]
-                # 保存初始消息到 DynamoDB
-                conv_service.save_message(
-                    session_id=st.session_state["session_id"],
-                    message_index=0,
-                    role="assistant",
-                    content="Hello! I'm an AI Chat Robot. You can configure avatars in the sidebar."
-                )
+                messages = conv_service.load_session(session_id)
+        if messages:
+            # 加載歷史會話；history_start 為 messages[0] 的 message_index
+            st.session_state["session_id"] = session_id
+            st.session_state["messages"] = messages
+            st.session_state["history_start"] = start_index
+            st.session_state["session_persisted"] = True
         else:
-            # 創建新會話
+            # 創建新會話（或加載失敗）：歡迎語只顯示不寫入，
+            # 只開啟頁面、沒有輸入的訪客不會產生任何寫入
             st.session_state["session_id"] = conv_service.create_session()
-            st.session_state["messages"] = [
-                {"role": "assistant", "content": "Hello! I'm an AI Chat Robot. You can configure avatars in the sidebar."}
-            ]
-            # 保存初始消息到 DynamoDB
-            conv_service.save_message(
-                session_id=st.session_state["session_id"],
-                message_index=0,
-                role="assistant",
-                content="Hello! I'm an AI Chat Robot. You can configure avatars in the sidebar."
-            )
+            st.session_state["messages"] = [{"role": "assistant", "content": GREETING}]
+            st.session_state["history_start"] = 0
+            st.session_state["session_persisted"] = False
 
     return st.session_state["session_id"]
 
-def render_history(user_avatar: str, bot_avatar: str) -> None:
-    """渲染對話歷史"""
+def get_converse_history() -> ConverseHistory:
+    """
+    取得當前會話的 Converse 格式歷史（存放於 session_state，每輪只轉換新增訊息）
+    """
+    if "converse_history" not in st.session_state:
+        st.session_state["converse_history"] = ConverseHistory()
+    history = st.session_state["converse_history"]
+    return history.sync(
+        st.session_state.get("messages", []),
+        st.session_state.get("history_start", 0),
+    )
+
+def render_history(user_avatar: str, bot_avatar: str, conv_service=None, page_size: int = 50) -> None:
+    """
+    渲染對話歷史
+
+    只載入了最近一段訊息時，頂端顯示「Load earlier messages」按鈕，
+    每按一次往前載入 page_size 條（Streamlit 無法偵測捲動位置，以按鈕代替）
+    """
+    start = st.session_state.get("history_start", 0)
+    if conv_service is not None and start > 0 and st.button("⬆️ Load earlier messages"):
+        earlier, first_index = conv_service.load_messages_before(
+            st.session_state["session_id"], start, page_size
+        )
+        if earlier:
+            st.session_state["messages"] = earlier + st.session_state.messages
+            st.session_state["history_start"] = first_index
+        else:
+            st.session_state["history_start"] = 0
+        st.rerun()
+
     for msg in st.session_state.messages:
         avatar = user_avatar if msg["role"] == "user" else bot_avatar
         st.chat_message(msg["role"], avatar=avatar).write(msg["content"])
@@ -64,8 +96,9 @@ def handle_input(
     *,
     user_avatar: str,
     bot_avatar: str,
-    on_user_prompt,   # callable(prompt)->str
+    on_user_prompt,   # callable(prompt)->str | Iterator[str] (串流)
     conv_service,     # 新增：DynamoDB 服務
+    user_id: str = DEFAULT_USER_ID,
 ) -> None:
     """處理用戶輸入並保存到 DynamoDB"""
     prompt = st.chat_input("Ask me anything about DevOps...")
@@ -73,7 +106,7 @@ def handle_input(
         return
 
     session_id = st.session_state["session_id"]
-    message_index = len(st.session_state.messages)
+    message_index = st.session_state.get("history_start", 0) + len(st.session_state.messages)
 
     # 保存用戶消息到 session state
     st.session_state.messages.append({"role": "user", "content": prompt})
@@ -82,18 +115,38 @@ def handle_input(
     # 持久化用戶消息到 DynamoDB
     # 如果是第一條用戶消息 (message_index == 1)，設置會話標題
     session_title = prompt[:50] if message_index == 1 else None
-    conv_service.save_message(
-        session_id=session_id,
-        message_index=message_index,
-        role="user",
-        content=prompt,
-        session_title=session_title
-    )
+    if st.session_state.get("session_persisted", True):
+        conv_service.save_message(
+            session_id=session_id,
+            message_index=message_index,
+            role="user",
+            content=prompt,
+            session_title=session_title,
+            user_id=user_id,
+        )
+    else:
+        # 會話第一次寫入：歡迎語與第一條用戶消息一起寫
+        conv_service.save_messages(
+            session_id=session_id,
+            messages=st.session_state.messages,
+            session_title=session_title,
+            user_id=user_id,
+        )
+        st.session_state["session_persisted"] = True
 
     with st.chat_message("assistant", avatar=bot_avatar):
         with st.spinner("Thinking..."):
-            response_text = on_user_prompt(prompt)
+            response = on_user_prompt(prompt)
+            if not isinstance(response, str):
+                # 串流模式：generator 在第一次取值時才開始呼叫模型，先在 spinner 內等到首個片段
+                first_chunk = next(response, None)
+        if isinstance(response, str):
+            response_text = response
             st.write(response_text)
+        else:
+            # 邊收邊渲染，write_stream 回傳完整文字供持久化
+            chunks = [] if first_chunk is None else [first_chunk]
+            response_text = st.write_stream(chain(chunks, response))
 
     # 保存助手回應到 session state
     st.session_state.messages.append({"role": "assistant", "content": response_text})
@@ -103,5 +156,6 @@ def handle_input(
         session_id=session_id,
         message_index=message_index + 1,
         role="assistant",
-        content=response_text
+        content=response_text,
+        user_id=user_id,
     )
@@ -2,20 +2,22 @@
 import streamlit as st
 from dataclasses import dataclass
 from src.config import AppConfig
+from src.services.dynamodb_service import DEFAULT_USER_ID
 
 @dataclass(frozen=True)
 class AvatarSelection:
     user_avatar: str
     bot_avatar: str
 
-def render_sidebar(cfg: AppConfig, conv_service) -> AvatarSelection:
+def render_sidebar(cfg: AppConfig, conv_service, user_id: str = DEFAULT_USER_ID) -> AvatarSelection:
     """
     渲染側邊欄，包含：
     1. Avatar 選擇
     2. 歷史會話列表
 
     :param cfg: AppConfig 實例
-    :param conv_service: ConversationService 實例
+    :param conv_service: 對話儲存（ConversationStore）
+    :param user_id: 目前使用者（只列出其會話）
     :return: AvatarSelection
     """
     avatar_display_map = {
@@ -62,9 +64,12 @@ def render_sidebar(cfg: AppConfig, conv_service) -> AvatarSelection:
 
         st.markdown("---")
 
-        # 獲取會話列表
+        # 獲取會話列表（每頁一次查詢；游標堆疊記錄已翻過的頁，可往回翻）
+        cursors = st.session_state.setdefault("session_list_cursors", [None])
         try:
-            sessions = conv_service.list_sessions(limit=cfg.session_list_limit)
+            sessions, next_cursor = conv_service.list_sessions(
+                limit=cfg.session_list_limit, cursor=cursors[-1], user_id=user_id
+            )
 
             if sessions:
                 for session in sessions:
@@ -73,12 +78,12 @@ def render_sidebar(cfg: AppConfig, conv_service) -> AvatarSelection:
                     if len(title) > 30:
                         title = title[:30] + "..."
 
-                    # 格式化時間
-                    created_at = session["created_at"][:19]  # 去掉毫秒
+                    # 格式化時間（最近活動時間）
+                    last_active_at = session["last_active_at"][:19]  # 去掉毫秒
 
                     # 創建會話按鈕
                     if st.button(
-                        f"{title}\n🕐 {created_at}",
+                        f"{title}\n🕐 {last_active_at}",
                         key=session["session_id"],
                         use_container_width=True
                     ):
@@ -88,6 +93,14 @@ def render_sidebar(cfg: AppConfig, conv_service) -> AvatarSelection:
                         st.rerun()
             else:
                 st.info("No recent sessions")
+
+            newer_col, older_col = st.columns(2)
+            if len(cursors) > 1 and newer_col.button("‹ Newer", use_container_width=True):
+                cursors.pop()
+                st.rerun()
+            if next_cursor and older_col.button("Older ›", use_container_width=True):
+                cursors.append(next_cursor)
+                st.rerun()
         except Exception as e:
             st.warning(f"Could not load sessions: {str(e)}")
 
@@ -0,0 +1,45 @@
+# tests/conftest.py
+import os
+import sys
+
+import boto3
+import pytest
+from botocore.config import Config
+
+# 與 app.py 相同，以 app/ 為根目錄匯入 src.*
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.tools.fake_bedrock import RegionBehavior, serve  # noqa: E402
+
+# 不對外匯出 log（get_logger 的 OTLP exporter 指向叢集內的 collector）
+os.environ.setdefault("OTEL_SDK_DISABLED", "true")
+# botocore 簽章需要憑證；請求只會送到本地的假端點
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+
+
+@pytest.fixture
+def fake_bedrock():
+    """
+    回傳啟動假 Bedrock 端點的函式：start(region, **behavior) -> 指向該端點的 bedrock-runtime client
+
+    測試可傳入 RegionBehavior 的欄位調整延遲 / 節流率，例如 fake_bedrock(latency_ms=300)
+    """
+    servers = []
+
+    def start(region: str = "ap-northeast-1", **behavior):
+        options = {"latency_ms": 10.0, "jitter_ms": 0.0, "delta_interval_ms": 1.0, **behavior}
+        server, = serve([RegionBehavior(region=region, port=0, **options)])
+        servers.append(server)
+        return boto3.client(
+            "bedrock-runtime",
+            region_name=region,
+            endpoint_url=f"http://127.0.0.1:{server.server_address[1]}",
+            # 不重試：節流 / 5xx 直接交給 region 容錯與斷路器處理
+            config=Config(retries={"max_attempts": 1, "mode": "standard"}),
+        )
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from src.services.admission import AdmissionController, AdmissionRejected
+
+
+def make_controller(**options) -> AdmissionController:
+    options = {"rpm": 60_000, "tpm": 10_000_000, "max_concurrency": 1, "max_wait_seconds": 30.0, **options}
+    return AdmissionController(**options)
+
+
+def wait_for_queued(controller: AdmissionController, count: int) -> None:
+    deadline = time.monotonic() + 2
+    while controller._queued < count:
+        assert time.monotonic() < deadline, "waiters were not queued"
+        time.sleep(0.005)
+
+
+def test_waiters_are_granted_round_robin_across_sessions():
+    controller = make_controller()
+    granted = []
+    lock = threading.Lock()
+
+    def call(session_id: str, name: str):
+        with controller.admit(session_id, 100):
+            with lock:
+                granted.append(name)
+
+    threads = []
+    with controller.admit("holder", 100):
+        # 依序排入：A 的兩個請求先到，B 最後到
+        for count, (session_id, name) in enumerate([("a", "a1"), ("a", "a2"), ("b", "b1")], start=1):
+            thread = threading.Thread(target=call, args=(session_id, name))
+            thread.start()
+            threads.append(thread)
+            wait_for_queued(controller, count)
+    for thread in threads:
+        thread.join(2)
+
+    assert granted == ["a1", "b1", "a2"]
+
+
+def test_rejects_when_the_estimated_wait_exceeds_the_limit():
+    controller = make_controller(max_wait_seconds=0.5)
+    controller._service_time = 10.0
+    with controller.admit("holder", 100):
+        with pytest.raises(AdmissionRejected) as error:
+            with controller.admit("other", 100):
+                pass
+    assert error.value.reason == "queue_full"
+    assert error.value.user_message
+
+
+def test_try_admit_does_not_wait_for_a_slot():
+    controller = make_controller()
+    with controller.admit("holder", 100):
+        # 同時呼叫數已滿時立即放棄，不排隊
+        assert controller.try_admit(100) is None
+    release = controller.try_admit(100)
+    assert release is not None
+    assert controller.try_admit(100) is None
+    release()
+    assert controller._active == 0
+
+
+def test_try_admit_respects_the_token_budget():
+    controller = make_controller(max_concurrency=10, tpm=600)
+    # bucket 容量為 10 秒的 TPM（100 tokens）
+    release = controller.try_admit(100)
+    assert release is not None
+    assert controller.try_admit(100) is None
+    release()
+
+
+def test_released_slot_wakes_waiters_when_the_bucket_is_briefly_empty():
+    controller = make_controller(rpm=600)
+    admitted = threading.Event()
+
+    def call():
+        with controller.admit("waiter", 100):
+            admitted.set()
+
+    with controller.admit("holder", 100):
+        thread = threading.Thread(target=call)
+        thread.start()
+        wait_for_queued(controller, 1)
+        with controller._cond:
+            # 釋放時 RPM bucket 剛好用完，_dispatch 不會放行任何人
+            controller._requests.tokens = 0
+    started = time.monotonic()
+
+    # 10 RPS 的 bucket 約 0.1 秒補足一個請求，不應等到 max_wait_seconds
+    assert admitted.wait(2)
+    assert time.monotonic() - started < 2
+    thread.join(2)
@@ -0,0 +1,46 @@
+import logging
+
+from src.services.bedrock import call_bedrock, call_bedrock_stream
+from src.services.region_pool import RegionalClientPool
+
+logger = logging.getLogger("tests")
+MODEL_ID = "amazon.nova-lite-v1:0"
+
+
+def call_options(client, **options):
+    return {
+        "client": client, "model_id": MODEL_ID, "max_tokens": 100, "temperature": 0.0, "logger": logger, **options,
+    }
+
+
+def test_converse_against_the_fake_endpoint(fake_bedrock):
+    client = fake_bedrock()
+    usage = []
+    answer = call_bedrock("What is a Pod?", on_usage=usage.append, **call_options(client))
+    assert answer.startswith("[fake ap-northeast-1] You asked: What is a Pod?")
+    assert usage and usage[0]["outputTokens"] > 0
+
+
+def test_converse_stream_against_the_fake_endpoint(fake_bedrock):
+    client = fake_bedrock()
+    usage = []
+    chunks = list(call_bedrock_stream("What is a Pod?", on_usage=usage.append, idle_timeout=5, **call_options(client)))
+    assert len(chunks) > 1
+    assert "".join(chunks).startswith("[fake ap-northeast-1] You asked: What is a Pod?")
+    assert usage and usage[0]["inputTokens"] > 0
+
+
+def test_throttled_region_fails_over(fake_bedrock):
+    regions = RegionalClientPool(
+        {
+            "ap-northeast-1": fake_bedrock("ap-northeast-1", throttle_rate=1.0),
+            "us-east-1": fake_bedrock("us-east-1"),
+        },
+        explore_ratio=0.0,
+    )
+    answer = call_bedrock("What is a Pod?", regions=regions, **call_options(None))
+    assert answer.startswith("[fake us-east-1]")
+    assert regions.ordered_regions()[0] == "us-east-1"
+
+    chunks = call_bedrock_stream("What is a Pod?", regions=regions, **call_options(None))
+    assert "".join(chunks).startswith("[fake us-east-1]")
@@ -0,0 +1,46 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from src.config import AppConfig
+from src.services.chat_gateway import ChatGateway, ChatRequest
+from src.services.single_flight import SingleFlight
+
+logger = logging.getLogger("tests")
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_coalesced_turns_record_usage_for_every_session(fake_bedrock, streaming):
+    client = fake_bedrock(latency_ms=300)
+    recorded = []
+    gateway = ChatGateway(
+        cfg=AppConfig(),
+        client=client,
+        logger=logger,
+        single_flight=SingleFlight("test"),
+        usage_sink=lambda session_id, input_tokens, output_tokens: recorded.append(session_id),
+    )
+    messages = [{"role": "user", "content": [{"text": "Why is my Pod pending?"}]}]
+    answers = {}
+
+    def turn(session_id: str):
+        request = ChatRequest(prompt="Why is my Pod pending?", messages=messages, session_id=session_id)
+        if streaming:
+            answers[session_id] = "".join(gateway.stream(request))
+        else:
+            answers[session_id] = gateway.complete(request)
+
+    threads = [threading.Thread(target=turn, args=(f"session-{i}",)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert len(set(answers.values())) == 1
+    # 用量在背景寫入
+    deadline = time.monotonic() + 5
+    while len(recorded) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(recorded) == ["session-0", "session-1", "session-2"]
@@ -0,0 +1,143 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from src.services import circuit_breaker
+from src.services.bedrock import _breaker_guard
+from src.services.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitBreakerRegistry,
+    CircuitOpenError,
+)
+from src.services.deadline import SEND_STAGE, DeadlineExceeded
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    return clock
+
+
+def make_breaker() -> CircuitBreaker:
+    return CircuitBreaker("model@region", failure_threshold=3, open_seconds=30)
+
+
+def trip(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.allow()
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = make_breaker()
+    breaker.record_failure()
+    breaker.record_failure()
+    # 成功會重置連續失敗次數
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.allow()
+    assert error.value.retry_after == pytest.approx(30)
+    assert error.value.user_message
+
+
+def test_half_open_allows_one_probe_and_closes_on_success(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 30
+
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.allow()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 30
+
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    clock.now += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_registry_keeps_one_breaker_per_model_and_region():
+    registry = CircuitBreakerRegistry(failure_threshold=3, open_seconds=30)
+    assert registry.get("m", "ap-northeast-1") is registry.get("m", "ap-northeast-1")
+    assert registry.get("m", "ap-northeast-1") is not registry.get("m", "us-east-1")
+
+
+def test_neutral_outcome_returns_the_half_open_probe(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 30
+
+    breaker.allow()
+    breaker.record_neutral()
+    assert breaker.state == HALF_OPEN
+    # 試探名額歸還，下一個請求仍可試探
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+class FakeClient:
+    class meta:
+        region_name = "ap-northeast-1"
+
+
+def run_guarded(registry: CircuitBreakerRegistry, error: Exception) -> None:
+    with pytest.raises(type(error)):
+        with _breaker_guard(registry, "m", FakeClient):
+            raise error
+
+
+def test_guard_ignores_deadlines_hit_before_the_request_is_sent(clock):
+    registry = CircuitBreakerRegistry(failure_threshold=2, open_seconds=30)
+    for _ in range(5):
+        run_guarded(registry, DeadlineExceeded(SEND_STAGE))
+    assert registry.get("m", "ap-northeast-1").state == CLOSED
+
+
+def test_guard_counts_in_flight_deadlines_and_throttling(clock):
+    registry = CircuitBreakerRegistry(failure_threshold=2, open_seconds=30)
+    run_guarded(registry, DeadlineExceeded("bedrock.converse"))
+    throttled = ClientError(
+        {"Error": {"Code": "ThrottlingException"}, "ResponseMetadata": {"HTTPStatusCode": 429}}, "Converse"
+    )
+    run_guarded(registry, throttled)
+    assert registry.get("m", "ap-northeast-1").state == OPEN
+
+
+def test_guard_treats_request_errors_as_a_healthy_response(clock):
+    registry = CircuitBreakerRegistry(failure_threshold=2, open_seconds=30)
+    invalid = ClientError(
+        {"Error": {"Code": "ValidationException"}, "ResponseMetadata": {"HTTPStatusCode": 400}}, "Converse"
+    )
+    for _ in range(3):
+        run_guarded(registry, invalid)
+    assert registry.get("m", "ap-northeast-1").state == CLOSED
@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+
+from src.services import context_window
+from src.services.context_window import ContextWindowManager
+from src.services.history import ConverseHistory
+
+# 40 個 ASCII 字元約 10 tokens
+TEXT = "x" * 40
+
+
+class FakeStore:
+    def __init__(self, meta=None):
+        self.meta = meta or {}
+        self.reads = 0
+
+    def get_session_meta(self, session_id):
+        self.reads += 1
+        return dict(self.meta.get(session_id, {}))
+
+    def update_session_meta(self, session_id, **fields):
+        self.meta.setdefault(session_id, {}).update(fields)
+
+
+def chat(count: int, start: int = 0):
+    """user / assistant 交替、以 user 結尾的聊天訊息，內容帶上 message_index"""
+    roles = ("user", "assistant")
+    return [{"role": roles[i % 2], "content": f"{i} {TEXT}"} for i in range(start, start + count)]
+
+
+def first_index(message) -> int:
+    return int(message["content"][-1]["text"].split()[0])
+
+
+def wait_for_summaries():
+    deadline = time.monotonic() + 2
+    while context_window._pending:
+        assert time.monotonic() < deadline, "summary did not finish"
+        time.sleep(0.005)
+
+
+@pytest.fixture(autouse=True)
+def drain_summaries():
+    yield
+    wait_for_summaries()
+
+
+def make_manager(store, summarize=None, budget=60):
+    calls = []
+
+    def default_summarize(previous, messages):
+        calls.append((previous, [first_index(m) for m in messages]))
+        return "S"
+
+    manager = ContextWindowManager(
+        budget_tokens=budget, keep_turns=2, summarize=summarize or default_summarize, conv_service=store
+    )
+    return manager, calls
+
+
+def test_within_budget_passes_through():
+    store = FakeStore()
+    manager, calls = make_manager(store, budget=1000)
+    history = ConverseHistory().sync(chat(5))
+    messages, stats = manager.build("s1", history)
+    assert messages is history.messages
+    assert stats.tokens_saved == 0
+    assert store.reads == 0 and calls == []
+
+
+def test_over_budget_keeps_recent_turns_and_summarizes_the_rest():
+    store = FakeStore()
+    manager, calls = make_manager(store)
+    history = ConverseHistory().sync(chat(11))
+
+    messages, stats = manager.build("s1", history)
+    # 保留最近 keep_turns 輪與本輪問題；摘要尚未產生前先丟棄較早的訊息
+    assert [first_index(m) for m in messages] == [6, 7, 8, 9, 10]
+    assert stats.dropped_messages == 6 and stats.sent_tokens <= 60
+
+    wait_for_summaries()
+    assert calls == [(None, [0, 1, 2, 3, 4, 5])]
+    assert store.meta["s1"] == {"summary": "S", "summary_upto_index": 6}
+    assert history.summary == "S" and history.summary_upto == 6
+
+    messages, stats = manager.build("s1", history)
+    assert messages[0]["content"][0]["text"].startswith("<conversation_summary>")
+    assert first_index(messages[0]) == 6
+    assert stats.summarized_messages == 6 and stats.dropped_messages == 0
+
+
+def test_tail_loaded_session_maps_the_persisted_cutoff():
+    store = FakeStore({"s1": {"summary": "S", "summary_upto_index": 6}})
+    manager, calls = make_manager(store, budget=1000)
+    # 只載入 message_index 4 之後的訊息，尾段在預算內仍帶上摘要
+    history = ConverseHistory(start_index=4).sync(chat(7, start=4), start_index=4)
+
+    messages, stats = manager.build("s1", history)
+    assert history.summary_upto == history.position_of(6) == 2
+    assert first_index(messages[0]) == 6
+    assert "S" in messages[0]["content"][0]["text"]
+    assert stats.summarized_messages == 2
+    assert calls == []
+
+
+def test_legacy_position_cutoff_is_still_read():
+    store = FakeStore({"s1": {"summary": "S", "summary_upto": 4}})
+    manager, _ = make_manager(store)
+    history = ConverseHistory().sync(chat(11))
+    manager.build("s1", history)
+    wait_for_summaries()
+    assert store.meta["s1"]["summary_upto_index"] == 6
+
+
+def test_summary_finished_after_a_rebuild_only_updates_the_metadata():
+    store = FakeStore()
+    started = threading.Event()
+    release = threading.Event()
+
+    def summarize(previous, messages):
+        started.set()
+        release.wait(2)
+        return "S"
+
+    manager, _ = make_manager(store, summarize=summarize)
+    history = ConverseHistory(start_index=2).sync(chat(11, start=2), start_index=2)
+    manager.build("s1", history)
+    assert started.wait(2)
+
+    # 摘要進行中載入了較早的訊息，history 就地重建
+    history.sync(chat(13), start_index=0)
+    release.set()
+    wait_for_summaries()
+
+    assert store.meta["s1"] == {"summary": "S", "summary_upto_index": 8}
+    assert history.summary is None and not history.summary_loaded
+
+    # 下一次需要摘要時從 metadata 讀回，截止點對應到重建後的位置
+    manager.build("s1", history)
+    assert history.summary == "S"
+    assert history.summary_upto == history.position_of(8) == 8
@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+from src.services.conversation_store import InMemoryConversationStore, SQLiteConversationStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        store = InMemoryConversationStore()
+    else:
+        store = SQLiteConversationStore(str(tmp_path / "conversations.db"))
+    yield store
+    store.close()
+
+
+def chat(count: int, start: int = 0):
+    roles = ("assistant", "user")
+    return [{"role": roles[i % 2], "content": f"message {i}"} for i in range(start, start + count)]
+
+
+def test_messages_round_trip_and_windows(store):
+    session_id = store.create_session()
+    store.save_messages(session_id, chat(6))
+    store.save_message(session_id, 6, "assistant", "message 6")
+    assert store.load_session(session_id) == chat(7)
+
+    assert store.load_session_tail(session_id, 3) == (chat(3, start=4), 4)
+    assert store.load_messages_before(session_id, 4, 3) == (chat(3, start=1), 1)
+    assert store.load_messages_before(session_id, 0, 3) == ([], 0)
+    assert store.load_session("missing") == []
+
+    # 同一序號重複寫入時覆寫
+    store.save_message(session_id, 6, "assistant", "edited")
+    assert store.load_session(session_id)[-1] == {"role": "assistant", "content": "edited"}
+
+
+def test_metadata_title_and_usage(store):
+    session_id = store.create_session()
+    store.save_messages(session_id, [
+        {"role": "assistant", "content": "welcome"},
+        {"role": "user", "content": "How do I roll back a Deployment?"},
+    ])
+    store.save_message(session_id, 2, "assistant", "Use kubectl rollout undo.")
+    store.add_session_usage(session_id, 100, 20)
+    store.add_session_usage(session_id, 50, 10)
+    store.update_session_meta(session_id, summary="S", summary_upto_index=2)
+    store.update_session_meta(session_id, summary="S2")
+
+    meta = store.get_session_meta(session_id)
+    assert meta["session_title"] == "How do I roll back a Deployment?"
+    assert meta["message_count"] == 3
+    assert (meta["input_tokens"], meta["output_tokens"], meta["model_calls"]) == (150, 30, 2)
+    # 只覆寫傳入的欄位
+    assert (meta["summary"], meta["summary_upto_index"]) == ("S2", 2)
+    assert store.get_session_meta("missing") == {}
+
+
+def test_list_sessions_pages_by_recent_activity(store):
+    session_ids = []
+    for _ in range(5):
+        session_id = store.create_session()
+        store.save_messages(session_id, chat(2))
+        session_ids.append(session_id)
+        time.sleep(0.002)
+    store.save_messages(session_ids[0], chat(1, start=2), start_index=2)
+
+    listed = []
+    cursor = None
+    while True:
+        sessions, cursor = store.list_sessions(limit=2, cursor=cursor)
+        listed += [session["session_id"] for session in sessions]
+        if cursor is None:
+            break
+    # 最近有活動的會話排在最前
+    assert listed == [session_ids[0]] + session_ids[:0:-1]
+    assert store.list_sessions(user_id="someone-else") == ([], None)
+
+
+def test_delete_session(store):
+    session_id = store.create_session()
+    store.save_messages(session_id, chat(2))
+    store.delete_session(session_id)
+    assert store.load_session(session_id) == []
+    assert store.get_session_meta(session_id) == {}
+    assert store.list_sessions() == ([], None)
+
+
+def test_sqlite_store_persists_across_instances(tmp_path):
+    path = str(tmp_path / "conversations.db")
+    store = SQLiteConversationStore(path)
+    store.save_messages("s1", chat(3))
+    store.update_session_meta("s1", summary="S")
+    store.close()
+
+    reopened = SQLiteConversationStore(path)
+    assert reopened.load_session("s1") == chat(3)
+    assert reopened.get_session_meta("s1")["summary"] == "S"
+    reopened.close()
@@ -0,0 +1,64 @@
+import logging
+import threading
+
+import pytest
+
+from src.services.bedrock import call_bedrock_stream
+from src.services.deadline import DeadlineExceeded, TimedIterator, deadline_scope, remaining
+
+logger = logging.getLogger("tests")
+MODEL_ID = "amazon.nova-lite-v1:0"
+
+
+def call_options(client, **options):
+    return {
+        "client": client, "model_id": MODEL_ID, "max_tokens": 100, "temperature": 0.0, "logger": logger, **options,
+    }
+
+
+def test_nested_scope_keeps_the_earlier_deadline():
+    assert remaining() is None
+    with deadline_scope(10):
+        with deadline_scope(60):
+            assert remaining() <= 10
+        with deadline_scope(0):
+            assert remaining() <= 10
+    assert remaining() is None
+
+
+def test_stream_idle_timeout_closes_a_stalled_stream(fake_bedrock):
+    client = fake_bedrock(delta_interval_ms=500)
+    with pytest.raises(DeadlineExceeded) as error:
+        list(call_bedrock_stream("stall", raise_errors=True, idle_timeout=0.1, **call_options(client)))
+    assert error.value.stage == "bedrock.stream_idle"
+
+
+def test_timed_iterator_times_out_between_items():
+    release = threading.Event()
+
+    def items():
+        yield 1
+        release.wait(2)
+        yield 2
+
+    events = TimedIterator(items())
+    assert events.next(1, "test") == 1
+    with pytest.raises(DeadlineExceeded):
+        events.next(0.05, "test")
+    release.set()
+    assert events.next(1, "test") == 2
+    assert events.next(1, "test") is None
+    assert events.next(1, "test") is None
+
+
+def test_timed_iterator_reraises_reader_errors():
+    def items():
+        yield 1
+        raise ValueError("connection reset")
+
+    events = TimedIterator(items())
+    assert events.next(1, "test") == 1
+    with pytest.raises(ValueError):
+        events.next(1, "test")
+
+
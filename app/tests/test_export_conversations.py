@@ -0,0 +1,91 @@
+from src.services.message_codec import SEGMENT_SUFFIX, encode_segment
+from src.tools.export_conversations import (
+    CapacityLimiter,
+    PartitionedWriter,
+    build_filter,
+    load_watermark,
+    save_watermark,
+    to_rows,
+)
+
+T1 = "2026-10-01T10:00:00.000000+08:00"
+T2 = "2026-10-01T11:00:00.000000+08:00"
+T3 = "2026-10-01T12:00:00.000000+08:00"
+T4 = "2026-10-01T13:00:00.000000+08:00"
+
+
+def segment_item(session_id: str, start: int, messages):
+    encoded = encode_segment(messages, max_inline_bytes=350_000)
+    return {
+        "session_id": f"{session_id}{SEGMENT_SUFFIX}",
+        "message_index": start,
+        "segment_end": start + len(messages),
+        "timestamp": messages[-1]["timestamp"],
+        **encoded.attributes,
+    }
+
+
+def export(items, since, until):
+    stats = {"rows": 0, "skipped": 0}
+    return list(to_rows(iter(items), None, CapacityLimiter(1000), since, until, stats)), stats
+
+
+def test_segment_compacted_during_a_run_is_split_at_the_watermarks():
+    # 匯出期間壓縮：區段的 timestamp (T4) 晚於本次的 until (T3)，原訊息 item 已刪除
+    segment = segment_item("s1", 0, [
+        {"role": "user", "content": "exported last run", "timestamp": T1},
+        {"role": "assistant", "content": "this run", "timestamp": T2},
+        {"role": "user", "content": "next run", "timestamp": T4},
+    ])
+
+    rows, _ = export([segment], since=T1, until=T3)
+    assert [(row["message_index"], row["content"]) for row in rows] == [(1, "this run")]
+    assert rows[0]["session_id"] == "s1"
+
+    # 下一次從 T3 開始，只補上晚於水位的訊息，沒有漏掉也沒有重複
+    rows, _ = export([segment], since=T3, until=T4)
+    assert [row["content"] for row in rows] == ["next run"]
+
+
+def test_filter_bounds_segments_only_by_since():
+    kwargs = build_filter(T1, T3)
+    expression = kwargs["FilterExpression"]
+    values = kwargs["ExpressionAttributeValues"]
+    assert "(#ts <= :until OR contains(session_id, :segment))" in expression
+    assert "#ts > :since" in expression
+    assert values[":segment"] == SEGMENT_SUFFIX
+    assert values[":until"] == T3 and values[":since"] == T1
+
+    assert ":since" not in build_filter(None, T3)["ExpressionAttributeValues"]
+
+
+def test_plain_messages_and_undecodable_items():
+    items = [
+        {"session_id": "s1", "message_index": 5, "role": "user", "content": "hi", "timestamp": T2, "user_id": "u"},
+        {"session_id": "s1", "message_index": 6, "role": "assistant", "codec": 99, "timestamp": T2},
+    ]
+    rows, stats = export(items, since=None, until=T3)
+    assert rows == [{
+        "session_id": "s1", "message_index": 5, "role": "user", "content": "hi", "timestamp": T2, "user_id": "u",
+    }]
+    assert stats["skipped"] == 1
+
+
+def test_watermark_round_trip(tmp_path):
+    assert load_watermark(str(tmp_path)) is None
+    save_watermark(str(tmp_path), T3, rows=10, files=2)
+    assert load_watermark(str(tmp_path)) == T3
+    assert not (tmp_path / "_watermark.json.tmp").exists()
+
+
+def test_partitioned_writer_limits_open_files(tmp_path):
+    writer = PartitionedWriter(str(tmp_path), "part", "jsonl.gz", rows_per_file=100, row_group_size=10,
+                               max_open_files=2)
+    for day in ("2026-10-01", "2026-10-02", "2026-10-03", "2026-10-01"):
+        writer.write({"session_id": "s", "message_index": 0, "role": "user", "content": "x",
+                      "timestamp": f"{day}T10:00:00+08:00", "user_id": None})
+        assert len(writer.open_files) <= 2
+    writer.close()
+    # 被關閉的分區之後再寫入時開新檔
+    assert len(writer.paths) == 4
+    assert sum(path.startswith(str(tmp_path / "date=2026-10-01")) for path in writer.paths) == 2
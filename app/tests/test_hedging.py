@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+from src.services.hedging import HedgePolicy, Hedger
+
+
+def make_policy(**options) -> HedgePolicy:
+    options = {
+        "percentile": 0.9, "max_ratio": 0.5, "min_delay_ms": 50, "max_delay_ms": 1000, "min_samples": 5, **options,
+    }
+    return HedgePolicy(**options)
+
+
+def test_no_delay_until_enough_samples():
+    policy = make_policy()
+    for _ in range(4):
+        policy.observe(100)
+    assert policy.delay_ms() is None
+    policy.observe(100)
+    assert policy.delay_ms() == 100
+
+
+def test_delay_is_the_percentile_clamped_to_the_limits():
+    policy = make_policy()
+    for latency in range(10, 110, 10):
+        policy.observe(latency)
+    # 10 筆樣本的 p90 為第 10 筆
+    assert policy.delay_ms() == 100
+
+    fast = make_policy()
+    for _ in range(10):
+        fast.observe(1)
+    assert fast.delay_ms() == 50
+
+    slow = make_policy()
+    for _ in range(10):
+        slow.observe(5000)
+    assert slow.delay_ms() == 1000
+
+
+def test_credits_limit_the_hedge_rate():
+    policy = make_policy(max_ratio=0.5, max_credit=2.0)
+    assert not policy.try_acquire()
+    policy.on_primary()
+    assert not policy.try_acquire()
+    policy.on_primary()
+    assert policy.try_acquire()
+    assert not policy.try_acquire()
+
+    # credit 上限限制突發的備援請求數
+    for _ in range(100):
+        policy.on_primary()
+    assert policy.try_acquire()
+    assert policy.try_acquire()
+    assert not policy.try_acquire()
+
+
+def warmed_up_hedger(**options) -> Hedger:
+    policy = make_policy(max_ratio=1.0, **options)
+    for _ in range(5):
+        policy.observe(50)
+    return Hedger(policy, backup_client=None, backup_model_id=None, max_workers=4)
+
+
+def test_slow_primary_is_hedged_and_the_backup_wins():
+    hedger = warmed_up_hedger()
+    primary_done = threading.Event()
+
+    def primary():
+        primary_done.wait(2)
+        return "primary"
+
+    try:
+        assert hedger.run(primary, lambda: "backup") == "backup"
+    finally:
+        primary_done.set()
+
+
+def test_hedge_is_skipped_without_admission():
+    hedger = warmed_up_hedger()
+    backup_calls = []
+
+    def primary():
+        time.sleep(0.2)
+        return "primary"
+
+    assert hedger.run(primary, lambda: backup_calls.append(1), admit_backup=lambda: None) == "primary"
+    assert backup_calls == []
+
+
+def test_primary_error_is_raised_when_both_fail():
+    hedger = warmed_up_hedger()
+
+    def primary():
+        time.sleep(0.1)
+        raise ValueError("primary")
+
+    def backup():
+        raise RuntimeError("backup")
+
+    with pytest.raises(ValueError):
+        hedger.run(primary, backup)
@@ -0,0 +1,78 @@
+from src.services.history import ConverseHistory, estimate_tokens
+
+
+def chat(*pairs):
+    return [{"role": role, "content": content} for role, content in pairs]
+
+
+def texts(history: ConverseHistory):
+    return [(m["role"], [block["text"] for block in m["content"]]) for m in history.messages]
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("你好") == 2
+    assert estimate_tokens("a") == 1
+
+
+def test_sync_appends_only_new_messages():
+    messages = chat(("assistant", "welcome"), ("user", "q1"), ("assistant", "a1"))
+    history = ConverseHistory().sync(messages)
+    # 第一則必須是 user，歡迎語被略過
+    assert texts(history) == [("user", ["q1"]), ("assistant", ["a1"])]
+    assert history.source_indices == [1, 2]
+
+    first = history.messages[0]
+    messages += chat(("user", "q2"))
+    history.sync(messages)
+    assert history.messages[0] is first
+    assert texts(history)[-1] == ("user", ["q2"])
+    assert history.generation == 0
+    assert history.total_tokens == sum(history.token_estimates)
+
+
+def test_consecutive_same_role_messages_are_merged():
+    messages = chat(("user", "q1"), ("user", "q1 again"), ("assistant", "a1"))
+    history = ConverseHistory().sync(messages)
+    assert texts(history) == [("user", ["q1", "q1 again"]), ("assistant", ["a1"])]
+    # 合併後的訊息對應到第一則來源
+    assert history.source_indices == [0, 2]
+    assert history.token_estimates[0] == estimate_tokens("q1") + estimate_tokens("q1 again")
+
+
+def test_loading_earlier_messages_rebuilds():
+    tail = chat(("user", "q2"), ("assistant", "a2"))
+    history = ConverseHistory(start_index=2).sync(tail, start_index=2)
+    assert history.source_indices == [2, 3]
+    history.summary = "old"
+
+    full = chat(("user", "q1"), ("assistant", "a1")) + tail
+    history.sync(full, start_index=0)
+    assert history.generation == 1
+    assert history.start_index == 0
+    assert history.source_indices == [0, 1, 2, 3]
+    # 重建時摘要狀態一併清除，由 context window 重新載入
+    assert history.summary is None and not history.summary_loaded
+
+
+def test_replaced_session_rebuilds():
+    history = ConverseHistory().sync(chat(("user", "q1"), ("assistant", "a1"), ("user", "q2")))
+    history.sync(chat(("user", "other")))
+    assert history.generation == 1
+    assert texts(history) == [("user", ["other"])]
+
+
+def test_position_and_message_index_mapping():
+    history = ConverseHistory(start_index=10).sync(
+        chat(("assistant", "skipped"), ("user", "q1"), ("user", "q1b"), ("assistant", "a1"), ("user", "q2")),
+        start_index=10,
+    )
+    assert history.source_indices == [11, 13, 14]
+    assert history.position_of(11) == 0
+    # 落在合併訊息中間的序號對應到下一則訊息
+    assert history.position_of(12) == 1
+    assert history.position_of(14) == 2
+    assert history.position_of(99) == 3
+    assert history.message_index_at(1) == 13
+    assert history.message_index_at(3) == 15
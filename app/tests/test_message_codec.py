@@ -0,0 +1,89 @@
+import json
+import random
+import string
+
+import pytest
+
+from src.services.message_codec import (
+    CODEC_VERSION,
+    ENCODING_ZLIB,
+    MessageDecodeError,
+    decode_content,
+    decode_segment,
+    encode_content,
+    encode_segment,
+)
+
+
+def random_text(seed: int, length: int) -> str:
+    rng = random.Random(seed)
+    return "".join(rng.choice(string.ascii_letters) for _ in range(length))
+
+
+def round_trip(content: str, **options) -> str:
+    encoded = encode_content(content, **options)
+    return decode_content(encoded.attributes, lambda count: encoded.chunks[:count])
+
+
+def test_small_content_stays_a_legacy_string():
+    encoded = encode_content("hello", compress_threshold=2048, max_inline_bytes=350_000)
+    assert encoded.attributes == {"content": "hello"}
+    assert decode_content(encoded.attributes) == "hello"
+
+
+def test_large_content_is_compressed_inline():
+    content = "kubectl get pods -n observability\n" * 200
+    encoded = encode_content(content, compress_threshold=64, max_inline_bytes=350_000)
+    assert encoded.attributes["codec"] == CODEC_VERSION
+    assert encoded.attributes["encoding"] == ENCODING_ZLIB
+    assert "content" not in encoded.attributes
+    assert encoded.stored_bytes < encoded.original_bytes
+    assert decode_content(encoded.attributes) == content
+
+
+def test_oversized_content_is_chunked():
+    content = random_text(1, 20_000)
+    encoded = encode_content(content, compress_threshold=0, max_inline_bytes=1024)
+    assert encoded.attributes["chunks"] == len(encoded.chunks) > 1
+    assert all(len(chunk) <= 1024 for chunk in encoded.chunks)
+    assert round_trip(content, compress_threshold=0, max_inline_bytes=1024) == content
+
+
+def test_non_ascii_content_round_trips():
+    content = "為什麼 Pod 一直 CrashLoopBackOff？" * 300
+    assert round_trip(content, compress_threshold=16, max_inline_bytes=350_000) == content
+
+
+def test_missing_chunk_is_a_decode_error():
+    content = random_text(2, 10_000)
+    encoded = encode_content(content, compress_threshold=0, max_inline_bytes=1024)
+    with pytest.raises(MessageDecodeError):
+        decode_content(encoded.attributes, lambda count: encoded.chunks[:-1])
+    with pytest.raises(MessageDecodeError):
+        decode_content(encoded.attributes)
+
+
+def test_unknown_codec_version_is_a_decode_error():
+    with pytest.raises(MessageDecodeError):
+        decode_content({"codec": CODEC_VERSION + 1, "content": "x"})
+    with pytest.raises(MessageDecodeError):
+        decode_content({"codec": CODEC_VERSION, "encoding": "brotli", "content": "x"})
+
+
+def test_segment_round_trip():
+    messages = [{"role": "user" if i % 2 else "assistant", "content": f"message {i} " * 50} for i in range(10)]
+    encoded = encode_segment(messages, max_inline_bytes=350_000)
+    item = {**encoded.attributes, "message_index": 20, "segment_end": 30}
+    assert decode_segment(item) == messages
+
+
+def test_segment_length_mismatch_is_a_decode_error():
+    messages = [{"role": "user", "content": "only one"}]
+    encoded = encode_segment(messages, max_inline_bytes=350_000)
+    with pytest.raises(MessageDecodeError):
+        decode_segment({**encoded.attributes, "message_index": 0, "segment_end": 2})
+
+
+def test_segment_payload_is_json():
+    encoded = encode_segment([{"role": "user", "content": "hi"}], max_inline_bytes=350_000)
+    assert json.loads(decode_content(encoded.attributes)) == [{"role": "user", "content": "hi"}]
@@ -0,0 +1,100 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from src.services import model_router
+from src.services.model_router import ModelRouter, parse_model_tiers
+
+TIERS = parse_model_tiers("fast=m-fast, standard=m-standard, strong=m-strong")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(model_router.time, "monotonic", clock)
+    return clock
+
+
+def make_router(**options) -> ModelRouter:
+    return ModelRouter(TIERS, latency_budget_ms=1000, **options)
+
+
+def throttled() -> ClientError:
+    return ClientError({"Error": {"Code": "ThrottlingException"}}, "Converse")
+
+
+def test_parse_model_tiers():
+    assert [(tier.name, tier.model_id) for tier in TIERS] == [
+        ("fast", "m-fast"), ("standard", "m-standard"), ("strong", "m-strong"),
+    ]
+    with pytest.raises(ValueError):
+        ModelRouter((), latency_budget_ms=1000)
+
+
+@pytest.mark.parametrize("prompt, input_tokens, expected", [
+    ("What is a Pod?", 0, 0),
+    ("Pod 是什麼", 0, 0),
+    ("Explain how services route traffic to pods in a cluster", 0, 1),
+    ("Why is my pod in CrashLoopBackOff?", 0, 2),
+    ("```\nkubectl get pods\n```", 0, 2),
+    ("What is a Pod?", 5000, 2),
+    ("x" * 2000, 0, 2),
+])
+def test_classify(prompt, input_tokens, expected):
+    assert make_router().classify(prompt, input_tokens) == expected
+
+
+def test_classify_with_a_single_tier():
+    router = ModelRouter(TIERS[:1], latency_budget_ms=1000)
+    assert router.classify("Explain how services route traffic to pods", 0) == 0
+
+
+def test_throttled_model_is_downgraded_until_the_cooldown_ends(clock):
+    router = make_router(throttle_cooldown_seconds=30)
+    prompt = "Why is my pod in CrashLoopBackOff?"
+    assert router.choose(prompt, 0).model_id == "m-strong"
+
+    router.observe("m-strong", 0, error=throttled())
+    decision = router.choose(prompt, 0)
+    assert (decision.tier, decision.preferred_tier, decision.reason) == ("standard", "strong", "downgrade:throttled")
+
+    clock.now += 31
+    assert router.choose(prompt, 0).reason == "complexity"
+
+
+def test_slow_model_is_downgraded_only_with_enough_samples(clock):
+    router = make_router()
+    prompt = "Explain how services route traffic to pods"
+    for _ in range(4):
+        router.observe("m-standard", 5000)
+    # 樣本不足 5 筆時不降級
+    assert router.choose(prompt, 0).tier == "standard"
+
+    router.observe("m-standard", 5000)
+    decision = router.choose(prompt, 0)
+    assert (decision.tier, decision.reason) == ("fast", "downgrade:slow")
+
+    # 超出時間窗的樣本不再計入
+    clock.now += 301
+    assert router.choose(prompt, 0).tier == "standard"
+
+
+def test_other_errors_do_not_affect_routing(clock):
+    router = make_router()
+    router.observe("m-strong", 0, error=ValueError("bad request"))
+    assert router.choose("Why is my pod failing?", 0).tier == "strong"
+
+
+def test_all_degraded_keeps_the_preferred_model(clock):
+    router = make_router()
+    router.observe("m-standard", 0, error=throttled())
+    router.observe("m-fast", 0, error=throttled())
+    decision = router.choose("Explain how services route traffic to pods", 0)
+    assert (decision.tier, decision.reason) == ("standard", "all_degraded")
@@ -0,0 +1,77 @@
+from src.services.dynamodb_service import ReadThroughCache
+
+
+class Loader:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return f"value-{self.calls}"
+
+
+def test_hit_until_the_group_is_invalidated():
+    cache = ReadThroughCache("test", max_entries=10, ttl_seconds=60)
+    loader = Loader()
+    assert cache.get_or_load("user-a", "page-1", loader) == "value-1"
+    assert cache.get_or_load("user-a", "page-1", loader) == "value-1"
+    assert loader.calls == 1
+
+    cache.invalidate("user-a")
+    assert cache.get_or_load("user-a", "page-1", loader) == "value-2"
+    assert loader.calls == 2
+
+
+def test_invalidation_is_scoped_to_the_group():
+    cache = ReadThroughCache("test", max_entries=10, ttl_seconds=60)
+    loader = Loader()
+    cache.get_or_load("user-a", "page-1", loader)
+    cache.get_or_load("user-b", "page-1", loader)
+    cache.invalidate("user-a")
+    cache.get_or_load("user-b", "page-1", loader)
+    assert loader.calls == 2
+
+
+def test_write_during_a_load_is_not_masked_by_the_older_result():
+    cache = ReadThroughCache("test", max_entries=10, ttl_seconds=60)
+
+    def stale_loader():
+        # 讀取期間另一個請求寫入並失效
+        cache.invalidate("session-1")
+        return "stale"
+
+    assert cache.get_or_load("session-1", "tail", stale_loader) == "stale"
+    assert cache.get_or_load("session-1", "tail", lambda: "fresh") == "fresh"
+
+
+def test_evicted_generations_never_resurrect_old_entries():
+    cache = ReadThroughCache("test", max_entries=2, ttl_seconds=60)
+    assert cache.get_or_load("a", "k", lambda: "old") == "old"
+    cache.invalidate("a")
+    # 淘汰 "a" 的世代號：之後以 _floor 比對，失效前的快取值仍不可命中
+    cache.invalidate("b")
+    cache.invalidate("c")
+    assert cache.get_or_load("a", "k", lambda: "new") == "new"
+    assert len(cache._generations) <= 2
+
+
+def test_loader_errors_are_not_cached():
+    cache = ReadThroughCache("test", max_entries=10, ttl_seconds=60)
+
+    def failing():
+        raise RuntimeError("boom")
+
+    for _ in range(2):
+        try:
+            cache.get_or_load("a", "k", failing)
+        except RuntimeError:
+            pass
+    assert cache.get_or_load("a", "k", lambda: "ok") == "ok"
+
+
+def test_disabled_cache_always_loads():
+    cache = ReadThroughCache("test", max_entries=0, ttl_seconds=60)
+    loader = Loader()
+    cache.get_or_load("a", "k", loader)
+    cache.get_or_load("a", "k", loader)
+    assert loader.calls == 2
@@ -0,0 +1,143 @@
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from src.services import region_pool
+from src.services.circuit_breaker import CircuitOpenError
+from src.services.region_pool import RegionalClientPool, RegionHealth, failover_reason
+
+
+def client_error(code: str, status: int = 400) -> ClientError:
+    return ClientError(
+        {"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}},
+        "Converse",
+    )
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(region_pool.time, "monotonic", clock)
+    return clock
+
+
+def make_pool(*regions, **options) -> RegionalClientPool:
+    options = {"explore_ratio": 0.0, "base_cooldown_seconds": 5.0, "max_cooldown_seconds": 60.0, **options}
+    return RegionalClientPool({region: region for region in regions}, **options)
+
+
+def test_failover_reason_classifies_errors():
+    assert failover_reason(client_error("ThrottlingException", 429)) == "ThrottlingException"
+    assert failover_reason(client_error("ServiceUnavailableException", 503)) == "ServiceUnavailableException"
+    assert failover_reason(client_error("", 502)) == "502"
+    assert failover_reason(EndpointConnectionError(endpoint_url="http://x")) == "EndpointConnectionError"
+    assert failover_reason(client_error("ValidationException", 400)) is None
+    assert failover_reason(client_error("AccessDeniedException", 403)) is None
+    assert failover_reason(ValueError("bad request")) is None
+
+
+def test_score_prefers_low_latency_and_penalizes_errors():
+    assert RegionHealth("a").score() == float("inf")
+    assert RegionHealth("a", latency_ewma_ms=100).score() == 100
+    assert RegionHealth("a", latency_ewma_ms=100, error_ewma=0.5).score() == 300
+
+
+def test_latency_ewma_orders_regions(clock):
+    pool = make_pool("primary", "secondary", alpha=0.5)
+    # 沒有樣本時依設定順序
+    assert pool.ordered_regions() == ["primary", "secondary"]
+
+    pool.observe("primary", 400)
+    pool.observe("secondary", 200)
+    assert pool.ordered_regions() == ["secondary", "primary"]
+
+    pool.observe("primary", 0)
+    pool.observe("primary", 0)
+    # primary: 400 -> 200 -> 100
+    assert pool._health["primary"].latency_ewma_ms == pytest.approx(100)
+    assert pool.ordered_regions() == ["primary", "secondary"]
+
+
+def test_failures_cool_down_with_exponential_backoff(clock):
+    pool = make_pool("primary", "secondary")
+    pool.observe("primary", 100)
+    pool.observe("secondary", 300)
+
+    pool.observe("primary", 0, error="ThrottlingException")
+    assert pool._health["primary"].unhealthy_until == clock.now + 5
+    # 不健康的 region 排在最後，但仍保留作為最後手段
+    assert pool.ordered_regions() == ["secondary", "primary"]
+
+    pool.observe("primary", 0, error="ThrottlingException")
+    pool.observe("primary", 0, error="ThrottlingException")
+    assert pool._health["primary"].unhealthy_until == clock.now + 20
+    for _ in range(10):
+        pool.observe("primary", 0, error="ThrottlingException")
+    assert pool._health["primary"].unhealthy_until == clock.now + 60
+
+    clock.now += 61
+    pool.observe("primary", 100)
+    assert pool._health["primary"].consecutive_failures == 0
+    assert pool._health["primary"].healthy(clock.now)
+
+
+def test_call_fails_over_on_throttling(clock):
+    pool = make_pool("primary", "secondary")
+    tried = []
+
+    def fn(client):
+        tried.append(client)
+        if client == "primary":
+            raise client_error("ThrottlingException", 429)
+        return "ok"
+
+    assert pool.call(fn) == "ok"
+    assert tried == ["primary", "secondary"]
+    assert not pool._health["primary"].healthy(clock.now)
+    # 下一次直接從健康的 region 開始
+    tried.clear()
+    assert pool.call(fn) == "ok"
+    assert tried == ["secondary"]
+
+
+def test_call_does_not_fail_over_on_request_errors(clock):
+    pool = make_pool("primary", "secondary")
+
+    def fn(client):
+        raise client_error("ValidationException", 400)
+
+    with pytest.raises(ClientError):
+        pool.call(fn)
+    assert pool._health["primary"].healthy(clock.now)
+    assert pool._health["primary"].error_ewma == 0
+
+
+def test_open_circuit_skips_the_region_without_marking_it_unhealthy(clock):
+    pool = make_pool("primary", "secondary")
+
+    def fn(client):
+        if client == "primary":
+            raise CircuitOpenError("m@primary", 10)
+        return "ok"
+
+    assert pool.call(fn) == "ok"
+    assert pool._health["primary"].healthy(clock.now)
+
+
+def test_call_raises_the_last_error_when_every_region_fails(clock):
+    pool = make_pool("primary", "secondary")
+
+    def fn(client):
+        raise client_error("ServiceUnavailableException", 503)
+
+    with pytest.raises(ClientError):
+        pool.call(fn)
+    assert not pool._health["primary"].healthy(clock.now)
+    assert not pool._health["secondary"].healthy(clock.now)
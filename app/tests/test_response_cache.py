@@ -0,0 +1,73 @@
+from src.services import response_cache
+from src.services.response_cache import LRUCache, ResponseCache, normalize_prompt
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSharedTier:
+    def __init__(self):
+        self.items = {}
+
+    def get(self, key):
+        return self.items.get(key)
+
+    def put(self, key, value, model_id):
+        self.items[key] = value
+
+
+def test_normalize_prompt_ignores_case_whitespace_and_trailing_punctuation():
+    assert normalize_prompt("  What is   a Pod?? ") == "what is a pod"
+    assert normalize_prompt("什麼是 Pod？") == "什麼是 pod"
+
+
+def test_lru_evicts_least_recently_used_and_expired_entries(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "monotonic", clock)
+    cache = LRUCache(max_entries=2, ttl_seconds=10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    # b 最久未使用
+    assert cache.get("b") is None
+    assert len(cache) == 2
+
+    clock.now += 11
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+
+def test_key_depends_on_model_and_temperature_but_not_formatting():
+    key = ResponseCache.make_key("What is a Pod?", "m1", 0.2)
+    assert key == ResponseCache.make_key("what is a pod", "m1", 0.2)
+    assert key != ResponseCache.make_key("what is a pod", "m2", 0.2)
+    assert key != ResponseCache.make_key("what is a pod", "m1", 0.7)
+
+
+def test_only_single_turn_low_temperature_requests_are_cacheable():
+    question = [{"role": "user", "content": [{"text": "q"}]}]
+    assert ResponseCache.is_cacheable(None, 0.2, 0.3)
+    assert ResponseCache.is_cacheable(question, 0.2, 0.3)
+    assert not ResponseCache.is_cacheable(question * 3, 0.2, 0.3)
+    assert not ResponseCache.is_cacheable(None, 0.7, 0.3)
+
+
+def test_shared_tier_hit_fills_the_local_tier():
+    shared = FakeSharedTier()
+    cache = ResponseCache(max_entries=10, ttl_seconds=60, shared_tier=shared)
+    assert cache.get("k") is None
+
+    cache.put("k", "answer", "m1")
+    assert shared.items == {"k": "answer"}
+
+    # 另一個 Pod：本地層沒有，從共用層讀回後回填
+    other = ResponseCache(max_entries=10, ttl_seconds=60, shared_tier=shared)
+    assert other.get("k") == "answer"
+    shared.items.clear()
+    assert other.get("k") == "answer"
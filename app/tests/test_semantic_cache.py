@@ -0,0 +1,108 @@
+import threading
+import time
+
+import numpy as np
+
+from src.services import semantic_cache
+from src.services.semantic_cache import HashingEmbedder, SemanticCache, SemanticIndex
+
+DIM = 32
+
+
+def unit_vectors(count: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_cache(**options) -> SemanticCache:
+    options = {"threshold": 0.9, **options}
+    return SemanticCache(embedder=HashingEmbedder(256), index=SemanticIndex(256, 100), **options)
+
+
+def test_rephrased_question_hits_within_the_same_namespace():
+    cache = make_cache()
+    cache.add(cache.embed("What is a Kubernetes Pod?"), "m1", "A Pod is ...")
+    assert cache.lookup(cache.embed("what is a kubernetes pod"), "m1") == "A Pod is ..."
+    # 不同模型 / temperature 的 namespace 不會命中
+    assert cache.lookup(cache.embed("what is a kubernetes pod"), "m2") is None
+    assert cache.lookup(cache.embed("How do I scale a Deployment?"), "m1") is None
+
+
+def test_search_filters_by_namespace():
+    index = SemanticIndex(DIM, 10)
+    vectors = unit_vectors(2)
+    index.add(vectors[0], {"answer": "a"}, "ns-a")
+    index.add(vectors[1], {"answer": "b"}, "ns-b")
+    # 即使 ns-a 的向量完全相同，查詢 ns-b 只會得到 ns-b 的項目
+    slot, _ = index.search(vectors[0], "ns-b")
+    assert index.payload(slot) == {"answer": "b"}
+    assert index.search(vectors[0], "unknown") == (-1, -1.0)
+
+
+def test_full_index_evicts_the_least_recently_used_entry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now[0])
+    index = SemanticIndex(DIM, 2)
+    vectors = unit_vectors(3)
+    for i in range(2):
+        index.add(vectors[i], {"answer": i})
+        now[0] += 1
+
+    index.search(vectors[0])
+    now[0] += 1
+    slot = index.add(vectors[2], {"answer": 2})
+    assert len(index) == 2
+    # 0 剛被查詢過，淘汰的是 1
+    assert index.payload(slot) == {"answer": 2}
+    assert sorted(index.payload(s)["answer"] for s in range(2)) == [0, 2]
+
+
+def test_entries_added_while_clustering_are_assigned_after_the_swap(monkeypatch):
+    index = SemanticIndex(DIM, 200)
+    monkeypatch.setattr(index, "TRAIN_MIN", 64)
+    release = threading.Event()
+    train = index._train
+
+    def blocked_train(slots):
+        release.wait(2)
+        train(slots)
+
+    monkeypatch.setattr(index, "_train", blocked_train)
+    vectors = unit_vectors(80)
+    for i in range(64):
+        index.add(vectors[i], {"answer": i})
+    assert index._training and index._centroids is None
+
+    # 分群進行中仍可查詢（暴力搜尋）與新增
+    for i in range(64, 80):
+        index.add(vectors[i], {"answer": i}, "other")
+    slot, score = index.search(vectors[70], "other")
+    assert index.payload(slot) == {"answer": 70}
+
+    release.set()
+    deadline = time.monotonic() + 2
+    while index._training:
+        assert time.monotonic() < deadline, "clustering did not finish"
+        time.sleep(0.005)
+
+    assert index._centroids is not None
+    listed = sorted(slot for members in index._lists for slot in members)
+    assert listed == list(range(80))
+    for i in (0, 70, 79):
+        slot, score = index.search(vectors[i], "other" if i >= 64 else "")
+        assert index.payload(slot) == {"answer": i}
+        assert score > 0.99
+
+
+def test_index_is_restored_from_disk(tmp_path):
+    vectors = unit_vectors(3)
+    index = SemanticIndex(DIM, 10, path=str(tmp_path))
+    for i in range(3):
+        index.add(vectors[i], {"answer": i}, f"ns-{i % 2}")
+    index.flush()
+
+    restored = SemanticIndex(DIM, 10, path=str(tmp_path))
+    assert len(restored) == 3
+    slot, score = restored.search(vectors[2], "ns-0")
+    assert restored.payload(slot) == {"answer": 2}
+    assert restored.search(vectors[1], "ns-0")[0] != 1
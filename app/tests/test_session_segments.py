@@ -0,0 +1,112 @@
+import boto3
+import pytest
+
+from src.services.dynamodb_service import SESSION_META_INDEX, UNREADABLE_MESSAGE, ConversationService
+from src.services.message_codec import segment_partition
+
+moto = pytest.importorskip("moto")
+
+TABLE = "conversations"
+REGION = "ap-northeast-1"
+
+
+@pytest.fixture
+def service():
+    with moto.mock_aws():
+        boto3.client("dynamodb", region_name=REGION).create_table(
+            TableName=TABLE,
+            KeySchema=[
+                {"AttributeName": "session_id", "KeyType": "HASH"},
+                {"AttributeName": "message_index", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "session_id", "AttributeType": "S"},
+                {"AttributeName": "message_index", "AttributeType": "N"},
+                {"AttributeName": "session_list_pk", "AttributeType": "S"},
+                {"AttributeName": "last_active_at", "AttributeType": "S"},
+            ],
+            GlobalSecondaryIndexes=[{
+                "IndexName": "session_list_pk-last_active_at-index",
+                "KeySchema": [
+                    {"AttributeName": "session_list_pk", "KeyType": "HASH"},
+                    {"AttributeName": "last_active_at", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield ConversationService(TABLE, region=REGION)
+
+
+def chat(count: int, start: int = 0):
+    roles = ("assistant", "user")
+    return [{"role": roles[i % 2], "content": f"message {i}"} for i in range(start, start + count)]
+
+
+def stored_indices(service: ConversationService, partition: str):
+    response = service.table.query(
+        KeyConditionExpression="session_id = :pk", ExpressionAttributeValues={":pk": partition}
+    )
+    return [int(item["message_index"]) for item in response["Items"]]
+
+
+def test_compaction_packs_closed_messages_into_segments(service):
+    service.save_messages("s1", chat(10))
+    assert service.compact_session("s1", segment_size=4, keep_open=2) == 2
+
+    meta = service.get_session_meta("s1")
+    assert meta["compacted_upto"] == 8
+    assert meta["segment_manifest"] == [{"start": 0, "end": 4}, {"start": 4, "end": 8}]
+    # 原訊息已刪除，只剩 metadata 與未壓縮的尾段
+    assert stored_indices(service, "s1") == [SESSION_META_INDEX, 8, 9]
+    assert stored_indices(service, segment_partition("s1")) == [0, 4]
+
+    assert service.load_session("s1") == chat(10)
+    assert service.load_session_tail("s1", 3) == (chat(3, start=7), 7)
+    assert service.load_messages_before("s1", 6, 3) == (chat(3, start=3), 3)
+
+    # 沒有新的已結束訊息時不重複壓縮
+    assert service.compact_session("s1", segment_size=4, keep_open=2) == 0
+
+
+def test_manifest_only_advances_from_the_recorded_cutoff(service):
+    service.save_messages("s1", chat(8))
+    assert service._advance_manifest("s1", 0, 4)
+    # 其他程序已記錄同一個區段
+    assert not service._advance_manifest("s1", 0, 4)
+    assert not service._advance_manifest("s1", 8, 12)
+    assert service._advance_manifest("s1", 4, 8)
+    assert service.get_session_meta("s1")["compacted_upto"] == 8
+
+
+def test_interrupted_compaction_is_finished_by_the_next_run(service, monkeypatch):
+    service.save_messages("s1", chat(6))
+    # 區段與 metadata 已寫入，刪除原訊息前中斷
+    monkeypatch.setattr(service, "_delete_messages", lambda *args: None)
+    assert service.compact_session("s1", segment_size=4) == 1
+    monkeypatch.undo()
+    assert stored_indices(service, "s1") == [SESSION_META_INDEX, 0, 1, 2, 3, 4, 5]
+    assert service.load_session("s1") == chat(6)
+
+    # 只刪了一部分原訊息：讀到缺口時 compacted_upto 以下以區段為準
+    service.table.delete_item(Key={"session_id": "s1", "message_index": 0})
+    service.history_cache.invalidate("s1")
+    assert service.load_session("s1") == chat(6)
+
+    assert service.compact_session("s1", segment_size=4) == 0
+    assert stored_indices(service, "s1") == [SESSION_META_INDEX, 4, 5]
+
+
+def test_corrupt_segment_degrades_to_placeholders(service):
+    service.save_messages("s1", chat(10))
+    service.compact_session("s1", segment_size=4)
+    service.table.update_item(
+        Key={"session_id": segment_partition("s1"), "message_index": 0},
+        UpdateExpression="SET content_z = :garbage",
+        ExpressionAttributeValues={":garbage": b"not zlib"},
+    )
+    service.history_cache.invalidate("s1")
+
+    messages = service.load_session("s1")
+    assert messages[:4] == [{"role": "assistant", "content": UNREADABLE_MESSAGE}] * 4
+    assert messages[4:] == chat(6, start=4)
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+from src.services.single_flight import SingleFlight
+
+
+def run_in_threads(count: int, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def run(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_do_shares_one_call_between_concurrent_callers():
+    flights = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(2)
+        return "answer"
+
+    threads, results, errors = run_in_threads(5, lambda: flights.do("key", fn))
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert calls == [1]
+    assert results == ["answer"] * 5
+    assert errors == [None] * 5
+
+
+def test_do_shares_the_leader_error():
+    flights = SingleFlight("test")
+    release = threading.Event()
+
+    def fn():
+        release.wait(2)
+        raise ValueError("throttled")
+
+    threads, results, errors = run_in_threads(3, lambda: flights.do("key", fn))
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert all(isinstance(error, ValueError) for error in errors)
+
+
+def test_finished_flight_is_not_reused():
+    flights = SingleFlight("test")
+    assert flights.do("key", lambda: 1) == 1
+    assert flights.do("key", lambda: 2) == 2
+
+
+def test_stream_fans_out_every_chunk_to_late_followers():
+    flights = SingleFlight("test")
+    first_sent = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def source():
+        calls.append(1)
+        yield "Hello"
+        first_sent.set()
+        release.wait(2)
+        yield ", "
+        yield "world"
+
+    leader = flights.stream("key", source)
+    assert next(leader) == "Hello"
+    first_sent.wait(2)
+    # 後到者先收到已產生的 chunks，再接上後續的 chunks
+    follower = flights.stream("key", source)
+    release.set()
+
+    assert "Hello" + "".join(leader) == "Hello, world"
+    assert "".join(follower) == "Hello, world"
+    assert calls == [1]
+
+
+def test_stream_error_reaches_every_subscriber_after_the_chunks():
+    flights = SingleFlight("test")
+    release = threading.Event()
+
+    def source():
+        yield "partial"
+        release.wait(2)
+        raise RuntimeError("stream broke")
+
+    subscribers = [flights.stream("key", source) for _ in range(2)]
+    release.set()
+    for subscriber in subscribers:
+        received = []
+        with pytest.raises(RuntimeError):
+            for chunk in subscriber:
+                received.append(chunk)
+        assert received == ["partial"]
+
+
+def test_abandoned_subscriber_does_not_stop_the_others():
+    flights = SingleFlight("test")
+    release = threading.Event()
+
+    def source():
+        yield "a"
+        release.wait(2)
+        yield "b"
+
+    leaving = flights.stream("key", source)
+    staying = flights.stream("key", source)
+    assert next(leaving) == "a"
+    leaving.close()
+    release.set()
+    assert list(staying) == ["a", "b"]
@@ -0,0 +1,138 @@
+import threading
+
+from botocore.exceptions import ClientError
+
+from src.services.write_behind import WriteBehindQueue, build_update_kwargs
+
+KEYS = ("session_id", "message_index")
+
+
+def client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "BatchWriteItem")
+
+
+class FakeTable:
+    """只實作 WriteBehindQueue 會用到的 boto3 Table / client 方法"""
+
+    name = "conversations"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = []
+        self.puts = []
+        self.updates = []
+        # 依序套用在 batch_write_item 上：None 表示成功，"unprocessed" 表示退回全部，例外則拋出
+        self.batch_results = []
+        self.rejected_items = set()
+        self.meta = self
+        self.client = self
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        items = [request["PutRequest"]["Item"] for request in RequestItems[self.name]]
+        with self.lock:
+            result = self.batch_results.pop(0) if self.batch_results else None
+            if isinstance(result, Exception):
+                raise result
+            if result == "unprocessed":
+                return {"UnprocessedItems": RequestItems}
+            self.batches.append(items)
+        return {}
+
+    def put_item(self, Item, **kwargs):
+        if (Item["session_id"], Item["message_index"]) in self.rejected_items:
+            raise client_error("ValidationException")
+        with self.lock:
+            self.puts.append(Item)
+        return {}
+
+    def update_item(self, Key, **kwargs):
+        with self.lock:
+            self.updates.append((Key, kwargs))
+        return {}
+
+    def written(self):
+        return [item for batch in self.batches for item in batch] + self.puts
+
+
+def make_queue(table, **options):
+    options = {"linger_seconds": 0.01, "base_backoff_seconds": 0.001, "max_backoff_seconds": 0.01, **options}
+    return WriteBehindQueue(table, KEYS, **options)
+
+
+def message(session_id: str, index: int, content: str = "hi"):
+    return {"session_id": session_id, "message_index": index, "content": content}
+
+
+def test_puts_to_the_same_key_coalesce_to_the_latest_version():
+    table = FakeTable()
+    # 背景執行緒在 linger 期間收到所有版本
+    queue = make_queue(table, linger_seconds=0.2)
+    queue.put(message("s1", 1, "draft"))
+    queue.put(message("s1", 1, "final"))
+    queue.put(message("s1", 2))
+    assert [item["content"] for item in queue.pending_items("s1")] == ["final", "hi"]
+    assert queue.flush()
+    queue.close()
+
+    assert len(table.batches) == 1
+    assert sorted((item["message_index"], item["content"]) for item in table.written()) == [(1, "final"), (2, "hi")]
+    assert queue.pending_items("s1") == []
+
+
+def test_unprocessed_items_are_retried():
+    table = FakeTable()
+    table.batch_results = ["unprocessed", "unprocessed"]
+    queue = make_queue(table)
+    queue.put(message("s1", 1))
+    assert queue.flush()
+    queue.close()
+    assert [item["message_index"] for item in table.written()] == [1]
+
+
+def test_permanent_batch_failure_splits_and_drops_only_the_bad_item():
+    table = FakeTable()
+    table.batch_results = [client_error("ValidationException")]
+    table.rejected_items = {("s1", 2)}
+    queue = make_queue(table, linger_seconds=0.2)
+    for index in (1, 2, 3):
+        queue.put(message("s1", index))
+    assert queue.flush()
+    queue.close()
+
+    assert sorted(item["message_index"] for item in table.written()) == [1, 3]
+
+
+def test_retryable_failures_give_up_after_max_attempts():
+    table = FakeTable()
+    table.batch_results = [client_error("ThrottlingException")] * 3
+    queue = make_queue(table, max_attempts=3)
+    queue.put(message("s1", 1))
+    assert queue.flush()
+    queue.close()
+    assert table.written() == []
+
+
+def test_updates_merge_and_wait_for_the_session_messages():
+    table = FakeTable()
+    queue = make_queue(table, linger_seconds=0.2)
+    queue.put(message("s1", 1))
+    queue.update(("s1", -1), {"title": "old", "message_count": 1}, {"created_at": "t0"})
+    queue.update(("s1", -1), {"title": "new"}, {"created_at": "t1"})
+    assert queue.flush()
+    queue.close()
+
+    assert len(table.updates) == 1
+    key, kwargs = table.updates[0]
+    assert key == {"session_id": "s1", "message_index": -1}
+    values = set(kwargs["ExpressionAttributeValues"].values())
+    assert {"new", 1, "t0"} <= values
+    assert "old" not in values and "t1" not in values
+    # metadata 在訊息寫入之後才更新
+    assert table.batches
+
+
+def test_build_update_kwargs_prefers_set_over_defaults():
+    kwargs = build_update_kwargs({"title": "a"}, {"title": "b", "created_at": "t"})
+    assert kwargs["UpdateExpression"] == "SET #s0 = :s0, #d0 = if_not_exists(#d0, :d0)"
+    assert kwargs["ExpressionAttributeNames"] == {"#s0": "title", "#d0": "created_at"}
+    assert kwargs["ExpressionAttributeValues"] == {":s0": "a", ":d0": "t"}
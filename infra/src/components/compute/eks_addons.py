@@ -389,7 +389,9 @@ class EksAddons(pulumi.ComponentResource):
                         "dynamodb:GetItem",
                         "dynamodb:Query",
                         "dynamodb:Scan",
-                        "dynamodb:UpdateItem"
+                        "dynamodb:UpdateItem",
+                        "dynamodb:BatchWriteItem",  # write-behind 批次寫入 / 刪除會話
+                        "dynamodb:DeleteItem"
                     ],
                     "Resource": [
                         "arn:aws:dynamodb:*:*:table/ai-chatbot-conversations-*",
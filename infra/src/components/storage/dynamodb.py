@@ -16,14 +16,21 @@ class ConversationTable(pulumi.ComponentResource):
     - role: user | assistant
     - content: 消息內容
     - timestamp: ISO 8601 時間戳
-    - created_at: 會話創建時間
-    - session_title: 會話標題 (第一個用戶問題的前 50 字)
-    - user_id: 用戶標識符 (暫時固定為 "default")
+    - user_id: 用戶標識符 (驗證代理提供的 header，沒有時為 "default")
 
-    GSI: user_id-created_at-index
-    - Partition Key: user_id
-    - Sort Key: created_at (降序)
-    - 用於查詢用戶的會話列表
+    Session metadata item (message_index = -1):
+    - session_title: 會話標題 (第一個用戶問題的前 50 字)
+    - created_at / last_active_at: 會話創建與最近活動時間
+    - message_count, input_tokens, output_tokens: 隨寫入維護的統計
+    - summary / summary_upto_index: 滾動摘要
+
+    GSI: session_list_pk-last_active_at-index (sparse, write-sharded)
+    - Partition Key: session_list_pk = "{user_id}#{shard}"，shard = crc32(session_id) % SESSION_INDEX_SHARDS
+    - Sort Key: last_active_at (降序查詢)
+    - 只有 metadata item 帶 session_list_pk / last_active_at，每個會話在索引中只有一筆
+    - 同一使用者的會話分散到多個 GSI partition，寫入不會集中在單一熱 partition；
+      列表時各 shard 並行查詢後合併
+    - INCLUDE 投影側邊欄需要的欄位
     """
 
     def __init__(
@@ -67,22 +74,23 @@ class ConversationTable(pulumi.ComponentResource):
                     type="N"  # Number
                 ),
                 aws.dynamodb.TableAttributeArgs(
-                    name="user_id",
-                    type="S"  # String (用於 GSI)
+                    name="session_list_pk",
+                    type="S"  # String (用於 GSI，"{user_id}#{shard}")
                 ),
                 aws.dynamodb.TableAttributeArgs(
-                    name="created_at",
+                    name="last_active_at",
                     type="S"  # String (ISO 8601 時間戳，用於 GSI 排序)
                 ),
             ],
 
-            # 全局二級索引 (GSI) - 用於查詢用戶的會話列表
+            # 全局二級索引 (GSI) - 用於查詢用戶的會話列表（sparse：只索引會話 metadata item；partition key 分片）
             global_secondary_indexes=[
                 aws.dynamodb.TableGlobalSecondaryIndexArgs(
-                    name="user_id-created_at-index",
-                    hash_key="user_id",
-                    range_key="created_at",
-                    projection_type="ALL",  # 投影所有屬性
+                    name="session_list_pk-last_active_at-index",
+                    hash_key="session_list_pk",
+                    range_key="last_active_at",
+                    projection_type="INCLUDE",  # 只投影側邊欄需要的欄位
+                    non_key_attributes=["session_title", "created_at", "message_count"],
                 )
             ],
 